@@ -5,141 +5,119 @@ const WebSocketClient = () => {
     // Hostname for WebSocket connections
     const hostName = "localhost";
     //const hostName = "35.208.226.141";
+    // All sockets are served by one app (startall.py); voice may be redirected to its session's worker
+    const appPort = 8080;
+    const voicePortRef = useRef(appPort);
     // Refs for displaying messages
     const divVoiceRef = useRef(null);
     const divTranscriptRef = useRef(null);
     const divAnalysisRef = useRef(null);
     const websocketTranscriptRef = useRef(null);
     const websocketAnalysisRef = useRef(null);
-
-    // WebSocket state & heartbeat
-    let heartbeatTimeout;
-    const heartbeatInterval = 10000; // 10s max between heartbeats
+    // One consultation per page load; all three sockets join it
+    const sessionIdRef = useRef(crypto.randomUUID());
+    // Last delivered sequence numbers, so a reconnect resumes instead of replaying
+    const lastTranscriptSeqRef = useRef(null);
+    const lastAnalysisSeqRef = useRef(null);
+    const resumeParam = (seqRef) => (seqRef.current !== null ? `&since=${seqRef.current}` : '');
+    // Transcript variants to receive, e.g. ['English', 'Spanish'] for a doctor and a patient sharing
+    // the screen; each language is translated once per session however many viewers ask for it.
+    // Empty: whatever the uploader's translate_to asks for
+    const transcriptLanguages = [];
+    const languagesParam = transcriptLanguages.length ? `&languages=${encodeURIComponent(transcriptLanguages.join(','))}` : '';
+
+    // WebSocket state. Dead connections are found by the server's protocol-level pings, which
+    // the browser answers by itself; a socket the server drops ends up in onclose and reconnects.
     let retryCount = 0;
     const maxRetries = 10;
     let websocketVoice = null;
 
     let audioContext;
     let mediaRecorder;
+    let captureStream;
+    // Bumped whenever capture starts or stops, so a recorder or getUserMedia call from before is ignored
+    let captureGeneration = 0;
+
+    // Stops the current recorder, its microphone tracks and audio context, if there are any
+    const stopAudioCapture = () => {
+        captureGeneration++;
+        if (mediaRecorder && mediaRecorder.state !== 'inactive') {
+            mediaRecorder.stop();
+        }
+        captureStream?.getTracks().forEach((track) => track.stop());
+        audioContext?.close();
+        mediaRecorder = captureStream = audioContext = undefined;
+    };
 
+    // One capture at a time, bound to the socket it started on: a reconnect or redirect stops the
+    // previous recorder, so the server never gets two streams (or WebM chunks without their header)
     const startAudioCapture = () => {
+        stopAudioCapture();
+        const generation = captureGeneration;
+        const socket = websocketVoice;
         navigator.mediaDevices.getUserMedia({ audio: true })
             .then((stream) => {
+                if (generation !== captureGeneration || socket.readyState !== WebSocket.OPEN) {
+                    stream.getTracks().forEach((track) => track.stop());
+                    return;
+                }
+                captureStream = stream;
                 audioContext = new (window.AudioContext || window.webkitAudioContext)();
                 const input = audioContext.createMediaStreamSource(stream);
 
-                // Set the sample rate to 16,000 Hz if the default is higher
-                const targetSampleRate = 32000;
-                const originalSampleRate = audioContext.sampleRate;
-                const sampleRate = Math.min(originalSampleRate, targetSampleRate);
-
-                mediaRecorder = new MediaRecorder(stream);
+                // Send audio at the context's native rate; the server resamples it to 16 kHz once
+                const sampleRate = audioContext.sampleRate;
+
+                // Prefer compressed Opus: the server decodes MediaRecorder's WebM chunks as they arrive
+                const webm = 'audio/webm;codecs=opus';
+                const compressed = MediaRecorder.isTypeSupported(webm);
+                mediaRecorder = compressed ? new MediaRecorder(stream, { mimeType: webm }) : new MediaRecorder(stream);
+
+                // Binary protocol: one metadata frame, then raw PCM frames or WebM chunks
+                socket.send(JSON.stringify({
+                    action: 'start_stream',
+                    duration: 5, // Match the 5-second interval
+                    mode: 'c',
+                    translate_to: 'en',
+                    encoding: compressed ? 'webm' : 'pcm_s16le',
+                    sample_rate: sampleRate,
+                    stream_tokens: true
+                }));
 
                 mediaRecorder.ondataavailable = async (event) => {
+                    if (generation !== captureGeneration) {
+                        return;  // The final chunk of a stopped capture
+                    }
                     const audioBlob = event.data;
 
-                    // Convert audioBlob to WAV format with the target sample rate
-                    const wavBlob = await convertToWav(audioBlob, sampleRate);
-
-                    // Read the WAV blob as base64
-                    const reader = new FileReader();
-                    reader.onloadend = () => {
-                        const base64Audio = reader.result.split(',')[1]; // Base64-encoded WAV audio
-                        const payload = {
-                            action: 'transcribe_translate',
-                            duration: 5, // Match the 5-second interval
-                            mode: 'c',
-                            translate_to: 'en',
-                            sample_rate: sampleRate, // Include sample rate in the payload
-                            audio: base64Audio // WAV audio in base64 format
-                        };
-                        websocketVoice.send(JSON.stringify(payload));
-                    };
-                    reader.readAsDataURL(wavBlob);
+                    // WebM chunks go as-is (only the first carries the header); otherwise convert to 16-bit PCM
+                    const data = compressed ? await audioBlob.arrayBuffer() : (await convertToPcm(audioBlob)).buffer;
+                    if (generation === captureGeneration && socket.readyState === WebSocket.OPEN) {
+                        socket.send(data);
+                    }
                 };
 
-                mediaRecorder.start(5000); // Emit audio chunks every 5 seconds
+                // Small chunks keep the uplink smooth; the server cuts 5-second fragments itself
+                mediaRecorder.start(compressed ? 1000 : 5000);
             })
             .catch((error) => {
                 console.error('Error capturing audio:', error);
             });
     };
 
-    // Utility function to convert audioBlob to WAV format with a target sample rate
-    const convertToWav = async (audioBlob, targetSampleRate) => {
+    // Utility function to convert audioBlob to mono 16-bit PCM at the audio context's rate
+    const convertToPcm = async (audioBlob) => {
         const arrayBuffer = await audioBlob.arrayBuffer();
         const audioBuffer = await audioContext.decodeAudioData(arrayBuffer);
 
-        // Resample the audio if the target sample rate is lower than the original
-        const resampledBuffer = targetSampleRate < audioBuffer.sampleRate
-            ? await resampleAudioBuffer(audioBuffer, targetSampleRate)
-            : audioBuffer;
-
-        // Force mono channel by averaging all channels
-        const numChannels = 1; // Set to mono
-        const length = resampledBuffer.length * numChannels * 2 + 44; // WAV header + PCM data
-        const wavBuffer = new ArrayBuffer(length);
-        const view = new DataView(wavBuffer);
-
-        // Write WAV header
-        writeWavHeader(view, resampledBuffer, targetSampleRate, numChannels);
-
-        // Write PCM data
-        let offset = 44;
-        const channelData = resampledBuffer.getChannelData(0); // Use the first channel
+        // Use the first channel and convert to PCM 16-bit; no WAV header is needed
+        const channelData = audioBuffer.getChannelData(0);
+        const pcm = new Int16Array(channelData.length);
         for (let i = 0; i < channelData.length; i++) {
             const sample = Math.max(-1, Math.min(1, channelData[i])); // Clamp to [-1, 1]
-            view.setInt16(offset, sample < 0 ? sample * 0x8000 : sample * 0x7FFF, true); // PCM 16-bit
-            offset += 2; // 2 bytes per sample (16-bit)
-        }
-
-        return new Blob([view], { type: 'audio/wav' });
-    };
-
-    // Utility function to resample an AudioBuffer
-    const resampleAudioBuffer = async (audioBuffer, targetSampleRate) => {
-        const offlineContext = new OfflineAudioContext(
-            1, // Mono channel
-            Math.ceil(audioBuffer.duration * targetSampleRate),
-            targetSampleRate
-        );
-        const source = offlineContext.createBufferSource();
-        source.buffer = audioBuffer;
-        source.connect(offlineContext.destination);
-        source.start(0);
-        return await offlineContext.startRendering();
-    };
-
-    // Utility function to write WAV header
-    const writeWavHeader = (view, audioBuffer, sampleRate, numChannels) => {
-        const sampleRateInBytes = sampleRate * numChannels * 2; // Byte rate
-        const dataSize = audioBuffer.length * numChannels * 2; // PCM data size
-
-        // RIFF chunk descriptor
-        writeString(view, 0, 'RIFF');
-        view.setUint32(4, 36 + dataSize, true); // File size - 8 bytes
-        writeString(view, 8, 'WAVE');
-
-        // fmt sub-chunk
-        writeString(view, 12, 'fmt ');
-        view.setUint32(16, 16, true); // Sub-chunk size (16 for PCM)
-        view.setUint16(20, 1, true); // Audio format (1 for PCM)
-        view.setUint16(22, numChannels, true); // Number of channels (1 for mono)
-        view.setUint32(24, sampleRate, true); // Sample rate
-        view.setUint32(28, sampleRateInBytes, true); // Byte rate
-        view.setUint16(32, numChannels * 2, true); // Block align (numChannels * bytes per sample)
-        view.setUint16(34, 16, true); // Bits per sample (16 bits)
-
-        // data sub-chunk
-        writeString(view, 36, 'data');
-        view.setUint32(40, dataSize, true); // Data size
-    };
-
-    // Utility function to write strings to DataView
-    const writeString = (view, offset, string) => {
-        for (let i = 0; i < string.length; i++) {
-            view.setUint8(offset + i, string.charCodeAt(i));
+            pcm[i] = sample < 0 ? sample * 0x8000 : sample * 0x7FFF;
         }
+        return pcm;
     };
 
     // Utility to append a message to a div
@@ -148,15 +126,39 @@ const WebSocketClient = () => {
         p.textContent = text;
         divRef.current.appendChild(p);
         divRef.current.scrollTop = divRef.current.scrollHeight;
+        return p;
     };
 
-    // Reset heartbeat timeout when a heartbeat is received
-    const resetHeartbeatTimeout = () => {
-        clearTimeout(heartbeatTimeout);
-        heartbeatTimeout = setTimeout(() => {
-            console.warn("voice: No heartbeat recd in time. Reconnecting...");
-            websocketVoice?.close(); // force reconnect
-        }, heartbeatInterval);
+    // Streamed messages: "delta" tokens grow one line per stream, the "complete" message replaces it
+    const streamLinesRef = useRef(new Map());
+    const appendStreamDelta = (divRef, streamId, delta, prefix) => {
+        let p = streamLinesRef.current.get(streamId);
+        if (!p) {
+            p = appendToDiv(divRef, prefix);
+            streamLinesRef.current.set(streamId, p);
+        }
+        p.textContent += delta;
+        divRef.current.scrollTop = divRef.current.scrollHeight;
+    };
+    // One download link per session, updated in place as the report gains versions
+    const reportLinkRef = useRef(null);
+    const showReportLink = (divRef, report) => {
+        if (!reportLinkRef.current) {
+            const p = appendToDiv(divRef, '');
+            reportLinkRef.current = document.createElement('a');
+            p.appendChild(reportLinkRef.current);
+        }
+        reportLinkRef.current.href = `http://${hostName}:8082${report.url}`;  // Or appPort with AGENT_INPROCESS=1
+        reportLinkRef.current.textContent = `Download report (v${report.version})`;
+    };
+    const completeStream = (divRef, streamId, text) => {
+        const p = streamId && streamLinesRef.current.get(streamId);
+        if (!p) {
+            appendToDiv(divRef, text);
+            return;
+        }
+        p.textContent = text;
+        streamLinesRef.current.delete(streamId);
     };
 
     // Attempt to reconnect with exponential-ish backoff
@@ -174,53 +176,50 @@ const WebSocketClient = () => {
 
     // Setup the Voice WebSocket connection
     const connectVoiceWebSocket = () => {
-        websocketVoice = new WebSocket(`ws://${hostName}:8081/ws`);
+        websocketVoice = new WebSocket(`ws://${hostName}:${voicePortRef.current}/voice/ws?session=${sessionIdRef.current}`);
         websocketVoice.onopen = () => {
             console.log('voice: Connected');
             appendToDiv(divVoiceRef, 'Connected');
 
             // Reset retries on successful connection
             retryCount = 0;
-
-            // Start heartbeat timeout tracking
-            resetHeartbeatTimeout();
-
-            // Start audio capture
-            startAudioCapture();
         };
 
         websocketVoice.onmessage = (event) => {
             //console.log("***HERE websocketVoice***", event);
             try {
-                // Handle heartbeat separately
-                if (event && event.data === "heartbeat") {
-                    console.log('voice: heartbeat');
-                    resetHeartbeatTimeout();
-                    return;
-                }
-
-                // Normal message handling
                 const message = JSON.parse(event.data);
                 //console.log('Received from Voice WebSocket:[', message, ']');
-                if (message !== "heartbeat") {
-                    let strMsg = JSON.stringify(message, null, 2);
-                    appendToDiv(divVoiceRef, `Recd: ${strMsg}`);
+                if (message.status === 'redirect') {
+                    // Another worker owns this session; onclose reconnects to its port
+                    voicePortRef.current = message.port;
+                    return;
+                }
+                if (message.status === 'connected') {
+                    // Start audio capture once the session's worker has accepted us
+                    startAudioCapture();
                 }
+                let strMsg = JSON.stringify(message, null, 2);
+                appendToDiv(divVoiceRef, `Recd: ${strMsg}`);
             } catch (e) {
                 console.error('voice: Error parsing message:', e);
             }
         };
 
-        websocketVoice.onclose = () => {
+        websocketVoice.onclose = (event) => {
+            stopAudioCapture();  // Restarted once the next connection is accepted
+            if (event.code === 4307) {
+                connectVoiceWebSocket();
+                return;
+            }
             console.warn('voice: closed');
             appendToDiv(divVoiceRef,  `Disconnected: ${event.code}, ${event.reason}`);
-            clearTimeout(heartbeatTimeout);
             attemptReconnect();
         };
 
         websocketVoice.onerror = (error) => {
             console.error('voice: error:', error);
-            appendToDiv(divVoiceRef, `Error: ${error}, ${event.code}, ${event.reason}`);
+            appendToDiv(divVoiceRef, `Error: ${error}`);
             websocketVoice.close();
         };
     }; // end of connectVoiceWebSocket
@@ -255,25 +254,26 @@ const WebSocketClient = () => {
 
     // Setup the Transcript WebSocket connection
     const connectTranscriptWebSocket = () => {
-        websocketTranscriptRef.current = new WebSocket(`ws://${hostName}:6081/ws`);
+        websocketTranscriptRef.current = new WebSocket(`ws://${hostName}:${appPort}/transcribed/ws?session=${sessionIdRef.current}${languagesParam}${resumeParam(lastTranscriptSeqRef)}`);
         const websocketTranscript = websocketTranscriptRef.current;
-        //let websocketTranscript = new WebSocket(`ws://${hostName}:6081/ws`);
+        //let websocketTranscript = new WebSocket(`ws://${hostName}:${appPort}/transcribed/ws?session=${sessionIdRef.current}`);
         websocketTranscript.onopen = () => appendToDiv(divTranscriptRef, 'Connected');
         websocketTranscript.onmessage = (event) => {
             console.log("[DBG]useEffect -> [websocketTranscript] event:", event);
-            if (event.data !== "heartbeat") {
-                try {
-                    const message = JSON.parse(event.data);
-                    let strMsg = JSON.stringify(message, null, 2);
-                    appendToDiv(divTranscriptRef, `Received: ${JSON.parse(strMsg).translation_output}`);
-                } catch (error) {
-                    console.error("transcript: Error parsing msg:", error);
+            try {
+                const message = JSON.parse(event.data);
+                if (message.seq) lastTranscriptSeqRef.current = message.seq;
+                if (message.type === 'delta') {
+                    appendStreamDelta(divTranscriptRef, message.stream, message.delta, 'Received: ');
+                } else {
+                    const language = transcriptLanguages.length > 1 ? `[${message.language}] ` : '';
+                    completeStream(divTranscriptRef, message.stream, `Received: ${message.partial ? '(partial) ' : ''}${language}${message.translation_output}`);
                 }
-            } else {
-                console.log('[DBG]useEffect -> [websocketTranscript]transcript:heartbeat');
+            } catch (error) {
+                console.error("transcript: Error parsing msg:", error);
             }
         };
-        websocketTranscript.onclose = () => {
+        websocketTranscript.onclose = (event) => {
             console.warn('transcript: closed');
             appendToDiv(divTranscriptRef, `Disconnected: ${event.code}, ${event.reason}`);
             attemptReconnectTranscript();
@@ -287,25 +287,28 @@ const WebSocketClient = () => {
 
     // Setup the Analysis WebSocket connection
     const connectAnalysisWebSocket = () => {
-        websocketAnalysisRef.current = new WebSocket(`ws://${hostName}:7081/ws`);
+        websocketAnalysisRef.current = new WebSocket(`ws://${hostName}:${appPort}/modelresp/ws?session=${sessionIdRef.current}${resumeParam(lastAnalysisSeqRef)}`);
         const websocketAnalysis = websocketAnalysisRef.current;    
-        //let websocketAnalysis = new WebSocket(`ws://${hostName}:7081/ws`);
+        //let websocketAnalysis = new WebSocket(`ws://${hostName}:${appPort}/modelresp/ws?session=${sessionIdRef.current}`);
         websocketAnalysis.onopen = () => appendToDiv(divAnalysisRef, 'Connected');
         websocketAnalysis.onmessage = (event) => {
             try {
                 console.log("[DBG]useEffect -> [websocketAnalysis] modelresp, event:", event);
-                if (event.data !== "heartbeat") {
-                    const message = JSON.parse(event.data);
-                    console.log('[DBG]useEffect ->Recd from Analysis ws:', message.diagnosis_summary);
-                    appendToDiv(divAnalysisRef, `Diagnosis summary: ${message.diagnosis_summary}`);
+                const message = JSON.parse(event.data);
+                if (message.seq) lastAnalysisSeqRef.current = message.seq;
+                if (message.type === 'delta') {
+                    appendStreamDelta(divAnalysisRef, message.stream, message.delta, 'Diagnosis summary (streaming): ');
                 } else {
-                    console.log('modelresp: heartbeat');
+                    const summary = message.model_resp?.diagnosis_summary ?? message.model_resp;
+                    console.log('[DBG]useEffect ->Recd from Analysis ws:', summary);
+                    completeStream(divAnalysisRef, message.stream, `Diagnosis summary: ${JSON.stringify(summary)}`);
+                    if (message.model_resp?.report) showReportLink(divAnalysisRef, message.model_resp.report);
                 }
             } catch (e) {
                 console.error('analysis: Error parsing msg:', e);
             }
         };
-        websocketAnalysis.onclose = () => {
+        websocketAnalysis.onclose = (event) => {
             console.warn('analysis: closed');
             appendToDiv(divAnalysisRef, `Disconnected: ${event.code}, ${event.reason}`);
             attemptReconnectAnalysis();
@@ -359,13 +362,13 @@ const WebSocketClient = () => {
 
         // Clean up on unmount
         return () => {
+            stopAudioCapture();
             websocketVoice?.close();
             websocketTranscriptRef.current?.close();
             websocketAnalysisRef.current?.close();
             // websocketTranscript.close();
             // websocketAnalysis.close();if (websocketTranscriptRef.current?.readyState !== WebSocket.OPEN) {
             //if (websocketTranscriptRef.current?.readyState !== WebSocket.OPEN) {
-                clearTimeout(heartbeatTimeout);
                 clearInterval(checkWebSocketConnections);
             //}
         };
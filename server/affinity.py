@@ -0,0 +1,32 @@
+# Session affinity across worker processes: every session is owned by one worker.
+#
+# The supervisor in startall.py sets these for each worker it starts. Worker i serves the shared
+# port and its own port WORKER_PORT_BASE + i, so a client can be redirected to its session's owner.
+import os
+import uuid
+import zlib
+
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_PORT_BASE = int(os.getenv("WORKER_PORT_BASE", "0"))
+REDIRECT_CLOSE_CODE = 4307  # WebSocket close code after a {"status": "redirect", "port": ...} message
+
+
+def owner(session_id) -> int:
+    return zlib.crc32(session_id.encode()) % WORKER_COUNT
+
+
+def is_local(session_id) -> bool:
+    return WORKER_COUNT <= 1 or owner(session_id) == WORKER_INDEX
+
+
+def owner_port(session_id) -> int:
+    return WORKER_PORT_BASE + owner(session_id)
+
+
+def new_local_session_id() -> str:
+    """A fresh session ID owned by this worker, so new sessions never need a redirect."""
+    while True:
+        session_id = uuid.uuid4().hex
+        if is_local(session_id):
+            return session_id
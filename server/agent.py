@@ -1,17 +1,29 @@
 import os
-import base64
-from io import BytesIO
-from docx import Document
+import json
+import uuid
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from dotenv import load_dotenv  
 from pydantic import BaseModel
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from openai import OpenAI
 from objects import PatientInput
+from reports import get_report, iter_chunks
+import metrics
+import tracing
+from logconfig import configure_logging
 from crewai import Agent, Task, Crew
 from langchain_openai import ChatOpenAI
 from fastapi.middleware.cors import CORSMiddleware
-from crewai_tools import ScrapeWebsiteTool, SerperDevTool
 
 load_dotenv()
+configure_logging()
+log = logging.getLogger(__name__)
 app = FastAPI()
 
 app.add_middleware(
@@ -26,95 +38,332 @@ app.add_middleware(
 # os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 # os.environ["SERPER_API_KEY"] = os.getenv("SERPER_API_KEY")
 
-os.environ["OPENAI_API_KEY"] = ""
-os.environ["SERPER_API_KEY"] = ""
+os.environ.setdefault("OPENAI_API_KEY", "")
 
-# Tools and LLM
-search_tool = SerperDevTool()
-scrape_tool = ScrapeWebsiteTool()
+CREW_POOL_SIZE = int(os.getenv("CREW_POOL_SIZE", "4"))  # Concurrent /diagnose requests
+DIARIZE_MODEL = os.getenv("DIARIZE_MODEL", "gpt-4o-mini")  # Must support JSON-schema output
+DIARIZE_CONTEXT_PAIRS = int(os.getenv("DIARIZE_CONTEXT_PAIRS", "6"))  # Labelled pairs sent back as context
+DIARIZE_CONTEXT_CHARS = int(os.getenv("DIARIZE_CONTEXT_CHARS", "1500"))  # Upper bound on that context
+DIARIZE_MAX_SESSIONS = int(os.getenv("DIARIZE_MAX_SESSIONS", "100"))  # Dialogues kept, least recently used dropped
+DIARIZE_SEEN_FRAGMENTS = int(os.getenv("DIARIZE_SEEN_FRAGMENTS", "1000"))  # Fragment IDs remembered per dialogue to skip replays
+DIARIZE_STREAM_THREADS = int(os.getenv("DIARIZE_STREAM_THREADS", "8"))  # Concurrent /diarize/stream labellings; the rest queue
 
+# LLM
 llm = ChatOpenAI(
     model="gpt-3.5-turbo-16k",
     temperature=0.1,
     max_tokens=3000
 )
 
-# Agents and Tasks
-role_designator = Agent(
-    role="Role Designator",
-    goal="Convert an undifferentiated transcript of a voice conversation between a doctor and a patient into structured chronological dialogue fragments, attributing each line to either the doctor or the patient.",
-    backstory=(
-        "Trained on thousands of hours of clinical conversations, this agent is a specialist in identifying speaker roles "
-        "in healthcare dialogues. With expertise in medical linguistics, pragmatic cues, and contextual reasoning, "
-        "it discerns subtle distinctions in speech—whether it's a physician delivering a diagnosis, a nurse asking clarifying questions, "
-        "or a patient expressing symptoms or concerns. Its primary mission is to ensure accurate role attribution, "
-        "serving as the foundation for high-precision downstream tasks like summarization, speech translation, "
-        "medical charting, and intelligent response generation in clinical settings."
-    ),
-    verbose=True,
-    allow_delegation=False,
-    tools=[search_tool, scrape_tool],
-    llm=llm
-)
+# Agents and Tasks. A Crew holds per-run state, so each concurrent request needs its own.
+def build_crew() -> Crew:
+    role_designator = Agent(
+        role="Role Designator",
+        goal="Convert an undifferentiated transcript of a voice conversation between a doctor and a patient into structured chronological dialogue fragments, attributing each line to either the doctor or the patient.",
+        backstory=(
+            "Trained on thousands of hours of clinical conversations, this agent is a specialist in identifying speaker roles "
+            "in healthcare dialogues. With expertise in medical linguistics, pragmatic cues, and contextual reasoning, "
+            "it discerns subtle distinctions in speech—whether it's a physician delivering a diagnosis, a nurse asking clarifying questions, "
+            "or a patient expressing symptoms or concerns. Its primary mission is to ensure accurate role attribution, "
+            "serving as the foundation for high-precision downstream tasks like summarization, speech translation, "
+            "medical charting, and intelligent response generation in clinical settings."
+        ),
+        verbose=False,
+        allow_delegation=False,
+        tools=[],  # Labelling speakers is pure text work; web tools only add tool-calling round trips
+        llm=llm
+    )
 
-role_designator_task = Task(
-    description=(
-        "1. Process a raw voice transcript containing undifferentiated speech from both a doctor and a patient. Transcript is as follows: ({conversation}).\n"
-        "2. Accurately differentiate and label the speech fragments as either 'doctor' or 'patient' based on context and language cues.\n"
-        "3. Segment the transcript chronologically into a JSON array, where each element contains one fragment of speech from the doctor and one from the patient, paired together in the order they occurred.\n"
-        "4. Do not return any intermediate steps or explanations, only the final JSON array.\n"
-        "Conversation Input:${inputs['conversation']}\n"
-    ),
-    expected_output=(
-        "A JSON array in the following format, with each element representing a chronological pair of dialogue fragments from the doctor and the patient:\n"
-        "[{'doctor': 'doctor speech first fragment','patient': 'patient speech first fragment'},{'doctor': 'doctor speech next fragment', 'patient': 'patient speech next fragment'}]\n"
-    ),
-    agent=role_designator
-)
+    role_designator_task = Task(
+        description=(
+            "1. Process a raw voice transcript containing undifferentiated speech from both a doctor and a patient. Transcript is as follows: ({conversation}).\n"
+            "2. Accurately differentiate and label the speech fragments as either 'doctor' or 'patient' based on context and language cues.\n"
+            "3. Segment the transcript chronologically into a JSON array, where each element contains one fragment of speech from the doctor and one from the patient, paired together in the order they occurred.\n"
+            "4. Do not return any intermediate steps or explanations, only the final JSON array.\n"
+            "Conversation Input:${inputs['conversation']}\n"
+        ),
+        expected_output=(
+            "A JSON array in the following format, with each element representing a chronological pair of dialogue fragments from the doctor and the patient:\n"
+            "[{'doctor': 'doctor speech first fragment','patient': 'patient speech first fragment'},{'doctor': 'doctor speech next fragment', 'patient': 'patient speech next fragment'}]\n"
+        ),
+        agent=role_designator
+    )
 
+    crew = Crew(
+        agents=[role_designator],
+        tasks=[role_designator_task],
+        verbose=False
+    )
+    return crew
+
+
+class CrewPool:
+    """Bounded pool of reusable Crew instances, built on demand up to `size`."""
+    def __init__(self, size=CREW_POOL_SIZE):
+        self.size = max(1, size)
+        self._idle: queue.Queue[Crew] = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrows a crew, building a new one if the pool isn't full yet."""
+        try:
+            crew = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._created < self.size
+                if grow:
+                    self._created += 1
+            if grow:
+                try:
+                    crew = build_crew()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                crew = self._idle.get(timeout=timeout)
+        try:
+            yield crew
+        finally:
+            self._idle.put(crew)
+
+
+crew_pool = CrewPool()
+
+
+# Fast path: one chat completion with JSON-schema output instead of a CrewAI agent loop
+_client = None
+
+
+def get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        _client = OpenAI()
+    return _client
+
+
+DIARIZE_SCHEMA = {
+    "name": "dialogue",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "fragments": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "doctor": {"type": "string"},
+                        "patient": {"type": "string"},
+                    },
+                    "required": ["doctor", "patient"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["fragments"],
+        "additionalProperties": False,
+    },
+}
+
+
+def diarize(conversation, context=None, on_token=None):
+    """Labels a transcript. With `context` (pairs already labelled), only the new text is labelled.
+
+    With `on_token`, the completion is streamed and each token is passed to it as it arrives.
+    """
+    if context:
+        user = (
+            "Dialogue so far, already labelled (most recent last). Do not repeat it:\n"
+            f"{json.dumps(context)}\n\n"
+            f"New transcript that continues it:\n{conversation}"
+        )
+    else:
+        user = conversation
+    response = get_client().chat.completions.create(
+        model=DIARIZE_MODEL,
+        messages=[
+            {"role": "system", "content": (
+                "You label speaker roles in transcripts of doctor-patient consultations. "
+                "Split the transcript chronologically into pairs of what the doctor said and what "
+                "the patient said next. Use an empty string when one side said nothing."
+            )},
+            {"role": "user", "content": user},
+        ],
+        response_format={"type": "json_schema", "json_schema": DIARIZE_SCHEMA},
+        temperature=0.1,
+        stream=on_token is not None,
+    )
+    if on_token is None:
+        return json.loads(response.choices[0].message.content)["fragments"]
+    content = []
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            content.append(chunk.choices[0].delta.content)
+            on_token(content[-1])
+    return json.loads("".join(content))["fragments"]
+
+
+class Dialogue:
+    """The recent labelled dialogue of one session, so each call only has to label the new transcript delta.
+
+    Only the pairs the context window can use and the last `max_fragment_ids` fragment IDs are
+    kept, so a long consultation holds no more than a short one.
+    """
+    def __init__(self, max_pairs=DIARIZE_CONTEXT_PAIRS, max_fragment_ids=DIARIZE_SEEN_FRAGMENTS):
+        self.pairs = deque(maxlen=max(max_pairs, 0))  # Only the context window is kept
+        self.labelled = 0  # Pairs labelled over the whole dialogue
+        # Pipeline fragments already labelled, oldest first; a replayed one is skipped
+        self.fragment_ids: OrderedDict[str, None] = OrderedDict()
+        self.max_fragment_ids = max_fragment_ids
+        self.lock = threading.Lock()  # Deltas of one session are labelled one at a time, in order
+
+    def context(self, max_pairs=DIARIZE_CONTEXT_PAIRS, max_chars=DIARIZE_CONTEXT_CHARS):
+        """The most recent pairs, trimmed so the prompt stays the same size as the dialogue grows."""
+        recent = list(self.pairs)[-max_pairs:] if max_pairs > 0 else []
+        while recent and len(json.dumps(recent)) > max_chars:
+            recent = recent[1:]
+        return recent
+
+    def add(self, pairs, fragment_id=None):
+        self.pairs.extend(pairs)
+        self.labelled += len(pairs)
+        if fragment_id is not None:
+            self.fragment_ids[fragment_id] = None
+            while len(self.fragment_ids) > self.max_fragment_ids:
+                self.fragment_ids.popitem(last=False)
 
-crew = Crew(
-    agents=[role_designator],
-    tasks=[role_designator_task],
-    verbose=True     
-)
 
+_dialogues: OrderedDict[str, Dialogue] = OrderedDict()
+_dialogues_lock = threading.Lock()
 
-# DOCX generation
-def generate_docx(result):
-    doc = Document()
-    doc.add_heading('Healthcare Diagnosis and Treatment Recommendations', 0)
-    result = " ".join(str(item) for item in result)
-    doc.add_paragraph(result)
-    bio = BytesIO()
-    doc.save(bio)
-    bio.seek(0)
-    return bio
 
+def get_dialogue(session_id) -> Dialogue:
+    with _dialogues_lock:
+        dialogue = _dialogues.get(session_id)
+        if dialogue is None:
+            dialogue = _dialogues[session_id] = Dialogue()
+            while len(_dialogues) > DIARIZE_MAX_SESSIONS:
+                _dialogues.popitem(last=False)
+        _dialogues.move_to_end(session_id)
+        return dialogue
 
+
+def diarize_incremental(session_id, delta, on_token=None, fragment_id=None):
+    """Labels a session's new transcript against a bounded window of its dialogue; returns only the new pairs."""
+    dialogue = get_dialogue(session_id)
+    with dialogue.lock:
+        if fragment_id is not None and fragment_id in dialogue.fragment_ids:
+            log.info("diarize: fragment %s of %s is already labelled", fragment_id, session_id)
+            return []
+        with tracing.span("diarize", bytes=len(delta.encode()), pairs=dialogue.labelled):
+            new_pairs = diarize(delta, dialogue.context(), on_token)
+        dialogue.add(new_pairs, fragment_id)
+    return new_pairs
+
+
+# Records new results in the report and returns a small reference to it; the DOCX itself is
+# only rendered when GET /report/{report_id} is called
+def report_reference(report_id, entries):
+    report = get_report(report_id)
+    version = report.add(entries) if entries else report.version
+    return {"url": f"/report/{report_id}", "version": version}
+
+
+# Callers pass their trace in a traceparent header (agent_call.py), so these spans join it
 @app.post("/diagnose")
-def get_diagnosis(data: PatientInput):
-    print("[/diagnose]Received data:", data)
-    result = None
+def get_diagnosis(data: PatientInput, traceparent: str | None = Header(default=None)):
+    log.debug("[/diagnose] Received data: %s", data)
     sample_data = data.symptoms
     
     #sample_data = "How are you feeling today? I've had a persistent cough and mild fever. Any shortness of breath or chest pain? No, just fatigue. Sounds viral, but we'll run some tests to be sure. Thank you, doctor."
-    try:
-        print("Calling crew.kickoff with data - sample_data:", sample_data)
-        #result = crew.kickoff(inputs={"symptoms": data.symptoms, "medical_history": data.medical_history})
-        #result = crew.kickoff(inputs={"symptoms": sample_data, "medical_history": data.medical_history})
-        result = crew.kickoff(inputs={"conversation": sample_data, "medical_history": data.medical_history})
-        print("Crew kickoff result:", result)
-        docx_file = generate_docx(result)
-        docx_bytes = docx_file.read()
-    except Exception as e:
-        print("Error during crew.kickoff:", e)
-        docx_file = generate_docx("ERROR")
-        docx_bytes = docx_file.read()
-    finally:
-        print("Crew kickoff finally.")
-        encoded_doc = base64.b64encode(docx_bytes).decode('utf-8')
-        return {
-            "diagnosis_summary": result,
-            "docx_base64": encoded_doc
-        }
\ No newline at end of file
+    log.debug("Calling crew.kickoff with data - sample_data: %s", sample_data)
+    #result = crew.kickoff(inputs={"symptoms": data.symptoms, "medical_history": data.medical_history})
+    #result = crew.kickoff(inputs={"symptoms": sample_data, "medical_history": data.medical_history})
+    # A failed kickoff raises, so the caller gets a 500 rather than an empty diagnosis
+    with tracing.continue_trace(traceparent), crew_pool.acquire() as crew:
+        with tracing.span("crew_kickoff", bytes=len(sample_data.encode())):
+            result = crew.kickoff(inputs={"conversation": sample_data, "medical_history": data.medical_history})
+    log.debug("Crew kickoff result: %s", result)
+    return {
+        "diagnosis_summary": result,
+        "report": report_reference(data.session_id or uuid.uuid4().hex, [str(result)] if result else [])
+    }
+
+
+# Raises if labelling fails, so /diarize answers 500 and the pipeline retries the fragment
+def run_diarization(data: PatientInput, on_token=None):
+    if data.session_id:
+        result = diarize_incremental(data.session_id, data.symptoms, on_token, data.fragment_id)
+    else:
+        result = diarize(data.symptoms, on_token=on_token)
+    return {
+        "diagnosis_summary": result,
+        "report": report_reference(data.session_id or uuid.uuid4().hex, result or [])
+    }
+
+
+@app.post("/diarize")
+def get_diarization(data: PatientInput, traceparent: str | None = Header(default=None)):
+    log.debug("[/diarize] Received data: %s", data)
+    with tracing.continue_trace(traceparent):
+        return run_diarization(data)
+
+
+stream_executor = ThreadPoolExecutor(max_workers=DIARIZE_STREAM_THREADS, thread_name_prefix="diarize-stream")
+
+
+# Same as /diarize, streamed as NDJSON: {"delta": ...} lines while tokens arrive, then the
+# /diarize response with "complete": true, or {"error": ..., "complete": true} if labelling failed
+@app.post("/diarize/stream")
+def stream_diarization(data: PatientInput, traceparent: str | None = Header(default=None)):
+    log.debug("[/diarize/stream] Received data: %s", data)
+    tokens = queue.Queue()
+
+    # Always ends with a dict, so lines() never waits on a labelling that is gone
+    def run():
+        try:
+            with tracing.continue_trace(traceparent):
+                result = {"complete": True, **run_diarization(data, on_token=tokens.put)}
+        except Exception as e:
+            log.exception("[/diarize/stream] labelling failed: %s", e)
+            result = {"complete": True, "error": f"{type(e).__name__}: {e}"}
+        tokens.put(result)
+
+    stream_executor.submit(run)
+
+    def lines():
+        while True:
+            item = tokens.get()
+            if isinstance(item, dict):
+                yield json.dumps(item) + "\n"
+                return
+            yield json.dumps({"delta": item}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# Streams a session's report as DOCX, rendering only what was added since the last download
+@app.get("/report/{report_id}")
+def download_report(report_id: str):
+    report = get_report(report_id, create=False)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Unknown report")
+    version, data = report.render()
+    return StreamingResponse(
+        iter_chunks(data),
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        headers={
+            "Content-Disposition": f'attachment; filename="report-{report_id}-v{version}.docx"',
+            "Content-Length": str(len(data)),
+            "X-Report-Version": str(version),
+        },
+    )
+
+
+# Span histograms (diarize, crew_kickoff) in the Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
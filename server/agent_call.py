@@ -1,45 +1,116 @@
 # Handles asynchronous calls to the agent API.
+import os
 import json
-import requests
+import httpx
+import asyncio
+import logging
+import tracing
 from datetime import datetime
-from pydantic import BaseModel
-from objects import ModelResp, modelresps, PatientInput
+from executors import run_io
+from objects import ModelResp, PatientInput
+from sessions import session_manager
+from streaming import DeltaWriter, STREAM_TOKENS
 
-agentUrl = "http://localhost:8082/diagnose"
-agent_call_running = False  # Flag to track if agentCall is running
-result = None
+# /diarize is the single-call fast path; point at /diagnose to run the full CrewAI agent
+agentUrl = os.getenv("AGENT_URL", "http://localhost:8082/diarize")
+agentStreamUrl = os.getenv("AGENT_STREAM_URL", "http://localhost:8082/diarize/stream")  # Used with STREAM_TOKENS=1
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "120"))
+AGENT_INPROCESS = os.getenv("AGENT_INPROCESS", "0") == "1"  # Run the agent's /diarize path in this process, no HTTP hop
 
-async def agentCall_async(transcribed_text):
-    print("agentCall_async started")
+log = logging.getLogger(__name__)
 
-    global agent_call_running
-    if agent_call_running:
-        print("agentCall already running. Skipping")   
-        return
+# Pooled client so consecutive calls reuse keep-alive connections to the agent
+_client = None
 
-    agent_call_running = True
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(AGENT_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+# Streams the agent's reply, forwarding tokens to the session's modelresp subscribers as they arrive.
+# Returns the complete response and the stream ID its tokens were sent under.
+async def stream_agent_reply(payload, session, headers):
+    writer = DeltaWriter(session.modelresps, session.session_id, "agent_stream")
+    result = None
     try:
-        # print("agentCall:")
-        # print(transcribed_text)
-        print("before patient input")
-        payload = PatientInput(
-            gender="Unknown",
-            age=0,
-            symptoms=transcribed_text,
-            medical_history=transcribed_text)
-        
-        response = requests.post(agentUrl, json=payload.dict())
-        result = response.json()
-        if response.status_code == 200:
-            print("Modelquery successful")
-        else:
-           print(f"Modelquery failed: {response.status_code}")
-            
-        # print("Result:", result)
-    except Exception as e:
-        print(f"Exception: {e}")
-        result = (e).json()
+        async with get_client().stream("POST", agentStreamUrl, json=payload.dict(), headers=headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if "delta" in message:
+                    writer.write(message["delta"])
+                elif "error" in message:
+                    raise RuntimeError(f"agent stream failed: {message['error']}")
+                else:
+                    result = message
     finally:
-        agent_call_running = False
-        modelresps.append(ModelResp(datetime.now(), result))
-        print("after modelresps append: ", len(modelresps))
+        writer.close(result is not None)
+    return result, writer.stream_id
+
+
+# Runs the agent's diarization in this process on the I/O thread pool. Streamed tokens are
+# handed back to the event loop as they arrive.
+async def call_agent_inprocess(payload, session, stream):
+    import agent  # Loads CrewAI and the OpenAI client, so only when the in-process agent is used
+    if not stream or session is None:
+        return await run_io(agent.run_diarization, payload), None
+    writer = DeltaWriter(session.modelresps, session.session_id, "agent_stream")
+    loop = asyncio.get_running_loop()
+    result = None
+    try:
+        result = await run_io(agent.run_diarization, payload, lambda token: loop.call_soon_threadsafe(writer.write, token))
+    finally:
+        writer.close(result is not None)
+    return result, writer.stream_id
+
+
+# Raises when the agent fails or answers with an HTTP error, so the pipeline retries the fragment
+# (and fails it in the journal once the retries are used up); only replies reach the subscribers.
+async def agentCall_async(transcribed_text, session_id=None, stream=STREAM_TOKENS, fragment_id=None):
+    log.debug("agentCall_async started")
+    # Only the new text is sent; the agent keeps the session's dialogue for context
+    payload = PatientInput(
+        gender="Unknown",
+        age=0,
+        symptoms=transcribed_text,
+        medical_history="",
+        session_id=session_id,
+        fragment_id=fragment_id)
+
+    session = session_manager.get(session_id)
+    with tracing.span("agent_call", inprocess=AGENT_INPROCESS, bytes=len(transcribed_text.encode())):
+        # The agent's own spans join this trace
+        headers = {"traceparent": tracing.traceparent_header()} if tracing.current_trace_id() else {}
+        if AGENT_INPROCESS:
+            result, stream_id = await call_agent_inprocess(payload, session, stream)
+        elif stream and session is not None:
+            result, stream_id = await stream_agent_reply(payload, session, headers)
+            if result is None:
+                raise RuntimeError("agent stream ended without a result")
+        else:
+            response = await get_client().post(agentUrl, json=payload.dict(), headers=headers)
+            response.raise_for_status()
+            result, stream_id = response.json(), None
+    log.debug("Modelquery successful")
+
+    session = session_manager.get(session_id)
+    if session is not None:
+        session.modelresps.append(ModelResp(datetime.now(), result, session_id, stream_id, fragment_id))
+        log.debug("after modelresps append: %s %d", session_id, len(session.modelresps))
+    else:
+        log.warning("agentCall_async: session %s is gone, dropping response", session_id)
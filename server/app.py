@@ -0,0 +1,95 @@
+# Single ASGI app serving the voice, transcribed and modelresp WebSockets, plus the pipeline workers.
+#
+#   /voice/ws, /transcribed/ws, /modelresp/ws   (and /voice/stats etc.)
+#
+# With AGENT_INPROCESS=1 the agent's routes (/diarize, /report/{id}, ...) are served here too.
+# Run it with startall.py, which can start several workers; see affinity.py and broker.py.
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import RedirectResponse, PlainTextResponse
+from fastapi.middleware.cors import CORSMiddleware
+import affinity
+import voice
+import transcribed
+import modelresp
+from broker import get_broker
+from tasks import run_fragment_workers, replay_journal
+from metrics import run_metrics_reporter, run_loop_lag_monitor, render_prometheus
+from logconfig import configure_logging
+from whisper_models import preload_models, DEFAULT_POOL_SIZE
+from executors import shutdown as shutdown_executors
+from inference import inference_pool
+from journal import journal
+from agent_call import AGENT_INPROCESS, close_client
+from sessions import session_manager
+
+configure_logging()
+log = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    log.info("app: starting worker %d/%d", affinity.WORKER_INDEX + 1, affinity.WORKER_COUNT)
+    await session_manager.attach_broker(get_broker())
+    if os.getenv("WHISPER_PRELOAD", "0") == "1":
+        # Warm the local model before accepting audio so the first fragment isn't slow
+        await asyncio.to_thread(preload_models, count=DEFAULT_POOL_SIZE)
+        inference_pool.start()
+    background = [
+        asyncio.create_task(coro) for coro in (
+            run_fragment_workers(),
+            run_metrics_reporter(),
+            run_loop_lag_monitor(),
+            session_manager.run_eviction(),
+        )
+    ]
+    # Fragments a crash left half-way through the pipeline go first, ahead of new audio
+    journal.start()
+    await replay_journal()
+    # Mounted apps don't get lifespan events, so start their delivery loops here
+    await transcribed.startup_event()
+    await modelresp.startup_event()
+    yield
+    for task in background:
+        task.cancel()
+    await session_manager.broker.close()
+    await close_client()
+    await journal.close()
+    inference_pool.shutdown()
+    shutdown_executors()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Replace "*" with specific origins if needed
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Per-stage span histograms, queue depths and the rest of metrics.snapshot() for Prometheus.
+# Each worker serves its own; scrape the private ports (APP_PORT + 1 + i) to see them all.
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+app.mount("/voice", voice.voiceapp)
+app.mount("/transcribed", transcribed.transcribeapp)
+app.mount("/modelresp", modelresp.modelrespapp)
+
+if AGENT_INPROCESS:
+    import agent
+
+    # Reports live on the worker that owns the session: same scheme, host and path, on its port
+    @app.get("/report/{report_id}")
+    def download_report(report_id: str, request: Request):
+        if not affinity.is_local(report_id):
+            return RedirectResponse(str(request.url.replace(port=affinity.owner_port(report_id))))
+        return agent.download_report(report_id)
+
+    app.mount("/", agent.app)
@@ -0,0 +1,389 @@
+# Audio helpers for the voice ingestion path: WAV header parsing, decoding and normalisation.
+#
+# Audio is normalised once, on the voice socket: every frame is decoded (int16 PCM or Opus)
+# and resampled to the 16 kHz mono float32 Whisper consumes, straight into the fragment
+# buffer, and that array is what the rest of the pipeline sees.
+import math
+import struct
+import numpy as np
+from scipy.signal import firwin, resample_poly, upfirdn
+
+PCM_SAMPLE_WIDTH = 2  # int16
+SAMPLE_RATE = 16000  # What the pipeline works in: 16 kHz mono float32
+ENCODINGS = ("pcm_s16le", "opus", "webm")  # Binary frame formats accepted after start_stream
+
+
+def wav_data_offset(audio_bytes) -> tuple[int, int | None]:
+    """Returns (offset of the PCM data, sample rate) for a RIFF/WAVE buffer, or (0, None) if it isn't one."""
+    view = memoryview(audio_bytes)
+    if len(view) < 12 or bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        return 0, None
+    offset = 12
+    rate = None
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        chunk_size = struct.unpack_from("<I", view, offset + 4)[0]
+        if chunk_id == b"fmt ":
+            rate = struct.unpack_from("<I", view, offset + 12)[0]
+        elif chunk_id == b"data":
+            return offset + 8, rate
+        offset += 8 + chunk_size + (chunk_size & 1)  # Chunks are word aligned
+    return 0, None
+
+
+def pcm_from_wav_bytes(audio_bytes) -> tuple[np.ndarray, int | None]:
+    """Views the samples of a WAV (or headerless PCM) buffer as int16 without copying."""
+    offset, rate = wav_data_offset(audio_bytes)
+    usable = (len(audio_bytes) - offset) // PCM_SAMPLE_WIDTH * PCM_SAMPLE_WIDTH
+    return np.frombuffer(audio_bytes, dtype=np.int16, count=usable // PCM_SAMPLE_WIDTH, offset=offset), rate
+
+
+def pcm_to_float32(audio: np.ndarray, samplerate: int) -> np.ndarray:
+    """Converts a whole buffer of int16 PCM at any rate to 16 kHz float32 (for one-off fragments)."""
+    samples = np.asarray(audio, dtype=np.int16).reshape(-1)
+    if samplerate != SAMPLE_RATE:
+        divisor = math.gcd(samplerate, SAMPLE_RATE)
+        samples = resample_poly(samples, SAMPLE_RATE // divisor, samplerate // divisor)
+    return np.asarray(samples, dtype=np.float32) / np.float32(32768.0)
+
+
+class PolyphaseResampler:
+    """Streaming rational resampler with the same filter as scipy's resample_poly.
+
+    Keeps enough past input between calls that a stream resampled chunk by chunk matches
+    resampling it in one go, with no clicks at chunk boundaries. Each chunk goes through
+    scipy's polyphase upfirdn once, starting from the history sample that puts the next
+    output on the decimation grid. int16 input is scaled to [-1, 1) as it is copied into
+    the reusable work buffer.
+    """
+    def __init__(self, rate_in, rate_out=SAMPLE_RATE, half_len=10):
+        divisor = math.gcd(rate_in, rate_out)
+        self.up, self.down = rate_out // divisor, rate_in // divisor
+        max_rate = max(self.up, self.down)
+        self.filter = (firwin(2 * half_len * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0)) * self.up).astype(np.float32)
+        self.taps = -(-len(self.filter) // self.up)  # Input samples under the filter at any time
+        # The filter's span, plus up to down - 1 samples to line the first output up with the grid
+        self.history = self.taps - 1 + self.down - 1
+        self._work = np.zeros(self.history + 4096, dtype=np.float32)  # History, then the current chunk
+        self._next = half_len * max_rate  # Upsampled position of the next output, relative to the chunk start
+        self._inverse_up = pow(self.up, -1, self.down)
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def output_length(self, count) -> int:
+        """Upper bound on the samples `process` returns for `count` input samples."""
+        return -(-count * self.up // self.down) + 1
+
+    def process(self, samples: np.ndarray, out: np.ndarray) -> int:
+        """Resamples the next chunk into `out` and returns how many samples it wrote."""
+        history = self.history
+        count = len(samples)
+        if history + count > len(self._work):
+            grown = np.zeros(history + count, dtype=np.float32)
+            grown[:history] = self._work[:history]
+            self._work = grown
+        chunk = self._work[history:history + count]
+        if samples.dtype == np.int16:
+            np.multiply(samples, np.float32(1 / 32768), out=chunk, casting="unsafe")
+        else:
+            chunk[:] = samples
+
+        produced = max(0, -(-(count * self.up - self._next) // self.down))
+        if produced:
+            position = self._next + history * self.up  # Of the next output, in the work buffer
+            # upfirdn's outputs fall on multiples of `down`; skip input until ours does too
+            skip = (position % self.down) * self._inverse_up % self.down
+            first = (position - skip * self.up) // self.down
+            resampled = upfirdn(self.filter, self._work[skip:history + count], self.up, self.down)
+            out[:produced] = resampled[first:first + produced]
+        self._next += produced * self.down - count * self.up
+        self._work[:history] = self._work[count:count + history]
+        self.samples_in += count
+        self.samples_out += produced
+        return produced
+
+    def flush(self, out: np.ndarray) -> int:
+        """Writes the outputs still held back by the filter's look-ahead."""
+        expected = -(-self.samples_in * self.up // self.down)
+        silence = np.zeros(self.taps + 1, dtype=np.float32)
+        samples_in = self.samples_in
+        produced = self.process(silence, out)
+        self.samples_in = samples_in
+        produced = min(produced, max(0, expected - (self.samples_out - produced)))
+        self.samples_out = expected
+        return produced
+
+
+class OpusDecoder:
+    """Decodes a stream of raw Opus packets (one per binary frame) to 48 kHz mono float32."""
+    RATE = 48000
+
+    def __init__(self):
+        import av  # Installed with faster-whisper
+        self._av = av
+        self._codec = av.CodecContext.create("opus", "r")
+
+    def decode(self, packet) -> list[np.ndarray]:
+        frames = self._codec.decode(self._av.Packet(bytes(packet)))
+        return [frame.to_ndarray()[0] for frame in frames]  # Planar float; channel 0 is the mono mix
+
+
+class WebmOpusDemuxer:
+    """Incremental WebM/Matroska demuxer that pulls the Opus packets out of MediaRecorder chunks.
+
+    Chunks can be split anywhere; whatever can't be parsed yet is kept for the next `feed`.
+    Master elements (Segment, Cluster, ...) are entered without waiting for their end, since
+    MediaRecorder writes them with unknown sizes, and everything but blocks of the Opus track
+    is skipped as it arrives. Input that isn't WebM raises ValueError rather than piling up.
+    """
+    MASTERS = {0x18538067, 0x1F43B675, 0xA0, 0x1654AE6B, 0xAE}  # Segment, Cluster, BlockGroup, Tracks, TrackEntry
+    BLOCKS = {0xA3, 0xA1}  # SimpleBlock, Block
+    TRACK_NUMBER, CODEC_ID = 0xD7, 0x86
+    EBML = 0x1A45DFA3  # The header every WebM stream starts with
+    MAX_PENDING = 1 << 20  # Bytes held for one element; blocks of a few Opus frames are far smaller
+
+    def __init__(self):
+        self._pending = bytearray()
+        self._skip = 0  # Bytes still to drop of an element that isn't needed
+        self._started = False  # Whether the EBML header has been seen
+        self._track = None  # Opus track number, once Tracks has been seen
+        self._entry_number = None
+        self.bytes_in = 0
+
+    def feed(self, data) -> list[bytes]:
+        self.bytes_in += len(data)
+        self._pending += data
+        packets = []
+        offset = 0
+        with memoryview(self._pending) as view:
+            while True:
+                if self._skip:
+                    skipped = min(self._skip, len(view) - offset)
+                    self._skip -= skipped
+                    offset += skipped
+                    if self._skip:
+                        break
+                header = self._element_header(view, offset)
+                if header is None:
+                    break
+                element_id, size, start = header
+                if not self._started:
+                    if element_id != self.EBML:
+                        raise ValueError("not a WebM stream")
+                    self._started = True
+                if element_id in self.MASTERS:
+                    offset = start  # Step into it
+                    continue
+                if size is None:
+                    raise ValueError(f"WebM element {element_id:#x} has an unknown size but isn't a container")
+                if element_id not in self.BLOCKS and element_id not in (self.TRACK_NUMBER, self.CODEC_ID):
+                    self._skip = size
+                    offset = start
+                    continue
+                if start + size > len(view):
+                    break  # Wait for the rest of the element
+                with view[start:start + size] as body:
+                    if element_id in self.BLOCKS:
+                        packets.extend(self._block_frames(body))
+                    elif element_id == self.TRACK_NUMBER:
+                        self._entry_number = int.from_bytes(body, "big")
+                    elif bytes(body).rstrip(b"\0") == b"A_OPUS" and self._track is None:
+                        self._track = self._entry_number
+                offset = start + size
+        del self._pending[:offset]
+        if len(self._pending) > self.MAX_PENDING:
+            raise ValueError(f"WebM element larger than {self.MAX_PENDING} bytes")
+        return packets
+
+    @staticmethod
+    def _vint(view, offset, keep_marker=False):
+        """Reads an EBML variable-length integer: (value, length), or None if it's incomplete."""
+        if offset >= len(view):
+            return None
+        first = view[offset]
+        if not first:
+            raise ValueError("invalid EBML variable-length integer")  # Longer than 8 bytes
+        length = 8 - first.bit_length() + 1
+        if offset + length > len(view):
+            return None
+        value = first if keep_marker else first & (0xFF >> length)
+        for byte in view[offset + 1:offset + length]:
+            value = (value << 8) | byte
+        return value, length
+
+    def _element_header(self, view, offset):
+        element = self._vint(view, offset, keep_marker=True)
+        if element is None:
+            return None
+        if element[1] > 4:
+            raise ValueError(f"invalid WebM element ID at byte {self.bytes_in - len(view) + offset}")
+        size = self._vint(view, offset + element[1])
+        if size is None:
+            return None
+        unknown = size[0] == (1 << (7 * size[1])) - 1  # All ones: size not known while streaming
+        return element[0], None if unknown else size[0], offset + element[1] + size[1]
+
+    def _block_frames(self, body) -> list[bytes]:
+        track = self._vint(body, 0)
+        position = track[1] + 3 if track is not None else len(body) + 1  # Track number, 16-bit timecode, flags
+        if position > len(body):
+            raise ValueError("truncated WebM block")
+        if self._track is not None and track[0] != self._track:
+            return []
+        lacing = (body[track[1] + 2] >> 1) & 0x03
+        if lacing == 0:
+            return [bytes(body[position:])]
+        if position >= len(body):
+            raise ValueError("truncated WebM block lacing")
+        count = body[position] + 1
+        position += 1
+        sizes = []
+        if lacing == 1:  # Xiph: sizes as runs of 255s
+            for _ in range(count - 1):
+                size = 0
+                while position < len(body) and body[position] == 255:
+                    size += 255
+                    position += 1
+                if position >= len(body):
+                    raise ValueError("truncated Xiph lacing in WebM block")
+                size += body[position]
+                position += 1
+                sizes.append(size)
+        elif lacing == 3:  # EBML: first size, then signed differences
+            for _ in range(count - 1):
+                coded = self._vint(body, position)
+                if coded is None:
+                    raise ValueError("truncated EBML lacing in WebM block")
+                value, length = coded
+                position += length
+                size = value if not sizes else sizes[-1] + value - ((1 << (7 * length - 1)) - 1)
+                if size < 0:
+                    raise ValueError("negative frame size in WebM block lacing")
+                sizes.append(size)
+        else:  # Fixed: equal sizes
+            if (len(body) - position) % count:
+                raise ValueError("WebM block doesn't split into equal frames")
+            sizes = [(len(body) - position) // count] * (count - 1)
+        last = len(body) - position - sum(sizes)
+        if last < 0:
+            raise ValueError("WebM block lacing sizes exceed the block")
+        sizes.append(last)
+        frames = []
+        for size in sizes:
+            frames.append(bytes(body[position:position + size]))
+            position += size
+        return frames
+
+
+class WebmOpusDecoder:
+    """Decodes MediaRecorder's audio/webm;codecs=opus chunks to 48 kHz mono float32, one chunk at a time."""
+    RATE = OpusDecoder.RATE
+
+    def __init__(self):
+        self.demuxer = WebmOpusDemuxer()
+        self.opus = OpusDecoder()
+
+    def decode(self, chunk) -> list[np.ndarray]:
+        return [samples for packet in self.demuxer.feed(chunk) for samples in self.opus.decode(packet)]
+
+
+class AudioStreamBuffer:
+    """Turns a session's binary audio frames into fixed-length 16 kHz float32 fragments.
+
+    Frames are decoded (int16 PCM, Opus packets, or WebM/Opus chunks from MediaRecorder) and
+    resampled into a preallocated float32 fragment buffer; a full fragment is handed over as
+    that array, and nothing downstream decodes, resamples or copies it again. int16 PCM that isn't sample-aligned within a frame
+    is carried over to the next one.
+    """
+    def __init__(self, sample_rate: int, duration: float = 5, encoding: str = "pcm_s16le"):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding {encoding!r}, expected one of {ENCODINGS}")
+        self.encoding = encoding
+        self.decoder = {"opus": OpusDecoder, "webm": WebmOpusDecoder}.get(encoding, lambda: None)()
+        rate_in = OpusDecoder.RATE if self.decoder is not None else sample_rate
+        self.resampler = PolyphaseResampler(rate_in) if rate_in != SAMPLE_RATE else None
+        self.capacity = max(1, int(SAMPLE_RATE * duration))
+        self._buffer = np.empty(self.capacity, dtype=np.float32)
+        self._length = 0
+        self._odd_byte = b""
+        self._scratch = np.empty(0, dtype=np.float32)
+
+    def write(self, data) -> list[np.ndarray]:
+        """Decodes a frame and returns any fragments it completed."""
+        completed = []
+        if self.decoder is not None:
+            for samples in self.decoder.decode(data):
+                self._append(samples, completed)
+            return completed
+        if self._odd_byte:
+            data = self._odd_byte + bytes(data)
+            self._odd_byte = b""
+        usable = len(data) // PCM_SAMPLE_WIDTH
+        if len(data) % PCM_SAMPLE_WIDTH:
+            self._odd_byte = bytes(data[-1:])
+        self._append(np.frombuffer(data, dtype=np.int16, count=usable), completed)
+        return completed
+
+    def flush(self) -> np.ndarray | None:
+        """Returns whatever is buffered as a final, shorter fragment."""
+        tail = self._buffer[:0]
+        if self.resampler is not None:
+            out = np.empty(self.resampler.output_length(self.resampler.taps + 1), dtype=np.float32)
+            tail = out[:self.resampler.flush(out)]
+        if self._length + len(tail) == 0:
+            return None
+        if self._length + len(tail) > self.capacity:
+            # The filter's look-ahead spills past a full fragment, so the last one is a little longer
+            fragment = np.concatenate((self._buffer[:self._length], tail))
+            self._length = 0
+            return fragment
+        self._buffer[self._length:self._length + len(tail)] = tail
+        self._length += len(tail)
+        return self._take()
+
+    def _append(self, samples, completed):
+        if self.resampler is None:
+            while len(samples):
+                count = min(len(samples), self.capacity - self._length)
+                target = self._buffer[self._length:self._length + count]
+                if samples.dtype == np.int16:
+                    np.multiply(samples[:count], np.float32(1 / 32768), out=target, casting="unsafe")
+                else:
+                    target[:] = samples[:count]
+                self._length += count
+                samples = samples[count:]
+                if self._length == self.capacity:
+                    completed.append(self._take())
+            return
+        out = self._reserve(self.resampler.output_length(len(samples)))
+        self._emit(self.resampler.process(samples, out), out, completed)
+
+    def _reserve(self, count) -> np.ndarray:
+        """Where the resampler should write: the fragment buffer, or scratch space if it might overflow it."""
+        if self._length + count <= self.capacity:
+            return self._buffer[self._length:]
+        if len(self._scratch) < count:
+            self._scratch = np.empty(count, dtype=np.float32)
+        return self._scratch
+
+    def _emit(self, produced, out, completed):
+        if out.base is self._buffer:
+            self._length += produced
+            if self._length == self.capacity:
+                completed.append(self._take())
+            return
+        # Resampled into scratch because it straddles a fragment boundary
+        written = out[:produced]
+        while len(written):
+            count = min(len(written), self.capacity - self._length)
+            self._buffer[self._length:self._length + count] = written[:count]
+            self._length += count
+            written = written[count:]
+            if self._length == self.capacity:
+                completed.append(self._take())
+
+    def _take(self) -> np.ndarray:
+        fragment = self._buffer[:self._length]
+        self._buffer = np.empty(self.capacity, dtype=np.float32)
+        self._length = 0
+        return fragment
@@ -0,0 +1,136 @@
+# Benchmark: /diagnose (pooled CrewAI crew) vs /diarize (single structured-output call).
+#
+# Starts a stand-in OpenAI-compatible server that counts chat completion calls and answers
+# after a fixed latency, launches the agent app against it, and fires concurrent requests
+# at both endpoints. Reports p50/p95 latency and LLM calls per request for each path.
+#
+# Usage: python bench_agent.py [--requests 40] [--concurrency 4] [--llm-latency 0.5]
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+TRANSCRIPT = (
+    "How are you feeling today? I've had a persistent cough and mild fever. Any shortness of breath "
+    "or chest pain? No, just fatigue. Sounds viral, but we'll run some tests to be sure. Thank you, doctor."
+)
+FRAGMENTS = [
+    {"doctor": "How are you feeling today?", "patient": "I've had a persistent cough and mild fever."},
+    {"doctor": "Any shortness of breath or chest pain?", "patient": "No, just fatigue."},
+]
+
+stub = FastAPI()
+stub.state.calls = 0
+stub.state.latency = 0.5  # Seconds per call
+stub.state.latency_per_1k_tokens = 0.0  # Extra seconds per 1k prompt tokens
+stub.state.prompt_tokens = []  # Estimated prompt tokens (chars / 4) of every call
+
+
+@stub.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt_tokens = sum(len(m.get("content") or "") for m in body["messages"]) // 4
+    stub.state.calls += 1
+    stub.state.prompt_tokens.append(prompt_tokens)
+    await asyncio.sleep(stub.state.latency + stub.state.latency_per_1k_tokens * prompt_tokens / 1000)
+    if body.get("response_format"):
+        content = json.dumps({"fragments": FRAGMENTS})
+    else:
+        # CrewAI agents parse a ReAct-style reply
+        content = "Thought: I now know the final answer\nFinal Answer: " + json.dumps(FRAGMENTS)
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                  "total_tokens": prompt_tokens + len(content) // 4},
+    }
+
+
+def launch_agent(agent_port, stub_port):
+    """Starts the agent app in a subprocess, pointed at the stand-in OpenAI server."""
+    env = dict(os.environ)
+    env["OPENAI_BASE_URL"] = env["OPENAI_API_BASE"] = f"http://127.0.0.1:{stub_port}/v1"
+    env["OPENAI_API_KEY"] = "bench"
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "agent:app", "--port", str(agent_port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client, base):
+    for _ in range(300):
+        try:
+            await client.get(f"{base}/docs")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"agent at {base} did not start")
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def run_path(client, url, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            payload = {"gender": "Unknown", "age": 0, "symptoms": TRANSCRIPT, "medical_history": TRANSCRIPT}
+            response = await client.post(url, json=payload)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or response.json().get("diagnosis_summary") is None:
+                failures += 1
+
+    calls_before = stub.state.calls
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, (stub.state.calls - calls_before) / requests, failures
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="stand-in LLM latency (s)")
+    parser.add_argument("--stub-port", type=int, default=18090)
+    parser.add_argument("--agent-port", type=int, default=18082)
+    args = parser.parse_args()
+
+    stub.state.latency = args.llm_latency
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=args.stub_port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+
+    agent = launch_agent(args.agent_port, args.stub_port)
+    base = f"http://127.0.0.1:{args.agent_port}"
+    try:
+        async with httpx.AsyncClient(timeout=300) as client:
+            await wait_ready(client, base)
+            for path in ("/diagnose", "/diarize"):
+                await run_path(client, base + path, 1, 1)  # Warm up
+                latencies, calls, failures = await run_path(client, base + path, args.requests, args.concurrency)
+                print(f"{path:10s} p50={statistics.median(latencies):.2f}s p95={percentile(latencies, 0.95):.2f}s "
+                      f"llm calls/request={calls:.2f} failures={failures}")
+    finally:
+        agent.terminate()
+        agent.wait()
+        server.should_exit = True
+        await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+# Benchmark: broadcasting to 500 simulated clients, some slow and some dead.
+#
+# Compares the old sequential broadcast (await each send in turn) with
+# WebSocketConnectionManager's per-connection writers, reporting how long healthy clients
+# wait for each message, how many peers were evicted and how many messages were dropped.
+#
+# Usage: python bench_broadcast.py [--clients 500] [--slow 0.05] [--dead 0.02] [--messages 20]
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from websocket_manager import WebSocketConnectionManager
+
+
+class FakeWebSocket:
+    """Stands in for a WebSocket with a configurable send delay; dead peers never complete."""
+    client = None
+
+    def __init__(self, delay, dead=False):
+        self.delay = delay
+        self.dead = dead
+        self.received = []
+
+    async def accept(self):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+    async def send_text(self, message):
+        if self.dead:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self.delay)
+        self.received.append((message, time.perf_counter()))
+
+
+def make_clients(count, slow_fraction, dead_fraction, slow_delay):
+    rng = random.Random(0)
+    clients = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < dead_fraction:
+            clients.append(FakeWebSocket(0, dead=True))
+        elif roll < dead_fraction + slow_fraction:
+            clients.append(FakeWebSocket(slow_delay))
+        else:
+            clients.append(FakeWebSocket(0.0005))
+    return clients
+
+
+async def sequential(clients, messages, timeout):
+    """The old broadcast: one send after another, aborting on the first failure."""
+    sent_at = {}
+    for i in range(messages):
+        message = f"message {i}"
+        sent_at[message] = time.perf_counter()
+        try:
+            for client in clients:
+                await asyncio.wait_for(client.send_text(message), timeout=timeout)
+        except Exception:
+            pass  # The whole broadcast is aborted
+    return sent_at
+
+
+async def managed(clients, messages, timeout):
+    manager = WebSocketConnectionManager(send_timeout=timeout, queue_size=8)
+    for client in clients:
+        await manager.connect(client)
+    sent_at = {}
+    for i in range(messages):
+        message = f"message {i}"
+        sent_at[message] = time.perf_counter()
+        await manager.broadcast(message)
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(timeout + 0.5)
+    stats = manager.stats()
+    print(f"  evicted={stats['evicted']}  dropped={sum(p['dropped'] for p in stats['peers'])}  "
+          f"max lag={max((p['lag_ms'] for p in stats['peers']), default=0):.1f} ms")
+    for client in list(manager.active_connections):
+        manager.disconnect(client)
+    return sent_at
+
+
+def report(clients, sent_at, messages):
+    healthy = [c for c in clients if not c.dead and c.delay < 0.01]
+    delays = [t - sent_at[m] for c in healthy for m, t in c.received]
+    delivered = sum(len(c.received) for c in healthy)
+    print(f"  healthy clients: delivered {delivered}/{len(healthy) * messages}  "
+          f"p50 wait={statistics.median(delays) * 1000 if delays else float('nan'):.1f} ms  "
+          f"max wait={max(delays) * 1000 if delays else float('nan'):.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--slow", type=float, default=0.05, help="fraction of slow clients")
+    parser.add_argument("--dead", type=float, default=0.02, help="fraction of clients that never ack")
+    parser.add_argument("--slow-delay", type=float, default=0.2)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print("sequential broadcast")
+    clients = make_clients(args.clients, args.slow, args.dead, args.slow_delay)
+    report(clients, await sequential(clients, args.messages, args.timeout), args.messages)
+
+    print("WebSocketConnectionManager")
+    clients = make_clients(args.clients, args.slow, args.dead, args.slow_delay)
+    report(clients, await managed(clients, args.messages, args.timeout), args.messages)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
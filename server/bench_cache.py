@@ -0,0 +1,107 @@
+# Benchmark: backend calls and latency with and without the transcription/translation cache.
+#
+# Replays a workload where a share of fragments are resent (retries, reconnects, demo replays)
+# and a share of phrases are boilerplate, against stand-in backends with fixed latency. Counts
+# how often each backend is actually called and checks that every cache hit skipped the backend.
+#
+# Usage: python bench_cache.py [--fragments 200] [--repeat 0.4] [--latency 0.3]
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import numpy as np
+import tasks
+from cache import TwoLevelCache
+from translation_batcher import TranslationBatcher
+
+BOILERPLATE = [
+    "How are you feeling today?",
+    "Do you have any allergies?",
+    "Are you taking any medication?",
+    "When did the pain start?",
+]
+
+
+class Backend:
+    """Stand-in for Whisper/GPT-4 that counts calls and sleeps for a fixed latency."""
+    def __init__(self, latency, fn):
+        self.latency = latency
+        self.fn = fn
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.fn(*args)
+
+
+def make_workload(count, repeat, rng):
+    fragments = []
+    for i in range(count):
+        if fragments and rng.random() < repeat:
+            fragments.append(rng.choice(fragments))  # Resent chunk
+        else:
+            pcm = np.full(16000, i / 32768, dtype=np.float32)  # As normalised by the voice socket
+            phrase = rng.choice(BOILERPLATE) if rng.random() < 0.5 else f"symptom report number {i}"
+            fragments.append((pcm, phrase))
+    return fragments
+
+
+async def replay(fragments, cached, latency):
+    transcriber = Backend(latency, lambda audio, rate: transcripts[round(audio[0] * 32768)])
+    translator = Backend(latency, lambda text, src, dst: f"[es] {text}")
+    transcripts = {round(pcm[0] * 32768): phrase for pcm, phrase in fragments}
+    tasks.transcribe_cloud_from_memory = transcriber
+    tasks.translation_batcher = TranslationBatcher(translator, window=0)
+
+    start = time.perf_counter()
+    for pcm, _ in fragments:
+        if cached:
+            text = await tasks.transcribe_cached(pcm, "c")
+            await tasks.translate_cached(text, "English", "Spanish")
+        else:
+            text = await tasks.run_io(transcriber, pcm, 16000)
+            await tasks.run_io(translator, text, "English", "Spanish")
+    return time.perf_counter() - start, transcriber.calls, translator.calls
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fragments", type=int, default=200)
+    parser.add_argument("--repeat", type=float, default=0.4, help="share of fragments that are resent")
+    parser.add_argument("--latency", type=float, default=0.3, help="stand-in backend latency (s)")
+    args = parser.parse_args()
+
+    fragments = make_workload(args.fragments, args.repeat, random.Random(0))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        tasks.transcription_cache = TwoLevelCache("transcriptions", path=path)
+        tasks.translation_cache = TwoLevelCache("translations", path=path)
+
+        for label, cached in (("uncached", False), ("cached  ", True)):
+            elapsed, transcribe_calls, translate_calls = await replay(fragments, cached, args.latency)
+            print(f"{label} elapsed={elapsed:6.1f}s transcribe calls={transcribe_calls:4d} "
+                  f"translate calls={translate_calls:4d}")
+
+        distinct_audio = len({round(pcm[0] * 32768) for pcm, _ in fragments})
+        distinct_phrases = len({phrase for _, phrase in fragments})
+        print(f"distinct audio={distinct_audio} distinct phrases={distinct_phrases}")
+        print("transcriptions:", tasks.transcription_cache.stats())
+        print("translations:  ", tasks.translation_cache.stats())
+        assert transcribe_calls == distinct_audio, "a transcription cache hit reached the backend"
+        assert translate_calls == distinct_phrases, "a translation cache hit reached the backend"
+
+        # A restart keeps the disk level: a fresh cache on the same file serves everything
+        tasks.transcription_cache = TwoLevelCache("transcriptions", path=path)
+        tasks.translation_cache = TwoLevelCache("translations", path=path)
+        elapsed, transcribe_calls, translate_calls = await replay(fragments, True, args.latency)
+        print(f"restarted elapsed={elapsed:6.1f}s transcribe calls={transcribe_calls:4d} "
+              f"translate calls={translate_calls:4d} disk hits={tasks.transcription_cache.disk_hits}")
+        assert transcribe_calls == translate_calls == 0
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+# Microbenchmark: per-tick delivery cost as history grows, rescanning a list vs ChannelLog cursors.
+#
+# Each tick appends a few fragments and delivers them to the subscribers. The old approach
+# walks every fragment ever created checking .sent; ChannelLog only reads unread entries.
+#
+# Usage: python bench_channel_log.py [--total 100000] [--per-tick 2] [--subscribers 3]
+import argparse
+import time
+from channel_log import ChannelLog
+
+
+class Fragment:
+    def __init__(self, text):
+        self.text = text
+        self.sent = False
+
+
+def tick_rescan(fragments, subscribers, new_items):
+    fragments.extend(Fragment(text) for text in new_items)
+    delivered = 0
+    for fragment in fragments:
+        if not fragment.sent:
+            delivered += len(subscribers)
+            fragment.sent = True
+    return delivered
+
+
+def tick_cursor(log, subscribers, new_items):
+    for text in new_items:
+        log.append(text)
+    delivered = 0
+    for subscriber in subscribers:
+        for seq, _ in log.read(subscriber):
+            delivered += 1
+            log.ack(subscriber, seq)
+    return delivered
+
+
+def run(label, tick, state, subscribers, total, per_tick, checkpoints):
+    added = 0
+    samples = {}
+    while added < total:
+        start = time.perf_counter()
+        tick(state, subscribers, [f"fragment {added + i}" for i in range(per_tick)])
+        elapsed = time.perf_counter() - start
+        added += per_tick
+        for checkpoint in checkpoints:
+            if added - per_tick < checkpoint <= added:
+                samples[checkpoint] = elapsed
+    print(label + "  " + "  ".join(f"@{c // 1000}k={samples[c] * 1e6:9.1f} us" for c in checkpoints))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--total", type=int, default=100000)
+    parser.add_argument("--per-tick", type=int, default=2)
+    parser.add_argument("--subscribers", type=int, default=3)
+    args = parser.parse_args()
+
+    checkpoints = [c for c in (1000, 10000, 50000, 100000) if c <= args.total]
+    subscribers = [object() for _ in range(args.subscribers)]
+
+    run("rescan ", tick_rescan, [], subscribers, args.total, args.per_tick, checkpoints)
+    log = ChannelLog(max_entries=args.total)
+    for subscriber in subscribers:
+        log.subscribe(subscriber)
+    run("cursors", tick_cursor, log, subscribers, args.total, args.per_tick, checkpoints)
+    print(f"entries retained after compaction: {len(log)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Benchmark: prompt tokens and latency per /diarize call over a scripted 30-minute consultation.
+#
+# Compares three ways of feeding the consultation to the agent, one transcript fragment at a time:
+#   fragment     - each fragment on its own, no context (the old per-fragment behaviour)
+#   full         - the whole transcript so far on every call
+#   incremental  - only the new fragment, with the session's labelled dialogue as bounded context
+# Uses the stand-in OpenAI server from bench_agent.py, whose latency grows with prompt size.
+# Token counts are estimates (characters / 4).
+#
+# Usage: python bench_diarize_tokens.py [--minutes 30] [--fragment-seconds 5]
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+import uuid
+import httpx
+import uvicorn
+from bench_agent import stub, launch_agent, wait_ready, percentile
+
+DOCTOR = [
+    "How are you feeling today?",
+    "When did the cough start, and is it worse at night?",
+    "Have you had any fever or chills since then?",
+    "Are you taking anything for it at the moment?",
+    "Any shortness of breath when you climb stairs?",
+    "Let me listen to your chest, take a deep breath for me.",
+    "Do you have any allergies to medication?",
+    "I'd like to run a blood test and a chest X-ray to be sure.",
+]
+PATIENT = [
+    "Not great, I've had a persistent cough and I feel tired all the time.",
+    "About two weeks ago, and yes, it keeps me awake most nights.",
+    "A mild fever on and off, mostly in the evenings.",
+    "Just some cough syrup from the pharmacy, it doesn't help much.",
+    "A little, I have to stop halfway up sometimes.",
+    "Okay, it hurts a bit on the left side when I breathe in.",
+    "Penicillin gives me a rash, nothing else that I know of.",
+    "That's fine, thank you, doctor.",
+]
+
+
+def scripted_fragments(minutes, fragment_seconds):
+    """Alternating doctor/patient lines, one transcript fragment per `fragment_seconds` of audio."""
+    lines = itertools.cycle(itertools.chain.from_iterable(zip(DOCTOR, PATIENT)))
+    return [next(lines) for _ in range(int(minutes * 60 / fragment_seconds))]
+
+
+async def run_strategy(client, url, strategy, fragments):
+    session_id = uuid.uuid4().hex
+    tokens_before = len(stub.state.prompt_tokens)
+    latencies = []
+    transcript = []
+    for fragment in fragments:
+        transcript.append(fragment)
+        payload = {"gender": "Unknown", "age": 0, "medical_history": ""}
+        if strategy == "fragment":
+            payload["symptoms"] = fragment
+        elif strategy == "full":
+            payload["symptoms"] = " ".join(transcript)
+        else:
+            payload["symptoms"] = fragment
+            payload["session_id"] = session_id
+        start = time.perf_counter()
+        response = await client.post(url, json=payload)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return stub.state.prompt_tokens[tokens_before:], latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=30)
+    parser.add_argument("--fragment-seconds", type=float, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="stand-in LLM latency per call (s)")
+    parser.add_argument("--latency-per-1k-tokens", type=float, default=0.1, help="extra stand-in latency (s)")
+    parser.add_argument("--stub-port", type=int, default=18090)
+    parser.add_argument("--agent-port", type=int, default=18082)
+    args = parser.parse_args()
+
+    stub.state.latency = args.llm_latency
+    stub.state.latency_per_1k_tokens = args.latency_per_1k_tokens
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=args.stub_port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    agent = launch_agent(args.agent_port, args.stub_port)
+    base = f"http://127.0.0.1:{args.agent_port}"
+
+    fragments = scripted_fragments(args.minutes, args.fragment_seconds)
+    per_minute = 60 / args.fragment_seconds
+    checkpoints = [m for m in (1, 10, 20, 30) if m <= args.minutes]
+    print(f"{len(fragments)} fragments over {args.minutes:g} minutes")
+    try:
+        async with httpx.AsyncClient(timeout=300) as client:
+            await wait_ready(client, base)
+            for strategy in ("fragment", "full", "incremental"):
+                tokens, latencies = await run_strategy(client, base + "/diarize", strategy, fragments)
+                at = "  ".join(f"@{m}m={tokens[int(m * per_minute) - 1]:5d}" for m in checkpoints)
+                print(f"{strategy:12s} prompt tokens {at}  total={sum(tokens):7d}  "
+                      f"latency p50={statistics.median(latencies):.2f}s p95={percentile(latencies, 0.95):.2f}s")
+    finally:
+        agent.terminate()
+        agent.wait()
+        server.should_exit = True
+        await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+# Benchmark: per-fragment latency with the pipeline run as a graph (tasks.FRAGMENT_PIPELINE:
+# translation and the agent side by side after transcription) against the old serial chain
+# (transcribe -> translate -> agent), built from the same node functions.
+#
+# Runs the fragment workers in-process with stand-ins that sleep for --transcribe, --translate
+# and --agent seconds. --sessions sessions each send --fragments fragments, one every --interval
+# seconds as live speech would, through voice.enqueue_fragment. Latency is from enqueueing a
+# fragment until every node is through with it; the critical path counts come from /metrics'
+# pipeline_critical_path_total (metrics.critical_path_counts).
+#
+# Usage: python bench_fragment_dag.py [--sessions 4] [--fragments 10] [--interval 3]
+#                                     [--transcribe 0.3] [--translate 0.8] [--agent 1.0] [--workers 4]
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import numpy as np
+
+os.environ.setdefault("JOURNAL_PATH", "")  # Not what is measured here
+import dag
+import metrics
+import tasks
+from sessions import session_manager
+from voice import enqueue_fragment
+
+SAMPLE_RATE = 16000
+
+GRAPH_PIPELINE = tasks.FRAGMENT_PIPELINE
+SERIAL_PIPELINE = dag.Graph(
+    dag.Node("transcribe", tasks.transcribe_node),
+    dag.Node("translate", tasks.translate_node, after=("transcribe",), ordered=True),
+    dag.Node("agent", tasks.agent_node, after=("translate",), ordered=True, limit=tasks.AGENT_CONCURRENCY),
+)
+
+
+def install_stand_ins(args):
+    async def transcribe(samples, mode):
+        await asyncio.sleep(args.transcribe)
+        return "the patient reports a headache since yesterday"
+
+    async def translate(text, input_lang, output_lang, stream_to=None, requested=True):
+        await asyncio.sleep(args.translate)
+        return text.upper(), None
+
+    async def agent_call(text, session_id=None, stream=False, fragment_id=None):
+        await asyncio.sleep(args.agent)
+
+    tasks.transcribe_cached = transcribe
+    tasks.translate_cached = translate
+    tasks.agentCall_async = agent_call
+
+
+async def run_session(args):
+    session = session_manager.get_or_create()
+    samples = np.zeros(SAMPLE_RATE // 10, dtype=np.float32)
+    for _ in range(args.fragments):
+        started = time.monotonic()
+        await enqueue_fragment(session, {"mode": "c", "samples": samples, "translate_to": args.translate_to})
+        await asyncio.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+
+
+async def measure(label, pipeline, args):
+    tasks.FRAGMENT_PIPELINE = pipeline
+    metrics.critical_path_counts.clear()
+    latencies = []
+    process_fragment = tasks.process_fragment
+
+    async def timed(name, stage, fragment):
+        await process_fragment(name, stage, fragment)
+        latencies.append(time.monotonic() - fragment.enqueued_at)
+
+    tasks.process_fragment = timed
+    workers = asyncio.create_task(tasks.run_fragment_workers(args.workers))
+    start = time.monotonic()
+    await asyncio.gather(*(run_session(args) for _ in range(args.sessions)))
+    while len(latencies) < args.sessions * args.fragments:
+        await asyncio.sleep(0.05)
+    elapsed = time.monotonic() - start
+    workers.cancel()
+    tasks.process_fragment = process_fragment
+
+    latencies.sort()
+    paths = "  ".join(f"{name}={count}" for name, count in sorted(metrics.critical_path_counts.items()))
+    print(f"{label:6s} fragments={len(latencies)}  elapsed={elapsed:5.1f}s  "
+          f"latency p50={statistics.median(latencies):.2f}s p95={latencies[int(len(latencies) * 0.95) - 1]:.2f}s "
+          f"max={latencies[-1]:.2f}s  critical path: {paths}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--fragments", type=int, default=10, help="fragments per session")
+    parser.add_argument("--interval", type=float, default=3, help="seconds between a session's fragments")
+    parser.add_argument("--transcribe", type=float, default=0.3, help="stand-in transcription latency (s)")
+    parser.add_argument("--translate", type=float, default=0.8, help="stand-in translation latency (s)")
+    parser.add_argument("--agent", type=float, default=1.0, help="stand-in agent latency (s)")
+    parser.add_argument("--translate-to", default="Spanish", help="empty for English only")
+    parser.add_argument("--workers", type=int, default=tasks.FRAGMENT_WORKERS)
+    args = parser.parse_args()
+    args.translate_to = args.translate_to or None
+
+    install_stand_ins(args)
+    print(f"transcribe={args.transcribe}s translate={args.translate}s agent={args.agent}s  "
+          f"sessions={args.sessions} workers={args.workers} agent concurrency={tasks.AGENT_CONCURRENCY}")
+    await measure("serial", SERIAL_PIPELINE, args)
+    await measure("graph", GRAPH_PIPELINE, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
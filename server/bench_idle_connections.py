@@ -0,0 +1,164 @@
+# Idle connection benchmark: what an open transcript or model-response dashboard costs an app
+# worker while nothing is happening, and how quickly the worker notices peers that went away.
+#
+# Starts one app worker (startall.run_worker) in a child process and opens --connections
+# WebSockets to it, alternately /transcribed/ws and /modelresp/ws, spread over --sessions
+# sessions. Once they are all up it leaves them idle for --idle seconds and reports, from
+# /proc, the worker's RSS growth per connection and its CPU time and voluntary context switches
+# (wakeups) over that window. Then it opens --dead more that complete the handshake and go
+# silent, never reading or answering pings, and times how long the worker takes to drop them;
+# that is bounded by --ping-interval + --ping-timeout (startall.WS_PING_INTERVAL/TIMEOUT).
+#
+# Usage: python bench_idle_connections.py [--connections 10000] [--sessions 100] [--idle 30]
+#                                         [--dead 100] [--ping-interval 20] [--ping-timeout 20]
+import argparse
+import asyncio
+import base64
+import multiprocessing
+import os
+import time
+import uuid
+import httpx
+import websockets
+import startall
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def process_counters(pid) -> dict:
+    """CPU seconds, RSS bytes and voluntary context switches of a process."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * PAGE_SIZE
+    with open(f"/proc/{pid}/status") as f:
+        switches = next(int(line.split()[1]) for line in f if line.startswith("voluntary_ctxt_switches"))
+    # utime and stime are fields 14 and 15 of stat, i.e. 11 and 12 after the command name
+    return {"cpu": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, "rss": rss, "wakeups": switches}
+
+
+async def connection_count(client, port) -> int:
+    """Open dashboard sockets, from /metrics (the /stats endpoints list every peer)."""
+    text = (await client.get(f"http://127.0.0.1:{port}/metrics")).text
+    return sum(
+        int(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+        if line.startswith("pipeline_websocket_connections{") and 'endpoint="voice"' not in line
+    )
+
+
+async def wait_for_count(client, port, count, timeout) -> float | None:
+    """Seconds until the worker holds `count` connections, or None after `timeout`."""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if await connection_count(client, port) == count:
+            return time.monotonic() - start
+        await asyncio.sleep(0.25)
+    return None
+
+
+async def open_dashboard(port, index, sessions, limit):
+    path = "transcribed" if index % 2 == 0 else "modelresp"
+    async with limit:
+        # No client-side pings: only the worker's own keepalive traffic should show up
+        return await websockets.connect(
+            f"ws://127.0.0.1:{port}/{path}/ws?session={sessions[index % len(sessions)]}", ping_interval=None
+        )
+
+
+async def open_silent(port, session_id):
+    """A peer that completes the handshake and then never reads or answers pings again."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(
+        f"GET /transcribed/ws?session={session_id} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+        f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+        "Sec-WebSocket-Version: 13\r\n\r\n".encode()
+    )
+    await writer.drain()
+    await reader.readuntil(b"\r\n\r\n")
+    return writer
+
+
+async def run(args):
+    # The worker is spawned, so it sees this environment when it imports startall and the app
+    os.environ.update({
+        "WS_PING_INTERVAL": str(args.ping_interval),
+        "WS_PING_TIMEOUT": str(args.ping_timeout),
+        "MAX_SESSIONS": str(max(100, args.sessions)),
+        "JOURNAL_PATH": "",
+        "LOG_LEVEL": "WARNING",  # A log line per connection would dominate the CPU figures
+    })
+    worker = multiprocessing.get_context("spawn").Process(
+        target=startall.run_worker, args=(0, 1, startall.bind_socket("127.0.0.1", args.port), "127.0.0.1", args.port + 1)
+    )
+    worker.start()
+    sessions = [uuid.uuid4().hex for _ in range(args.sessions)]
+    async with httpx.AsyncClient(timeout=30) as client:
+        while True:
+            try:
+                await connection_count(client, args.port)
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        # The sessions themselves aren't what is measured; create them before the baseline
+        for session_id in sessions:
+            await (await open_dashboard(args.port, 0, [session_id], asyncio.Semaphore(1))).close()
+        await wait_for_count(client, args.port, 0, 10)
+        await asyncio.sleep(1)
+        before = process_counters(worker.pid)
+
+        start = time.monotonic()
+        limit = asyncio.Semaphore(args.concurrency)
+        sockets = await asyncio.gather(*(open_dashboard(args.port, i, sessions, limit) for i in range(args.connections)))
+        await wait_for_count(client, args.port, args.connections, 60)
+        print(f"opened {len(sockets)} connections in {time.monotonic() - start:.1f}s")
+
+        await asyncio.sleep(2)  # Let connection setup settle before the idle window
+        idle_start = process_counters(worker.pid)
+        await asyncio.sleep(args.idle)
+        idle_end = process_counters(worker.pid)
+        cpu = idle_end["cpu"] - idle_start["cpu"]
+        wakeups = idle_end["wakeups"] - idle_start["wakeups"]
+        print(f"idle {args.idle:.0f}s with {args.connections} connections: "
+              f"cpu={cpu / args.idle * 100:.2f}% of a core ({cpu / args.idle / args.connections * 1e6:.2f} us/s per connection)  "
+              f"wakeups={wakeups / args.idle:.1f}/s")
+        grown = idle_end["rss"] - before["rss"]
+        print(f"rss {before['rss'] / 2**20:.1f} -> {idle_end['rss'] / 2**20:.1f} MB  "
+              f"({grown / args.connections / 1024:.1f} KiB per connection)")
+
+        if args.dead:
+            silent = [await open_silent(args.port, sessions[0]) for _ in range(args.dead)]
+            await wait_for_count(client, args.port, args.connections + args.dead, 30)
+            budget = args.ping_interval + args.ping_timeout + 10
+            dropped = await wait_for_count(client, args.port, args.connections, budget)
+            if dropped is None:
+                print(f"{args.dead} silent peers: still connected after {budget:.0f}s")
+            else:
+                print(f"{args.dead} silent peers dropped after {dropped:.1f}s "
+                      f"(ping interval {args.ping_interval:.0f}s + timeout {args.ping_timeout:.0f}s)")
+            for writer in silent:
+                writer.close()
+
+        await asyncio.gather(*(socket.close() for socket in sockets), return_exceptions=True)
+    worker.terminate()
+    worker.join(10)
+    if worker.is_alive():
+        worker.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--sessions", type=int, default=100, help="sessions the dashboards are spread over")
+    parser.add_argument("--idle", type=float, default=30, help="seconds to measure with every connection idle")
+    parser.add_argument("--dead", type=int, default=100, help="silent peers to open afterwards (0 skips)")
+    parser.add_argument("--ping-interval", type=float, default=startall.WS_PING_INTERVAL)
+    parser.add_argument("--ping-timeout", type=float, default=startall.WS_PING_TIMEOUT)
+    parser.add_argument("--concurrency", type=int, default=200, help="connections opened at a time")
+    parser.add_argument("--port", type=int, default=18300)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Benchmark: aggregate real-time factor of the local inference pool against concurrent streams.
+#
+# Each stream sends fragments of --seconds of audio to inference.InferencePool back to back
+# (the next one as soon as the previous transcript arrives), so the pool is kept saturated.
+# For every stream count it prints
+#   rtf      - wall time / seconds of audio transcribed across all streams (below 1 keeps up)
+#   realtime - how many --seconds streams the pool could keep up with at that load (1 / rtf)
+# plus fragment latency and the mean batch size the workers achieved.
+#
+# --stand-in replaces Whisper with CPU work proportional to the audio length (it doesn't model
+# the gain from batching), for boxes without the model weights.
+#
+# Usage: python bench_inference.py [--wav path.wav] [--streams 1 2 4 8 16 32] [--processes 4]
+#                                  [--batch-size 8] [--seconds 5] [--fragments 4] [--stand-in 0.2]
+import argparse
+import asyncio
+import functools
+import statistics
+import time
+import wave
+import numpy as np
+from inference import InferencePool, load_whisper_engine
+
+SAMPLE_RATE = 16000
+
+
+class StandInEngine:
+    """Burns `factor` CPU seconds per second of audio, in pure Python."""
+    def __init__(self, factor):
+        self.factor = factor
+
+    def transcribe_batch(self, fragments):
+        texts = []
+        for fragment in fragments:
+            deadline = time.process_time() + self.factor * len(fragment) / SAMPLE_RATE
+            while time.process_time() < deadline:
+                sum(range(1000))
+            texts.append(f"{len(fragment)} samples")
+        return texts
+
+
+def load_stand_in(factor, cpu_threads, batch_size):
+    return StandInEngine(factor)
+
+
+def load_fragment(path, seconds):
+    """Returns `seconds` of float32 mono audio from a 16 kHz WAV, or synthetic noise if no file is given."""
+    if path:
+        with wave.open(path, "rb") as wav_file:
+            frames = wav_file.readframes(wav_file.getnframes())
+        audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+        return audio[: SAMPLE_RATE * seconds]
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(SAMPLE_RATE * seconds) * 0.05).astype(np.float32)
+
+
+async def run_stream(pool, audio, fragments, latencies):
+    for _ in range(fragments):
+        start = time.perf_counter()
+        await pool.transcribe(audio)
+        latencies.append(time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wav", help="16 kHz mono WAV to take fragments from (default: noise)")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--cores", default="", help='cores per process, e.g. "0-7;8-15" (default: split evenly)')
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seconds", type=int, default=5, help="audio per fragment")
+    parser.add_argument("--fragments", type=int, default=4, help="fragments per stream")
+    parser.add_argument("--stand-in", type=float, default=0.0, help="CPU seconds per audio second instead of Whisper")
+    args = parser.parse_args()
+
+    audio = load_fragment(args.wav, args.seconds)
+    loader = functools.partial(load_stand_in, args.stand_in) if args.stand_in else load_whisper_engine
+    pool = InferencePool(processes=args.processes, cores=args.cores, batch_size=args.batch_size,
+                         slots=max(args.streams), loader=loader)
+    print(f"processes={pool.processes} cores={pool.cores} batch_size={pool.batch_size} "
+          f"fragment={args.seconds}s engine={'stand-in' if args.stand_in else 'whisper'}")
+    # Warm every worker so model loading isn't counted
+    await asyncio.gather(*(pool.transcribe(audio) for _ in range(pool.processes)))
+
+    for streams in args.streams:
+        fragments_before, batches_before = pool.fragments, pool.batches
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(run_stream(pool, audio, args.fragments, latencies) for _ in range(streams)))
+        elapsed = time.perf_counter() - start
+        rtf = elapsed / (streams * args.fragments * args.seconds)
+        latencies.sort()
+        mean_batch = (pool.fragments - fragments_before) / (pool.batches - batches_before)
+        print(f"streams={streams:3d}  rtf={rtf:6.3f}  realtime={1 / rtf:6.1f} streams  "
+              f"latency p50={statistics.median(latencies):6.2f}s p95={latencies[int(len(latencies) * 0.95) - 1]:6.2f}s  "
+              f"mean batch={mean_batch:4.1f}", flush=True)
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
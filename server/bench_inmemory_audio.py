@@ -0,0 +1,90 @@
+# Benchmark: per-fragment audio preparation through a temp WAV file vs fully in memory.
+#
+# Counts file opens/removals with an audit hook and measures latency for both paths.
+# With --transcribe the local Whisper step is included (needs the model available).
+#
+# Usage: python bench_inmemory_audio.py [--fragments 50] [--rate 32000] [--transcribe]
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from scipy.io.wavfile import write
+from audio import pcm_to_float32
+from transcribe_whisper import wav_bytes_io, transcribe_local
+
+file_events = {"open": 0, "os.remove": 0}
+
+
+def audit(event, args):
+    if event in file_events:
+        file_events[event] += 1
+
+
+def file_path_cloud(audio, rate):
+    # What tasks.translate_fragment used to do: save_wav, then reopen for upload
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        write(f.name, rate, audio)
+    with open(f.name, "rb") as audio_file:
+        data = audio_file.read()
+    os.remove(f.name)  # The server never did this; the benchmark shouldn't leak too
+    return data
+
+
+def memory_cloud(audio, rate):
+    return wav_bytes_io(audio, rate).getvalue()
+
+
+def file_path_local(audio, rate, do_transcribe):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        write(f.name, rate, audio)
+    text = transcribe_local(f.name) if do_transcribe else f.name
+    os.remove(f.name)
+    return text
+
+
+def memory_local(audio, rate, do_transcribe):
+    # Includes the resample to 16 kHz, which the file path defers to faster-whisper's decoder
+    samples = pcm_to_float32(audio, rate)
+    return transcribe_local(samples) if do_transcribe else samples
+
+
+def run(label, fn, fragments):
+    for key in file_events:
+        file_events[key] = 0
+    timings = []
+    for audio, rate in fragments:
+        start = time.perf_counter()
+        fn(audio, rate)
+        timings.append(time.perf_counter() - start)
+    per_fragment = {k: v / len(fragments) for k, v in file_events.items()}
+    print(f"{label:<18} mean={statistics.mean(timings) * 1000:7.2f} ms  "
+          f"p50={statistics.median(timings) * 1000:7.2f} ms  "
+          f"opens/fragment={per_fragment['open']:.1f}  removes/fragment={per_fragment['os.remove']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fragments", type=int, default=50)
+    parser.add_argument("--seconds", type=int, default=5)
+    parser.add_argument("--rate", type=int, default=32000)
+    parser.add_argument("--transcribe", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    fragments = [
+        ((rng.standard_normal(args.rate * args.seconds) * 1000).astype(np.int16), args.rate)
+        for _ in range(args.fragments)
+    ]
+    sys.addaudithook(audit)
+
+    run("cloud via file", file_path_cloud, fragments)
+    run("cloud in memory", memory_cloud, fragments)
+    run("local via file", lambda a, r: file_path_local(a, r, args.transcribe), fragments)
+    run("local in memory", lambda a, r: memory_local(a, r, args.transcribe), fragments)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# Benchmark and crash-injection check for the pipeline journal (journal.py).
+#
+# throughput - drives journal.Journal the way the pipeline does: per fragment, a durable voice
+#              append with its samples, then an ack once the pipeline is through. It runs
+#              --producers concurrently, with group commit and with one commit per record, and
+#              prints fragments/s, append latency and records per fsync.
+# crash      - runs the real pipeline (voice.enqueue_fragment -> tasks workers -> journal) in a
+#              child process and kills it with SIGKILL at random points --crashes times. Cloud
+#              transcription and the agent call are the real transcribe_cloud_from_memory and
+#              agentCall_async, talking to stand-in transcription and /diarize endpoints in the
+#              child that answer --fail-rate and --agent-fail-rate of the requests with HTTP 500.
+#              After a final clean run it checks that every fragment enqueue_fragment accepted
+#              reached the agent at least once or was set aside in the journal, and reports
+#              repeats (the same fragment ID again, which the agent skips).
+#
+# Usage: python bench_journal.py throughput [--producers 1 8 32 128] [--fragments 1000] [--seconds 5]
+#        python bench_journal.py crash [--crashes 10] [--fragments 300] [--fail-rate 0.05] [--agent-fail-rate 0.05]
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+# Fragment i starts with this sample, which survives the float32 -> int16 WAV upload as i
+def marker_sample(index) -> float:
+    return (index + 0.5) / 32767
+
+
+def marker_index(sample) -> int:
+    return int(sample * 32767) if isinstance(sample, (float, np.floating)) else int(sample)
+
+
+def start_endpoints(fail_rate, agent_fail_rate, delivered) -> str:
+    """Stand-ins for POST /v1/audio/transcriptions, which names the fragment it was sent, and the
+    agent's POST /diarize, which logs each fragment it labels to `delivered`. Returns their base URL."""
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if self.path.endswith("/diarize"):
+                if random.random() < agent_fail_rate:
+                    self.reply(500, {"detail": "injected agent failure"})
+                    return
+                payload = json.loads(body)
+                with lock:
+                    delivered.write(f"{payload['symptoms'][1:]} {payload['fragment_id']}\n")
+                    delivered.flush()
+                self.reply(200, {"diagnosis_summary": [], "report": None})
+                return
+            if random.random() < fail_rate:
+                # x-should-retry: the SDK's own retries would hide the failure from the pipeline
+                self.reply(500, {"error": {"message": "injected transcription failure"}}, {"x-should-retry": "false"})
+                return
+            # The multipart body carries the WAV; its samples follow the "data" chunk header
+            data = body.index(b"data", body.index(b"RIFF")) + 8
+            self.reply(200, {"text": f"m{marker_index(np.frombuffer(body[data:data + 2], dtype=np.int16)[0])}"})
+
+        def reply(self, status, payload, headers=None):
+            content = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+async def produce(journal, samples, count, latencies):
+    for _ in range(count):
+        start = time.perf_counter()
+        voice_id = await journal.append("voice", "bench", {"mode": "c", "duration": 5}, samples)
+        latencies.append(time.perf_counter() - start)
+        journal.ack(voice_id)
+
+
+async def run_throughput(path, producers, fragments, samples, group_commit):
+    from journal import Journal
+    journal = Journal(path, commit_window=0, group_commit=group_commit)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(produce(journal, samples, fragments // producers, latencies) for _ in range(producers)))
+    elapsed = time.perf_counter() - start
+    stats = journal.stats()
+    await journal.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    latencies.sort()
+    print(f"{'group' if group_commit else 'single':6s} producers={producers:4d}  "
+          f"fragments/s={len(latencies) / elapsed:7.1f}  append p50={statistics.median(latencies) * 1000:6.1f} ms "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:6.1f} ms  "
+          f"records/commit={stats['records_per_commit']:5.1f}  commit={stats['commit_ms']:5.2f} ms", flush=True)
+
+
+def throughput(args):
+    samples = (np.random.default_rng(0).standard_normal(int(SAMPLE_RATE * args.seconds)) * 0.05).astype(np.float32)
+    directory = args.dir or tempfile.mkdtemp()
+    print(f"fragment={args.seconds}s ({samples.nbytes // 1024} KiB)  fragments={args.fragments}  dir={directory}")
+    for group_commit in (True, False):
+        for producers in args.producers:
+            path = os.path.join(directory, "bench-journal.sqlite3")
+            asyncio.run(run_throughput(path, producers, args.fragments, samples, group_commit))
+
+
+def crash_child(path, directory, fragments, fail_rate, agent_fail_rate, ready):
+    """One life of the pipeline: replays what the last one left, then enqueues the fragments not yet accepted."""
+    base_url = start_endpoints(fail_rate, agent_fail_rate, open(os.path.join(directory, "delivered"), "a"))
+    os.environ.update({
+        "JOURNAL_PATH": path,
+        "CACHE_PATH": "",
+        "PIPELINE_RETRIES": "3",
+        "OPENAI_BASE_URL": f"{base_url}/v1/",
+        "OPENAI_API_KEY": "crash-test",
+        "AGENT_URL": f"{base_url}/diarize",
+        "AGENT_INPROCESS": "0",
+        "STREAM_TOKENS": "0",
+    })
+    import tasks
+    from journal import journal
+    from sessions import session_manager
+    from voice import enqueue_fragment
+
+    async def run():
+        journal.start()
+        workers = [asyncio.create_task(tasks.run_fragment_workers())]
+        await tasks.replay_journal()
+        ready.set()
+        accepted_path = os.path.join(directory, "accepted")
+        with open(accepted_path, "a+") as accepted:
+            accepted.seek(0)
+            done = [int(line) for line in accepted.read().split()]
+            session = session_manager.get_or_create("crash-test")
+            for index in range(max(done, default=-1) + 1, fragments):
+                samples = np.zeros(SAMPLE_RATE // 10, dtype=np.float32)
+                samples[0] = marker_sample(index)
+                await enqueue_fragment(session, {"mode": "c", "duration": 0.1, "samples": samples})
+                accepted.write(f"{index}\n")
+                accepted.flush()
+        # Done when every record is acked (or set aside); acks are committed in the background
+        db = sqlite3.connect(path)
+        while db.execute("SELECT COUNT(*) FROM journal WHERE error IS NULL").fetchone()[0]:
+            await asyncio.sleep(0.05)
+        for worker in workers:
+            worker.cancel()
+        await journal.close()
+
+    asyncio.run(run())
+
+
+def count_lines(directory, name):
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return sum(1 for _ in f)
+
+
+def crash(args):
+    directory = args.dir or tempfile.mkdtemp()
+    path = os.path.join(directory, "crash-journal.sqlite3")
+    context = multiprocessing.get_context("spawn")
+    rng = random.Random(args.seed)
+    for life in range(args.crashes + 1):
+        ready = context.Event()
+        child = context.Process(target=crash_child, args=(path, directory, args.fragments, args.fail_rate, args.agent_fail_rate, ready))
+        child.start()
+        if life < args.crashes:
+            # Kill at a random point after startup (imports take a while), mid-replay or mid-stream
+            ready.wait(args.timeout)
+            child.join(rng.uniform(0, args.max_life))
+            if child.is_alive():
+                child.kill()  # SIGKILL: no shutdown hooks, the journal is all that is left
+            child.join()
+        else:
+            child.join(args.timeout)
+            if child.is_alive():
+                child.kill()
+                sys.exit("final run did not finish")
+        print(f"life {life}: exit code {child.exitcode}  accepted={count_lines(directory, 'accepted')}  "
+              f"delivered={count_lines(directory, 'delivered')}", flush=True)
+
+    with open(os.path.join(directory, "accepted")) as f:
+        accepted = {int(line) for line in f.read().split()}
+    with open(os.path.join(directory, "delivered")) as f:
+        delivered = [tuple(line.split()) for line in f if line.strip()]
+    indices = [int(index) for index, _ in delivered]
+    db = sqlite3.connect(path)
+    set_aside = {marker_index(np.frombuffer(blob, dtype=np.float32)[0]) for blob, in
+                 db.execute("SELECT samples FROM journal WHERE error IS NOT NULL AND stage = 'voice'")}
+    missing = accepted - set(indices) - set_aside
+    replays = len(delivered) - len(set(delivered))
+    resent = len(set(delivered)) - len(set(indices))
+    left = db.execute("SELECT COUNT(*) FROM journal WHERE error IS NULL").fetchone()[0]
+    print(f"accepted={len(accepted)}  delivered={len(set(indices))}  missing={len(missing)}  "
+          f"replayed={replays} (same fragment ID)  resent={resent} (journaled, killed before the producer logged it)  "
+          f"left in journal={left}  set aside={len(set_aside)} (retries used up)")
+    if missing or left:
+        sys.exit(f"lost fragments: {sorted(missing)[:20]}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("throughput")
+    bench.add_argument("--producers", type=int, nargs="+", default=[1, 8, 32, 128])
+    bench.add_argument("--fragments", type=int, default=1000)
+    bench.add_argument("--seconds", type=float, default=5, help="audio per fragment")
+    bench.add_argument("--dir", help="where to put the journal (default: a temp dir)")
+    check = commands.add_parser("crash")
+    check.add_argument("--crashes", type=int, default=10)
+    check.add_argument("--fragments", type=int, default=300)
+    check.add_argument("--fail-rate", type=float, default=0.05, help="share of transcription requests that fail")
+    check.add_argument("--agent-fail-rate", type=float, default=0.05, help="share of agent requests that fail")
+    check.add_argument("--max-life", type=float, default=1.0, help="longest a child runs after startup before it is killed (s)")
+    check.add_argument("--timeout", type=float, default=120)
+    check.add_argument("--seed", type=int, default=0)
+    check.add_argument("--dir", help="where to put the journal and logs (default: a temp dir)")
+    args = parser.parse_args()
+    throughput(args) if args.command == "throughput" else crash(args)
+
+
+if __name__ == "__main__":
+    main()
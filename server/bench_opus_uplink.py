@@ -0,0 +1,124 @@
+# Benchmark: uplink bandwidth and server decode CPU per stream for each way the voice socket takes audio.
+#
+#   json-wav  - the compatibility path: a base64 WAV per 5 s chunk inside a JSON text frame
+#   pcm       - binary int16 PCM frames at the capture rate (48 kHz here)
+#   webm      - MediaRecorder's audio/webm;codecs=opus chunks, decoded by audio.AudioStreamBuffer
+#               as they arrive (the WebM is made with PyAV and cut into --chunk-ms pieces, which
+#               don't line up with blocks, like the browser's)
+#
+# For each it prints the bytes on the wire per minute of audio and the CPU the server spends
+# turning a minute of it into 16 kHz float32 fragments.
+#
+# Usage: python bench_opus_uplink.py [--seconds 60] [--bitrate 32000] [--chunk-ms 1000]
+import argparse
+import base64
+import io
+import json
+import time
+import wave
+import numpy as np
+from audio import AudioStreamBuffer, OpusDecoder, pcm_to_float32
+
+RATE = OpusDecoder.RATE
+
+
+def cpu_ms(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        cpu = time.process_time()
+        fn()
+        best = min(best, time.process_time() - cpu)
+    return best * 1000
+
+
+def speech_like(seconds):
+    """A voiced tone with a syllable-rate envelope and some noise, so Opus has something to code."""
+    rng = np.random.default_rng(0)
+    t = np.arange(RATE * seconds) / RATE
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    voice = sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((180, 360, 540, 1100), 1))
+    return (voice * envelope * 5000 + rng.standard_normal(len(t)) * 300).astype(np.int16)
+
+
+def json_wav_messages(pcm, duration):
+    messages = []
+    chunk = int(RATE * duration)
+    for start in range(0, len(pcm), chunk):
+        wav_buffer = io.BytesIO()
+        with wave.open(wav_buffer, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(RATE)
+            wav_file.writeframes(pcm[start:start + chunk].tobytes())
+        audio = base64.b64encode(wav_buffer.getvalue()).decode()
+        messages.append(json.dumps({"action": "transcribe_translate", "mode": "c", "audio": audio}))
+    return messages
+
+
+def decode_json_wav(messages):
+    for message in messages:
+        with wave.open(io.BytesIO(base64.b64decode(json.loads(message)["audio"])), "rb") as wav_file:
+            frames = wav_file.readframes(wav_file.getnframes())
+        pcm_to_float32(np.frombuffer(frames, dtype=np.int16), RATE)
+
+
+def webm_bytes(pcm, bitrate):
+    import av
+    buffer = io.BytesIO()
+    container = av.open(buffer, "w", format="webm")
+    stream = container.add_stream("libopus", rate=RATE)
+    stream.layout, stream.bit_rate = "mono", bitrate
+    for start in range(0, len(pcm), 960):
+        frame = av.AudioFrame.from_ndarray(pcm[None, start:start + 960], format="s16", layout="mono")
+        frame.sample_rate, frame.pts = RATE, start
+        for packet in stream.encode(frame):
+            container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
+    container.close()
+    return buffer.getvalue()
+
+
+def stream(frames, duration, encoding):
+    buffer = AudioStreamBuffer(RATE, duration, encoding)
+    samples = 0
+    for frame in frames:
+        samples += sum(len(fragment) for fragment in buffer.write(frame))
+    tail = buffer.flush()
+    return samples + (len(tail) if tail is not None else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--bitrate", type=int, default=32000, help="Opus bit rate")
+    parser.add_argument("--chunk-ms", type=int, default=1000, help="MediaRecorder timeslice")
+    parser.add_argument("--frame-ms", type=int, default=100, help="binary PCM frame size")
+    parser.add_argument("--duration", type=float, default=5, help="fragment length (s)")
+    args = parser.parse_args()
+
+    pcm = speech_like(args.seconds)
+    messages = json_wav_messages(pcm, args.duration)
+    frame = RATE * args.frame_ms // 1000
+    frames = [pcm[i:i + frame].tobytes() for i in range(0, len(pcm), frame)]
+    webm = webm_bytes(pcm, args.bitrate)
+    # MediaRecorder emits roughly equal byte counts per timeslice, split wherever the muxer is
+    chunk = max(1, len(webm) * args.chunk_ms // (args.seconds * 1000))
+    chunks = [webm[i:i + chunk] for i in range(0, len(webm), chunk)]
+
+    per_minute = 60 / args.seconds
+    rows = [
+        ("json-wav", sum(map(len, messages)), len(messages), lambda: decode_json_wav(messages)),
+        ("pcm", sum(map(len, frames)), len(frames), lambda: stream(frames, args.duration, "pcm_s16le")),
+        ("webm", len(webm), len(chunks), lambda: stream(chunks, args.duration, "webm")),
+    ]
+    print(f"audio={args.seconds}s at {RATE} Hz  opus={args.bitrate // 1000} kbit/s  timeslice={args.chunk_ms} ms")
+    for name, wire, count, decode in rows:
+        print(f"{name:9s} wire={wire * per_minute / 1e6:6.2f} MB/min ({wire * 8 / args.seconds / 1000:6.1f} kbit/s, "
+              f"{count} frames)  decode={cpu_ms(decode) * per_minute:7.1f} ms CPU per stream-minute")
+    samples = stream(chunks, args.duration, "webm")
+    print(f"webm decoded to {samples / 16000:.2f}s of 16 kHz audio ({samples - args.seconds * 16000:+d} samples: Opus encoder delay, not trimmed)")
+
+
+if __name__ == "__main__":
+    main()
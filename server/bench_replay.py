@@ -0,0 +1,307 @@
+# Offline replay benchmark: recorded voice sessions against the full startall.py stack, with
+# stub_openai.py standing in for Whisper, GPT and the diarization model.
+#
+# Each replayed session connects its voice, transcribed and modelresp sockets to the shared
+# port and sends the recording's messages at their recorded times (divided by --speed).
+# Recordings come from VOICE_RECORD_DIR (see recording.py), from a WAV via `record-wav`, or are
+# synthesized (--synthetic). The agent runs in-process (AGENT_INPROCESS=1) against the stub.
+#
+# A fragment is "ready" when its last audio frame was sent (the harness cuts the stream with
+# the same audio.AudioStreamBuffer the server uses). The k-th complete transcript and the k-th
+# model response of a session are matched to its k-th fragment, so recordings in mode "s"
+# (where VAD decides the fragments) are replayed but not matched. Reports end-to-end latency
+# percentiles to the transcript and to the agent's response, throughput, each worker's
+# per-stage dwell times and memory, and writes them all as JSON with --out. `compare` diffs
+# two result files and fails when a latency or throughput figure regressed past --tolerance.
+#
+# Usage: python bench_replay.py replay [recording.jsonl ...] [--synthetic 30] [--sessions 8] [--speed 1]
+#                                      [--workers 1] [--out results.json] [--chat-latency 0.4] [--jitter 0.1]
+#        python bench_replay.py record-wav speech.wav recording.jsonl [--frame-ms 100] [--translate-to Spanish]
+#        python bench_replay.py compare baseline.json results.json [--tolerance 0.2]
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+import wave
+import httpx
+import numpy as np
+import uvicorn
+import websockets
+import startall
+import stub_openai
+from audio import AudioStreamBuffer
+from recording import load_recording, recording_from_wav, save_recording
+
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(len(ordered) * q))] * 1000, 1)
+    return {"count": len(ordered), "p50": round(statistics.median(ordered) * 1000, 1), "p90": pick(0.9),
+            "p99": pick(0.99), "max": round(ordered[-1] * 1000, 1)}
+
+
+def synthetic_recording(seconds, translate_to, rate=48000):
+    """A browser-like PCM stream of a voiced tone with pauses, built through a temporary WAV."""
+    t = np.arange(rate * seconds) / rate
+    rng = np.random.default_rng(0)
+    pcm = (np.sin(2 * np.pi * 180 * t) * (np.sin(2 * np.pi * 0.3 * t) > -0.3) * 6000
+           + rng.standard_normal(len(t)) * 200).astype(np.int16)
+    with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+        with wave.open(f.name, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(rate)
+            wav_file.writeframes(pcm.tobytes())
+        return recording_from_wav(f.name, translate_to=translate_to)
+
+
+class Fragmenter:
+    """Tracks which sent messages complete a server-side fragment, by cutting the stream the same way."""
+    def __init__(self):
+        self.buffer = None
+        self.matched = True
+
+    def fragments_in(self, message) -> int:
+        if isinstance(message, bytes):
+            return len(self.buffer.write(message)) if self.buffer is not None else 0
+        payload = json.loads(message)
+        action = payload.get("action")
+        if action == "start_stream":
+            encoding = payload.get("encoding", "pcm_s16le")
+            mode = payload.get("mode", "c").lower()
+            self.matched = self.matched and mode != "s"
+            rate = int(payload["sample_rate"]) if encoding == "pcm_s16le" else 48000
+            self.buffer = AudioStreamBuffer(rate, payload.get("duration", 1 if mode == "s" else 5), encoding)
+        elif action == "end_stream" and self.buffer is not None:
+            tail, self.buffer = self.buffer.flush(), None
+            return int(tail is not None)
+        elif action == "transcribe_translate":
+            return 1
+        return 0
+
+
+async def connect_voice(port, session_id):
+    """Connects to the shared port and follows a redirect to the session's owner."""
+    voice = await websockets.connect(f"ws://127.0.0.1:{port}/voice/ws?session={session_id}", max_size=None)
+    status = json.loads(await voice.recv())
+    if status["status"] == "redirect":
+        await voice.close()
+        voice = await websockets.connect(f"ws://127.0.0.1:{status['port']}/voice/ws?session={session_id}", max_size=None)
+        status = json.loads(await voice.recv())
+    assert status["status"] == "connected", status
+    return voice
+
+
+async def collect(socket, times):
+    """Records when each complete, final message arrives."""
+    async for message in socket:
+        payload = json.loads(message)
+        if payload.get("type") == "complete" and not payload.get("partial"):
+            times.append(time.perf_counter())
+
+
+async def run_session(recording, port, speed, drain, results):
+    session_id = uuid.uuid4().hex
+    fragmenter = Fragmenter()
+    ready, transcripts, responses = [], [], []
+    async with websockets.connect(f"ws://127.0.0.1:{port}/transcribed/ws?session={session_id}") as transcript, \
+            websockets.connect(f"ws://127.0.0.1:{port}/modelresp/ws?session={session_id}") as modelresp:
+        collectors = [asyncio.create_task(collect(transcript, transcripts)),
+                      asyncio.create_task(collect(modelresp, responses))]
+        voice = await connect_voice(port, session_id)
+        listener = asyncio.create_task(voice.recv())  # Status messages aren't needed; keep reading
+        start = time.perf_counter()
+        for t, message in recording:
+            delay = start + t / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if isinstance(message, str):
+                payload = json.loads(message)
+                payload.pop("session", None)  # Every replay gets its own session
+                message = json.dumps(payload)
+            await voice.send(message)
+            ready.extend([time.perf_counter()] * fragmenter.fragments_in(message))
+        sent = time.perf_counter() - start
+        deadline = time.perf_counter() + drain
+        while (len(transcripts) < len(ready) or len(responses) < len(ready)) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        listener.cancel()
+        await voice.close()
+        for task in collectors:
+            task.cancel()
+    results.append({
+        "ready": len(ready), "transcripts": len(transcripts), "responses": len(responses), "send_seconds": sent,
+        "matched": fragmenter.matched,
+        "transcript_latency": [done - at for at, done in zip(ready, transcripts)] if fragmenter.matched else [],
+        "response_latency": [done - at for at, done in zip(ready, responses)] if fragmenter.matched else [],
+    })
+
+
+async def wait_ready(ports):
+    async with httpx.AsyncClient() as client:
+        for port in ports:
+            while True:
+                try:
+                    if (await client.get(f"http://127.0.0.1:{port}/voice/stats")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+
+
+async def replay(args):
+    recordings = [load_recording(path) for path in args.recordings]
+    if not recordings:
+        recordings = [synthetic_recording(args.synthetic, args.translate_to)]
+    audio_seconds = [recording[-1][0] for recording in recordings]
+
+    stub_openai.configure(args.transcribe_latency, args.chat_latency, args.jitter, args.token_delay, args.seed)
+    stub = uvicorn.Server(uvicorn.Config(stub_openai.stub, host="127.0.0.1", port=args.stub_port, log_level="warning"))
+    stub_task = asyncio.create_task(stub.serve())
+    # The workers are spawned, so they see this environment when they import the app
+    scratch = tempfile.mkdtemp()
+    os.environ.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.stub_port}/v1/",
+        "OPENAI_API_KEY": "replay",
+        "AGENT_INPROCESS": "1",
+        "JOURNAL_PATH": os.path.join(scratch, "journal.sqlite3"),
+    })
+    if not args.cache:
+        # Replays repeat the same audio; a warm cache would hide the stages
+        os.environ.update({"CACHE_PATH": "", "CACHE_MEMORY_ENTRIES": "0"})
+    supervisor = asyncio.create_task(startall.supervise(args.workers, "127.0.0.1", args.port))
+    worker_ports = [args.port] if args.workers == 1 else [args.port + 1 + i for i in range(args.workers)]
+    await wait_ready(worker_ports)
+
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_session(recordings[i % len(recordings)], args.port, args.speed, args.drain, results)
+        for i in range(args.sessions)
+    ))
+    elapsed = time.perf_counter() - start
+
+    workers = {}
+    async with httpx.AsyncClient() as client:
+        for index, port in enumerate(worker_ports):
+            stats = (await client.get(f"http://127.0.0.1:{port}/voice/stats")).json()
+            workers[index] = {"stages": stats["stages"], "memory": stats["memory"], "loop_lag": stats["loop_lag"]}
+        stub_stats = (await client.get(f"http://127.0.0.1:{args.stub_port}/stats")).json()
+    supervisor.cancel()
+    await asyncio.gather(supervisor, return_exceptions=True)
+    stub.should_exit = True
+    await stub_task
+
+    total = lambda key: sum(result[key] for result in results)
+    replayed_audio = sum(audio_seconds[i % len(recordings)] for i in range(args.sessions))
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("command", "out")},
+        "wall_seconds": round(elapsed, 2),
+        "fragments": {"ready": total("ready"), "transcribed": total("transcripts"), "answered": total("responses")},
+        "throughput": {
+            "fragments_per_s": round(total("transcripts") / elapsed, 2),
+            "audio_seconds_per_s": round(replayed_audio / elapsed, 2),
+        },
+        "latency_ms": {
+            "transcript": percentiles([l for result in results for l in result["transcript_latency"]]),
+            "agent_response": percentiles([l for result in results for l in result["response_latency"]]),
+        },
+        "memory_mb": {
+            "rss_total": round(sum(worker["memory"]["rss_mb"] for worker in workers.values()), 1),
+            "peak_rss_max": max(worker["memory"]["peak_rss_mb"] for worker in workers.values()),
+        },
+        "workers": workers,
+        "stub_requests": stub_stats,
+    }
+    print(f"sessions={args.sessions} speed={args.speed}x workers={args.workers} wall={elapsed:.1f}s  "
+          f"fragments {report['fragments']}  throughput {report['throughput']}")
+    for name, summary in report["latency_ms"].items():
+        print(f"  {name:15s} {summary}")
+    for index, worker in workers.items():
+        stages = {name: (stage["wait_ms"]["p95"], stage["service_ms"]["p95"]) for name, stage in worker["stages"].items()}
+        print(f"  worker {index}: rss={worker['memory']['rss_mb']} MB  stage p95 (wait, service) ms: {stages}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"wrote {args.out}")
+
+
+def compare(args):
+    """Flags latencies that grew, and throughput that fell, by more than the tolerance."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        results = json.load(f)
+    checks = [(("latency_ms", name, q), False) for name in ("transcript", "agent_response") for q in ("p50", "p90", "p99")]
+    checks += [(("throughput", name), True) for name in ("fragments_per_s", "audio_seconds_per_s")]
+    checks += [(("memory_mb", "rss_total"), False)]
+    regressions = 0
+    for path, higher_is_better in checks:
+        before, after = baseline, results
+        for key in path:
+            before, after = (before or {}).get(key), (after or {}).get(key)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        worse = change < -args.tolerance if higher_is_better else change > args.tolerance
+        regressions += worse
+        print(f"{'.'.join(path):32s} {before:10.1f} -> {after:10.1f}  {change:+7.1%}{'  REGRESSION' if worse else ''}")
+    if regressions:
+        sys.exit(f"{regressions} regressions beyond {args.tolerance:.0%}")
+
+
+def record_wav(args):
+    messages = recording_from_wav(args.wav, args.frame_ms, args.mode, args.translate_to, args.duration)
+    save_recording(messages, args.recording)
+    print(f"wrote {len(messages)} messages, {messages[-1][0]:.1f}s, to {args.recording}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("replay")
+    run.add_argument("recordings", nargs="*", help="recordings to replay, round-robin over the sessions")
+    run.add_argument("--synthetic", type=float, default=30, help="seconds of synthetic audio when no recording is given")
+    run.add_argument("--translate-to", default="Spanish", help="for the synthetic recording")
+    run.add_argument("--sessions", type=int, default=8)
+    run.add_argument("--speed", type=float, default=1.0, help="replay N times faster than recorded")
+    run.add_argument("--workers", type=int, default=1)
+    run.add_argument("--drain", type=float, default=60, help="seconds to wait for the last results")
+    run.add_argument("--cache", action="store_true", help="keep the transcription/translation caches on")
+    run.add_argument("--port", type=int, default=18180)
+    run.add_argument("--stub-port", type=int, default=18190)
+    run.add_argument("--transcribe-latency", type=float, default=0.6)
+    run.add_argument("--chat-latency", type=float, default=0.4)
+    run.add_argument("--jitter", type=float, default=0.1)
+    run.add_argument("--token-delay", type=float, default=0.02)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--out", help="write the results as JSON")
+    record = commands.add_parser("record-wav")
+    record.add_argument("wav")
+    record.add_argument("recording")
+    record.add_argument("--frame-ms", type=int, default=100)
+    record.add_argument("--mode", default="c")
+    record.add_argument("--translate-to")
+    record.add_argument("--duration", type=float, default=5)
+    diff = commands.add_parser("compare")
+    diff.add_argument("baseline")
+    diff.add_argument("results")
+    diff.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.command == "replay":
+        asyncio.run(replay(args))
+    elif args.command == "record-wav":
+        record_wav(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
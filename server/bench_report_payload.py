@@ -0,0 +1,95 @@
+# Benchmark: agent response payload size and CPU per call, inline base64 DOCX vs lazy reports.
+#
+# Replays the results of a consultation's /diarize calls (a couple of dialogue pairs each) through
+#   before - the old generate_docx + base64 in every response
+#   after  - reports.Report: record the entries, return a reference, render only on download
+# and prints the JSON payload size and CPU time per call, plus the cost of a download for a
+# lazily rendered report compared with rebuilding the whole document from scratch.
+#
+# Usage: python bench_report_payload.py [--calls 360] [--downloads 10]
+import argparse
+import base64
+import json
+import statistics
+import time
+from io import BytesIO
+from docx import Document
+from reports import Report, format_entry
+
+
+def generate_docx(result):
+    """The per-call report the agent used to inline in every response."""
+    doc = Document()
+    doc.add_heading('Healthcare Diagnosis and Treatment Recommendations', 0)
+    result = " ".join(str(item) for item in result)
+    doc.add_paragraph(result)
+    bio = BytesIO()
+    doc.save(bio)
+    bio.seek(0)
+    return bio
+
+
+def rebuild_docx(entries):
+    doc = Document()
+    doc.add_heading('Healthcare Diagnosis and Treatment Recommendations', 0)
+    for entry in entries:
+        doc.add_paragraph(format_entry(entry))
+    bio = BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+
+def results_for(calls):
+    return [[
+        {"doctor": f"Question {i}: any change in the cough since yesterday?", "patient": f"Answer {i}: a little better."},
+        {"doctor": "Are you sleeping through the night?", "patient": "Mostly, yes."},
+    ] for i in range(calls)]
+
+
+def measure(fn):
+    cpu = time.process_time()
+    value = fn()
+    return value, time.process_time() - cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=360, help="/diarize calls in the consultation")
+    parser.add_argument("--downloads", type=int, default=10, help="report downloads spread over the consultation")
+    args = parser.parse_args()
+    results = results_for(args.calls)
+
+    sizes, cpu = [], []
+    for result in results:
+        payload, spent = measure(lambda: json.dumps({
+            "diagnosis_summary": result,
+            "docx_base64": base64.b64encode(generate_docx(result).read()).decode("utf-8"),
+        }))
+        sizes.append(len(payload))
+        cpu.append(spent)
+    print(f"before  payload p50={statistics.median(sizes) / 1024:7.1f} KiB  cpu/call p50={statistics.median(cpu) * 1000:6.2f} ms  "
+          f"total sent={sum(sizes) / 1024 / 1024:6.1f} MiB")
+
+    report = Report()
+    sizes, cpu, downloads, rebuilds = [], [], [], []
+    every = max(1, args.calls // args.downloads) if args.downloads else 0
+    for i, result in enumerate(results, 1):
+        payload, spent = measure(lambda: json.dumps({
+            "diagnosis_summary": result,
+            "report": {"url": "/report/session", "version": report.add(result)},
+        }))
+        sizes.append(len(payload))
+        cpu.append(spent)
+        if every and i % every == 0:
+            downloads.append(measure(report.render)[1])
+            rebuilds.append(measure(lambda: rebuild_docx(report.entries))[1])
+    print(f"after   payload p50={statistics.median(sizes) / 1024:7.1f} KiB  cpu/call p50={statistics.median(cpu) * 1000:6.2f} ms  "
+          f"total sent={sum(sizes) / 1024 / 1024:6.1f} MiB")
+    if downloads:
+        print(f"download: incremental render p50={statistics.median(downloads) * 1000:.1f} ms "
+              f"last={downloads[-1] * 1000:.1f} ms; full rebuild p50={statistics.median(rebuilds) * 1000:.1f} ms "
+              f"last={rebuilds[-1] * 1000:.1f} ms; repeat download={measure(report.render)[1] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Microbenchmark: CPU per second of audio to turn uplink frames into 16 kHz float32.
+#
+#   one-shot  - what the pipeline did before: buffer int16 at the client's rate, then
+#               resample_poly + float conversion per whole fragment
+#   stream    - audio.AudioStreamBuffer: decode and resample each frame as it arrives, into
+#               the fragment buffer
+#   opus      - AudioStreamBuffer fed one 20 ms Opus packet per frame (decode + 48 kHz -> 16 kHz)
+#
+# Also checks that the streamed output matches resample_poly over the whole stream.
+#
+# Usage: python bench_resample.py [--seconds 60] [--rates 48000 44100 32000 16000] [--frame-ms 100]
+import argparse
+import time
+import numpy as np
+from audio import AudioStreamBuffer, OpusDecoder, pcm_to_float32
+
+
+def cpu_ms_per_audio_second(fn, seconds, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        cpu = time.process_time()
+        fn()
+        best = min(best, time.process_time() - cpu)
+    return best * 1000 / seconds
+
+
+def one_shot(pcm, rate, duration):
+    chunk = int(rate * duration)
+    return [pcm_to_float32(pcm[i:i + chunk], rate) for i in range(0, len(pcm), chunk)]
+
+
+def stream(frames, rate, duration, encoding="pcm_s16le"):
+    buffer = AudioStreamBuffer(rate, duration, encoding)
+    fragments = []
+    for frame in frames:
+        fragments.extend(buffer.write(frame))
+    tail = buffer.flush()
+    if tail is not None:
+        fragments.append(tail)
+    return fragments
+
+
+def opus_packets(pcm):
+    """Encodes 48 kHz int16 PCM into 20 ms Opus packets, like a WebCodecs AudioEncoder would."""
+    import av
+    encoder = av.CodecContext.create("libopus", "w")
+    encoder.sample_rate, encoder.layout, encoder.format, encoder.bit_rate = 48000, "mono", "s16", 32000
+    packets = []
+    for start in range(0, len(pcm) - 959, 960):
+        frame = av.AudioFrame.from_ndarray(pcm[None, start:start + 960], format="s16", layout="mono")
+        frame.sample_rate, frame.pts = 48000, start
+        packets.extend(bytes(packet) for packet in encoder.encode(frame))
+    packets.extend(bytes(packet) for packet in encoder.encode(None))
+    return packets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--rates", type=int, nargs="+", default=[48000, 44100, 32000, 16000])
+    parser.add_argument("--frame-ms", type=int, default=100, help="binary frame size for PCM")
+    parser.add_argument("--duration", type=float, default=5, help="fragment length (s)")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    for rate in args.rates:
+        t = np.arange(rate * args.seconds) / rate
+        pcm = (np.sin(2 * np.pi * 220 * t) * 6000 + rng.standard_normal(len(t)) * 800).astype(np.int16)
+        frame = rate * args.frame_ms // 1000
+        frames = [pcm[i:i + frame].tobytes() for i in range(0, len(pcm), frame)]
+        before = cpu_ms_per_audio_second(lambda: one_shot(pcm, rate, args.duration), args.seconds)
+        after = cpu_ms_per_audio_second(lambda: stream(frames, rate, args.duration), args.seconds)
+        error = np.abs(np.concatenate(stream(frames, rate, args.duration)) - pcm_to_float32(pcm, rate)).max()
+        print(f"{rate:6d} Hz  one-shot={before:6.3f} ms/s  stream={after:6.3f} ms/s  "
+              f"max diff vs whole-stream resample_poly={error:.1e}")
+
+    t = np.arange(OpusDecoder.RATE * args.seconds) / OpusDecoder.RATE
+    pcm = (np.sin(2 * np.pi * 220 * t) * 6000).astype(np.int16)
+    packets = opus_packets(pcm)
+    opus = cpu_ms_per_audio_second(lambda: stream(packets, OpusDecoder.RATE, args.duration, "opus"), args.seconds)
+    print(f"  opus     decode+resample={opus:6.3f} ms/s  "
+          f"uplink={sum(map(len, packets)) * 8 / args.seconds / 1000:.0f} kbit/s (vs {OpusDecoder.RATE * 16 // 1000} kbit/s PCM)")
+
+
+if __name__ == "__main__":
+    main()
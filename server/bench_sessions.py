@@ -0,0 +1,112 @@
+# Load test: N concurrent sessions through the voice and transcribed servers.
+#
+# Runs the voice/transcribed apps and pipeline workers in-process with a stand-in transcriber
+# (configurable latency) that echoes a marker embedded in each fragment's samples. Every
+# session streams its own fragments and checks that it only receives its own transcripts.
+# Reports per-session delivery latency percentiles and isolation violations.
+#
+# Usage: python bench_sessions.py [--sessions 20] [--fragments 5] [--latency 0.2]
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+import numpy as np
+import websockets
+from uvicorn.config import Config
+from uvicorn.server import Server
+import tasks
+from voice import voiceapp
+from transcribed import transcribeapp
+
+SAMPLE_RATE = 16000
+
+
+def install_stand_ins(latency):
+    def transcribe(audio, rate):
+        time.sleep(latency)
+        # The server hands over 16 kHz float32; the markers were sent as int16 at 16 kHz
+        return f"s{round(audio[0] * 32768)}-f{round(audio[1] * 32768)}"
+
+    async def agent_call(text, session_id=None, stream=False, fragment_id=None):
+        pass
+
+    tasks.transcribe_cloud_from_memory = transcribe
+    tasks.agentCall_async = agent_call
+    tasks.transcription_cache.clear()  # Otherwise earlier runs are served from disk
+
+
+async def run_session(index, fragments, voice_port, transcribed_port, results):
+    session_id = uuid.uuid4().hex
+    sent_at = {}
+    latencies = []
+    violations = 0
+    async with websockets.connect(f"ws://127.0.0.1:{transcribed_port}/ws?session={session_id}") as transcript, \
+            websockets.connect(f"ws://127.0.0.1:{voice_port}/ws?session={session_id}") as voice:
+        await voice.recv()  # {"status": "connected"}
+        await voice.send(json.dumps({"action": "start_stream", "mode": "c", "sample_rate": SAMPLE_RATE, "duration": 1}))
+        for fragment in range(fragments):
+            pcm = np.zeros(SAMPLE_RATE, dtype=np.int16)
+            pcm[0], pcm[1] = index, fragment
+            sent_at[f"s{index}-f{fragment}"] = time.perf_counter()
+            await voice.send(pcm.tobytes())
+
+        while len(latencies) < fragments:
+            message = await transcript.recv()
+            payload = json.loads(message)
+            text = payload["translation_output"]
+            if payload.get("session") != session_id or text not in sent_at:
+                violations += 1
+                continue
+            latencies.append(time.perf_counter() - sent_at.pop(text))
+    results.append((latencies, violations))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--fragments", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="stand-in transcription latency (s)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--voice-port", type=int, default=18081)
+    parser.add_argument("--transcribed-port", type=int, default=16081)
+    args = parser.parse_args()
+
+    install_stand_ins(args.latency)
+    servers = [
+        Server(Config(voiceapp, host="127.0.0.1", port=args.voice_port, log_level="warning")),
+        Server(Config(transcribeapp, host="127.0.0.1", port=args.transcribed_port, log_level="warning")),
+    ]
+    background = [asyncio.create_task(server.serve()) for server in servers]
+    background.append(asyncio.create_task(tasks.run_fragment_workers(args.workers)))
+    while not all(server.started for server in servers):
+        await asyncio.sleep(0.05)
+
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_session(i, args.fragments, args.voice_port, args.transcribed_port, results)
+        for i in range(args.sessions)
+    ))
+    elapsed = time.perf_counter() - start
+
+    per_session_p50 = sorted(statistics.median(latencies) for latencies, _ in results)
+    all_latencies = sorted(l for latencies, _ in results for l in latencies)
+    violations = sum(v for _, v in results)
+    print(f"sessions={args.sessions} fragments/session={args.fragments} elapsed={elapsed:.1f}s")
+    print(f"latency p50={statistics.median(all_latencies):.2f}s "
+          f"p95={all_latencies[int(len(all_latencies) * 0.95) - 1]:.2f}s "
+          f"worst session p50={per_session_p50[-1]:.2f}s")
+    print(f"isolation violations={violations}")
+
+    for server in servers:
+        # The subscriber endpoints never read, so don't wait for them to close gracefully
+        server.should_exit = server.force_exit = True
+    await asyncio.wait(background[:len(servers)], timeout=5)
+    for task in background:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
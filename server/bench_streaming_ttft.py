@@ -0,0 +1,140 @@
+# Benchmark: time to first token vs time to full translation, with and without token streaming.
+#
+# Runs the voice/transcribed apps and pipeline workers in-process with a stand-in transcriber,
+# and points the translator at a stand-in OpenAI server that streams its reply token by token.
+# For each fragment the client records when the first piece of its translation arrived (a
+# "delta", or the "complete" message when not streaming) and when the complete message arrived.
+#
+# Usage: python bench_streaming_ttft.py [--fragments 10] [--tokens 60] [--token-delay 0.03]
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+import numpy as np
+import openai
+import uvicorn
+import websockets
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import metrics
+import tasks
+import translate_openai
+from voice import voiceapp
+from transcribed import transcribeapp
+
+SAMPLE_RATE = 16000
+
+stub = FastAPI()
+stub.state.latency = 0.4  # Seconds before the first token
+stub.state.tokens = 60
+stub.state.token_delay = 0.03
+
+
+@stub.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    words = [f"palabra{i} " for i in range(stub.state.tokens)]
+
+    def chunk(content):
+        return {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]}
+
+    if not body.get("stream"):
+        await asyncio.sleep(stub.state.latency + stub.state.token_delay * len(words))
+        message = {"role": "assistant", "content": "".join(words)}
+        return {"id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}]}
+
+    async def events():
+        await asyncio.sleep(stub.state.latency)
+        for word in words:
+            yield f"data: {json.dumps(chunk(word))}\n\n"
+            await asyncio.sleep(stub.state.token_delay)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def install_stand_ins():
+    def transcribe(audio, rate):
+        return f"fragment {round(audio[0] * 32768)}"
+
+    async def agent_call(text, session_id=None, stream=False, fragment_id=None):
+        pass
+
+    tasks.transcribe_cloud_from_memory = transcribe
+    tasks.agentCall_async = agent_call
+
+
+async def run(stream_tokens, fragments, voice_port, transcribed_port):
+    session_id = uuid.uuid4().hex
+    first, complete = [], []
+    async with websockets.connect(f"ws://127.0.0.1:{transcribed_port}/ws?session={session_id}") as transcript, \
+            websockets.connect(f"ws://127.0.0.1:{voice_port}/ws?session={session_id}") as voice:
+        await voice.recv()
+        await voice.send(json.dumps({"action": "start_stream", "mode": "c", "sample_rate": SAMPLE_RATE,
+                                     "duration": 1, "translate_to": "Spanish", "stream_tokens": stream_tokens}))
+        for fragment in range(fragments):
+            pcm = np.zeros(SAMPLE_RATE, dtype=np.int16)
+            pcm[0] = fragment
+            sent_at = time.perf_counter()
+            await voice.send(pcm.tobytes())
+            first_at = None
+            while True:
+                message = await transcript.recv()
+                payload = json.loads(message)
+                first_at = first_at or time.perf_counter()
+                if payload["type"] == "complete":
+                    break
+            first.append(first_at - sent_at)
+            complete.append(time.perf_counter() - sent_at)
+    return first, complete
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fragments", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.4, help="stand-in latency to the first token (s)")
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--token-delay", type=float, default=0.03)
+    parser.add_argument("--voice-port", type=int, default=18081)
+    parser.add_argument("--transcribed-port", type=int, default=16081)
+    parser.add_argument("--stub-port", type=int, default=18092)
+    args = parser.parse_args()
+
+    stub.state.latency, stub.state.tokens, stub.state.token_delay = args.latency, args.tokens, args.token_delay
+    install_stand_ins()
+    openai.base_url = f"http://127.0.0.1:{args.stub_port}/v1/"
+    openai.api_key = "bench"
+    translate_openai._async_client = None
+    servers = [
+        uvicorn.Server(uvicorn.Config(voiceapp, host="127.0.0.1", port=args.voice_port, log_level="warning")),
+        uvicorn.Server(uvicorn.Config(transcribeapp, host="127.0.0.1", port=args.transcribed_port, log_level="warning")),
+        uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=args.stub_port, log_level="warning")),
+    ]
+    background = [asyncio.create_task(server.serve()) for server in servers]
+    background.append(asyncio.create_task(tasks.run_fragment_workers(1)))
+    while not all(server.started for server in servers):
+        await asyncio.sleep(0.05)
+
+    for label, stream_tokens in (("complete only", False), ("streaming", True)):
+        tasks.transcription_cache.clear()  # Otherwise the second run is served from the cache
+        tasks.translation_cache.clear()
+        first, complete = await run(stream_tokens, args.fragments, args.voice_port, args.transcribed_port)
+        print(f"{label:14s} first text p50={statistics.median(first):.2f}s  "
+              f"complete p50={statistics.median(complete):.2f}s")
+    print("translate_stream stage:", metrics.get_stage("translate_stream").snapshot())
+
+    for server in servers:
+        server.should_exit = server.force_exit = True
+    await asyncio.wait(background[:len(servers)], timeout=5)
+    for task in background:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
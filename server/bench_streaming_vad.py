@@ -0,0 +1,73 @@
+# Replay benchmark: fixed 5 s chunks vs VAD-segmented streaming transcription.
+#
+# Replays recorded WAVs through both paths and reports real-time factor (processing time /
+# audio duration), the fraction of audio never sent to Whisper, Whisper calls per minute and
+# how much audio had arrived when the first words came out.
+#
+# Usage: python bench_streaming_vad.py recording1.wav [recording2.wav ...] [--chunk 1.0]
+import argparse
+import time
+import wave
+import numpy as np
+from audio import pcm_to_float32
+from transcribe_whisper import StreamingTranscriber, WHISPER_SAMPLE_RATE, transcribe_local
+
+
+def load_wav(path):
+    with wave.open(path, "rb") as wav_file:
+        if wav_file.getnchannels() != 1 or wav_file.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected mono int16 WAV")
+        rate = wav_file.getframerate()
+        pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+    return pcm_to_float32(pcm, rate)
+
+
+def replay_fixed(audio, chunk_seconds=5):
+    chunk = chunk_seconds * WHISPER_SAMPLE_RATE
+    calls = 0
+    first_word_at = None
+    start = time.perf_counter()
+    for offset in range(0, len(audio), chunk):
+        text = transcribe_local(audio[offset:offset + chunk])
+        calls += 1
+        if text.strip() and first_word_at is None:
+            first_word_at = min(len(audio), offset + chunk) / WHISPER_SAMPLE_RATE
+    return time.perf_counter() - start, calls, 0.0, first_word_at
+
+
+def replay_streaming(audio, chunk_seconds):
+    transcriber = StreamingTranscriber()
+    chunk = int(chunk_seconds * WHISPER_SAMPLE_RATE)
+    first_word_at = None
+    start = time.perf_counter()
+    for offset in range(0, len(audio), chunk):
+        events = transcriber.feed(audio[offset:offset + chunk])
+        if events and first_word_at is None:
+            first_word_at = min(len(audio), offset + chunk) / WHISPER_SAMPLE_RATE
+    transcriber.flush()
+    stats = transcriber.stats()
+    return time.perf_counter() - start, stats["whisper_calls"], stats["skipped_fraction"], first_word_at
+
+
+def report(label, duration, elapsed, calls, skipped, first_word_at):
+    first = f"{first_word_at:5.1f} s" if first_word_at is not None else "  n/a"
+    print(f"{label:<10} rtf={elapsed / duration:5.3f}  skipped={skipped * 100:5.1f}%  "
+          f"calls/min={calls / (duration / 60):5.1f}  first words after {first} of audio")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wavs", nargs="+")
+    parser.add_argument("--chunk", type=float, default=1.0, help="streaming chunk size in seconds")
+    args = parser.parse_args()
+
+    for path in args.wavs:
+        audio = load_wav(path)
+        duration = len(audio) / WHISPER_SAMPLE_RATE
+        print(f"{path} ({duration:.1f} s)")
+        report("fixed 5s", duration, *replay_fixed(audio))
+        report("streaming", duration, *replay_streaming(audio, args.chunk))
+
+
+if __name__ == "__main__":
+    main()
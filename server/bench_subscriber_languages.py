@@ -0,0 +1,129 @@
+# Benchmark: transcript subscribers with their own languages. Checks that the pipeline's API calls
+# follow the number of distinct languages subscribed, not the number of subscribers.
+#
+# Runs the app (startall.supervise, --workers workers) against stub_openai.py. For each
+# --clients count and each --languages count it opens a session with that many /transcribed
+# subscribers. The subscribers declare languages round robin (?languages=...). It uploads
+# --fragments one-second fragments on the voice socket and waits until every subscriber has its
+# complete messages. From the stub's /stats it reports the transcription and translation
+# requests per fragment, next to what one upload per subscriber would cost. That per-upload cost
+# is the only way to serve subscribers different languages when the uploader's translate_to
+# picks the language. It also counts messages delivered in a language the subscriber didn't ask
+# for, which should be 0.
+#
+# Usage: python bench_subscriber_languages.py [--clients 1 4 16 64] [--languages 1 2 4] [--fragments 5]
+#                                            [--workers 1] [--port 18400] [--stub-port 18490]
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+import httpx
+import numpy as np
+import uvicorn
+import websockets
+import startall
+import stub_openai
+from bench_replay import connect_voice, wait_ready
+
+SAMPLE_RATE = 16000
+LANGUAGES = ["Spanish", "French", "German", "Italian", "Portuguese", "Dutch", "Polish", "Turkish"]
+
+
+async def subscribe(port, session_id, languages):
+    query = f"session={session_id}&languages={','.join(languages)}"
+    return await websockets.connect(f"ws://127.0.0.1:{port}/transcribed/ws?{query}", max_size=None)
+
+
+async def collect(socket, languages, fragments, stray):
+    """Reads until `fragments` complete messages in each of the subscriber's languages have arrived."""
+    remaining = fragments * len(languages)
+    while remaining:
+        message = json.loads(await socket.recv())
+        if message.get("partial"):
+            continue
+        if message["language"] not in languages:
+            stray.append(message["language"])
+        elif message["type"] == "complete":
+            remaining -= 1
+
+
+async def run_case(args, clients, distinct, stub_client):
+    session_id = uuid.uuid4().hex
+    wanted = [[LANGUAGES[i % distinct]] for i in range(clients)]
+    subscribers = [await subscribe(args.port, session_id, languages) for languages in wanted]
+    await asyncio.sleep(0.5)  # Declarations from other workers reach the session's owner through the broker
+    before = (await stub_client.get(f"http://127.0.0.1:{args.stub_port}/stats")).json()
+
+    stray = []
+    collectors = asyncio.gather(*(
+        collect(socket, languages, args.fragments, stray) for socket, languages in zip(subscribers, wanted)
+    ))
+    start = time.perf_counter()
+    voice = await connect_voice(args.port, session_id)
+    await voice.send(json.dumps({"action": "start_stream", "mode": "c", "sample_rate": SAMPLE_RATE, "duration": 1}))
+    rng = np.random.default_rng(clients * 100 + distinct)
+    for _ in range(args.fragments):
+        # Different audio per fragment, so the stub transcribes different sentences
+        await voice.send((rng.standard_normal(SAMPLE_RATE) * 3000).astype(np.int16).tobytes())
+    await voice.send(json.dumps({"action": "end_stream"}))
+    try:
+        await asyncio.wait_for(collectors, args.timeout)
+        elapsed = f"{time.perf_counter() - start:5.1f}s"
+    except asyncio.TimeoutError:
+        elapsed = "timeout"
+    after = (await stub_client.get(f"http://127.0.0.1:{args.stub_port}/stats")).json()
+    await voice.close()
+    for socket in subscribers:
+        await socket.close()
+
+    transcriptions = after["transcriptions"] - before["transcriptions"]
+    translations = after["translations"] - before["translations"]
+    print(f"clients={clients:3d} languages={distinct}  transcriptions/fragment={transcriptions / args.fragments:4.1f}  "
+          f"translations/fragment={translations / args.fragments:5.1f}  "
+          f"(one upload per client: {clients:3d} + {clients:3d})  wrong language={len(stray)}  {elapsed}", flush=True)
+
+
+async def run(args):
+    stub_openai.configure(args.transcribe_latency, args.chat_latency, 0.0, 0.0)
+    stub = uvicorn.Server(uvicorn.Config(stub_openai.stub, host="127.0.0.1", port=args.stub_port, log_level="warning"))
+    stub_task = asyncio.create_task(stub.serve())
+    # The workers are spawned, so they see this environment when they import the app
+    os.environ.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.stub_port}/v1/",
+        "OPENAI_API_KEY": "bench",
+        "AGENT_INPROCESS": "1",
+        "JOURNAL_PATH": "",
+        "CACHE_PATH": "", "CACHE_MEMORY_ENTRIES": "0",  # Each translation should reach the stub
+        "LOG_LEVEL": "WARNING",
+    })
+    supervisor = asyncio.create_task(startall.supervise(args.workers, "127.0.0.1", args.port))
+    await wait_ready([args.port] if args.workers == 1 else [args.port + 1 + i for i in range(args.workers)])
+    async with httpx.AsyncClient() as stub_client:
+        for distinct in args.languages:
+            for clients in args.clients:
+                if clients >= distinct:
+                    await run_case(args, clients, distinct, stub_client)
+    supervisor.cancel()
+    await asyncio.gather(supervisor, return_exceptions=True)
+    stub.should_exit = True
+    await stub_task
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--languages", type=int, nargs="+", default=[1, 2, 4], help=f"at most {len(LANGUAGES)}")
+    parser.add_argument("--fragments", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--transcribe-latency", type=float, default=0.2)
+    parser.add_argument("--chat-latency", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=18400)
+    parser.add_argument("--stub-port", type=int, default=18490)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Benchmark: translation throughput against the micro-batching window.
+#
+# Starts a stand-in OpenAI-compatible server that "translates" each tagged segment after a
+# fixed per-request latency plus a small per-segment cost, then pushes a backlog of fragments
+# through TranslationBatcher from several concurrent callers (like translate workers).
+# Window 0 sends every fragment on its own, which is the old behaviour.
+#
+# Usage: python bench_translate_batch.py [--fragments 200] [--callers 8] [--malformed 0.05]
+import argparse
+import asyncio
+import random
+import re
+import statistics
+import time
+import openai
+import uvicorn
+from fastapi import FastAPI, Request
+from translation_batcher import TranslationBatcher
+from translate_openai import translate_text, translate_batch
+
+SEGMENT = re.compile(r"<s(\d+)>(.*?)</s\1>", re.DOTALL)
+
+stub = FastAPI()
+stub.state.calls = 0
+stub.state.latency = 0.6
+stub.state.segment_latency = 0.02
+stub.state.malformed = 0.0
+stub.state.rng = random.Random(0)
+
+
+@stub.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = body["messages"][-1]["content"]
+    segments = SEGMENT.findall(prompt)
+    stub.state.calls += 1
+    await asyncio.sleep(stub.state.latency + stub.state.segment_latency * max(1, len(segments)))
+    if segments:
+        if stub.state.rng.random() < stub.state.malformed:
+            segments = segments[:-1]  # A reply that drops a segment forces the per-item fallback
+        content = "\n".join(f"<s{i}>[es] {text}</s{i}>" for i, text in segments)
+    else:
+        content = "[es] " + prompt.split("\n\n")[1]
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+
+async def run_window(window, fragments, callers, batch_size, concurrency):
+    batcher = TranslationBatcher(translate_text, translate_batch, window=window,
+                                 max_batch=batch_size if window > 0 else 1, concurrency=concurrency)
+    backlog = asyncio.Queue()
+    for i in range(fragments):
+        backlog.put_nowait(f"fragment {i}: the patient reports a cough and a mild fever")
+    latencies = []
+    errors = 0
+
+    async def caller():
+        nonlocal errors
+        while not backlog.empty():
+            text = backlog.get_nowait()
+            start = time.perf_counter()
+            try:
+                translated = await batcher.translate(text, "English", "Spanish")
+                assert translated == f"[es] {text}", translated
+            except Exception as e:
+                errors += 1
+                print("error:", e)
+            latencies.append(time.perf_counter() - start)
+
+    calls_before = stub.state.calls
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(callers)))
+    elapsed = time.perf_counter() - start
+    stats = batcher.stats()
+    print(f"window={window * 1000:5.0f}ms  throughput={fragments / elapsed:6.1f}/s  "
+          f"p50={statistics.median(latencies):.2f}s p95={sorted(latencies)[int(len(latencies) * 0.95) - 1]:.2f}s  "
+          f"requests={stub.state.calls - calls_before:4d} avg batch={stats['avg_batch']:4.1f} "
+          f"fallbacks={stats['fallbacks']} errors={errors}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fragments", type=int, default=200)
+    parser.add_argument("--callers", type=int, default=8, help="concurrent translate workers")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight")
+    parser.add_argument("--latency", type=float, default=0.6, help="stand-in latency per request (s)")
+    parser.add_argument("--malformed", type=float, default=0.05, help="share of batched replies missing a segment")
+    parser.add_argument("--windows", default="0,10,50,100,250", help="batch windows to try (ms)")
+    parser.add_argument("--port", type=int, default=18091)
+    args = parser.parse_args()
+
+    stub.state.latency = args.latency
+    stub.state.malformed = args.malformed
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=args.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    openai.base_url = f"http://127.0.0.1:{args.port}/v1/"
+    openai.api_key = "bench"
+
+    for window in (float(w) / 1000 for w in args.windows.split(",")):
+        await run_window(window, args.fragments, args.callers, args.batch_size, args.concurrency)
+
+    server.should_exit = True
+    await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+# Benchmark: per-fragment latency of local transcription with a fresh model vs the resident pool.
+#
+# Usage: python bench_whisper_model.py [--wav path.wav] [--fragments 10] [--model base]
+import argparse
+import statistics
+import time
+import wave
+import numpy as np
+from faster_whisper import WhisperModel
+from whisper_models import WhisperModelPool
+
+SAMPLE_RATE = 16000
+
+
+def load_fragment(path, seconds):
+    """Returns `seconds` of float32 mono audio from a 16 kHz WAV, or synthetic noise if no file is given."""
+    if path:
+        with wave.open(path, "rb") as wav_file:
+            frames = wav_file.readframes(wav_file.getnframes())
+        audio = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+        return audio[: SAMPLE_RATE * seconds]
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(SAMPLE_RATE * seconds) * 0.05).astype(np.float32)
+
+
+def transcribe(model, audio):
+    segments, _ = model.transcribe(audio)
+    return " ".join(segment.text for segment in segments)
+
+
+def bench_per_fragment_load(audio, fragments, model_size, compute_type):
+    timings = []
+    for _ in range(fragments):
+        start = time.perf_counter()
+        transcribe(WhisperModel(model_size, compute_type=compute_type), audio)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_resident_pool(audio, fragments, model_size, compute_type):
+    pool = WhisperModelPool(model_size, compute_type, "cpu", size=1)
+    pool.warm()
+    timings = []
+    for _ in range(fragments):
+        start = time.perf_counter()
+        with pool.acquire() as model:
+            transcribe(model, audio)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{label:<22} mean={statistics.mean(timings) * 1000:8.1f} ms  "
+          f"p50={statistics.median(timings) * 1000:8.1f} ms  p95={p95 * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wav", help="16 kHz mono int16 WAV to cut fragments from")
+    parser.add_argument("--seconds", type=int, default=5)
+    parser.add_argument("--fragments", type=int, default=10)
+    parser.add_argument("--model", default="base")
+    parser.add_argument("--compute-type", default="int8")
+    args = parser.parse_args()
+
+    audio = load_fragment(args.wav, args.seconds)
+    # Load once up front so the first "before" sample isn't also paying for the download
+    WhisperModel(args.model, compute_type=args.compute_type)
+
+    report("before (load/fragment)", bench_per_fragment_load(audio, args.fragments, args.model, args.compute_type))
+    report("after (resident pool)", bench_resident_pool(audio, args.fragments, args.model, args.compute_type))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Load test: concurrent sessions against startall.py's single app at 1, 2, 4 and 8 workers.
+#
+# Starts the supervisor in this process with a CPU-bound, pure-Python stand-in transcriber
+# (it holds the GIL, like real decoding would, so one worker process is one core). Each session
+# connects its voice socket to the shared port, following the redirect to the worker that owns
+# the session, and its transcript socket to the shared port, which may land on any worker and
+# is fed through the broker. Reports fragment throughput and delivery latency per worker count.
+#
+# Usage: python bench_workers.py [--workers 1 2 4 8] [--sessions 32] [--fragments 5] [--work 0.05]
+import argparse
+import asyncio
+import functools
+import json
+import os
+import statistics
+import time
+import uuid
+import httpx
+import numpy as np
+import websockets
+import startall
+
+SAMPLE_RATE = 16000
+
+
+def install_stand_in(work):
+    """Worker setup hook: replaces transcription with `work` seconds of pure-Python CPU."""
+    os.environ["CACHE_PATH"] = ""  # Each run sends fresh audio anyway; keep the disk cache out of it
+    os.environ["JOURNAL_PATH"] = ""  # Supervisor.terminate() would leave fragments behind for the next run to replay
+    import tasks
+
+    def transcribe(audio, rate):
+        deadline = time.process_time() + work
+        total = 0
+        while time.process_time() < deadline:
+            total += sum(range(1000))
+        # The server hands over 16 kHz float32; the markers were sent as int16 at 16 kHz
+        return f"s{round(audio[0] * 32768)}-f{round(audio[1] * 32768)}"
+
+    async def agent_call(text, session_id=None, stream=False, fragment_id=None):
+        pass
+
+    tasks.transcribe_cloud_from_memory = transcribe
+    tasks.agentCall_async = agent_call
+
+
+async def wait_ready(port, workers):
+    ports = [port] if workers == 1 else [port + 1 + i for i in range(workers)]
+    async with httpx.AsyncClient() as client:
+        for worker_port in ports:
+            while True:
+                try:
+                    if (await client.get(f"http://127.0.0.1:{worker_port}/voice/stats")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.1)
+
+
+async def connect_voice(port, session_id):
+    """Connects to the shared port and follows a redirect to the session's owner."""
+    voice = await websockets.connect(f"ws://127.0.0.1:{port}/voice/ws?session={session_id}")
+    status = json.loads(await voice.recv())
+    if status["status"] == "redirect":
+        await voice.close()
+        voice = await websockets.connect(f"ws://127.0.0.1:{status['port']}/voice/ws?session={session_id}")
+        status = json.loads(await voice.recv())
+    assert status["status"] == "connected", status
+    return voice
+
+
+async def run_session(index, fragments, port, nonce, results):
+    session_id = uuid.uuid4().hex
+    sent_at = {}
+    latencies = []
+    async with websockets.connect(f"ws://127.0.0.1:{port}/transcribed/ws?session={session_id}") as transcript:
+        voice = await connect_voice(port, session_id)
+        await voice.send(json.dumps({"action": "start_stream", "mode": "c", "sample_rate": SAMPLE_RATE, "duration": 1}))
+        for fragment in range(fragments):
+            pcm = np.zeros(SAMPLE_RATE, dtype=np.int16)
+            pcm[0], pcm[1], pcm[2] = index, fragment, nonce
+            sent_at[f"s{index}-f{fragment}"] = time.perf_counter()
+            await voice.send(pcm.tobytes())
+
+        while len(latencies) < fragments:
+            message = await transcript.recv()
+            payload = json.loads(message)
+            text = payload.get("translation_output")
+            if text in sent_at:
+                latencies.append(time.perf_counter() - sent_at.pop(text))
+        await voice.close()
+    results.append(latencies)
+
+
+async def run(workers, args, nonce):
+    setup = functools.partial(install_stand_in, args.work)
+    # The supervisor runs the workers in child processes even for workers=1, so every run pays the same costs
+    supervisor = asyncio.create_task(startall.supervise(workers, "127.0.0.1", args.port, setup))
+    await wait_ready(args.port, workers)
+
+    results = []
+    start = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(
+        run_session(i, args.fragments, args.port, nonce, results) for i in range(args.sessions)
+    )), timeout=args.timeout)
+    elapsed = time.perf_counter() - start
+
+    supervisor.cancel()
+    await asyncio.gather(supervisor, return_exceptions=True)
+    latencies = sorted(l for session in results for l in session)
+    print(f"workers={workers}  fragments={len(latencies)}  elapsed={elapsed:5.1f}s  "
+          f"throughput={len(latencies) / elapsed:6.1f}/s  p50={statistics.median(latencies):.2f}s  "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1]:.2f}s", flush=True)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--fragments", type=int, default=5)
+    parser.add_argument("--work", type=float, default=0.05, help="stand-in CPU seconds per fragment")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()} sessions={args.sessions} fragments/session={args.fragments} work={args.work}s")
+    for nonce, workers in enumerate(args.workers):
+        await run(workers, args, nonce)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+# Benchmark: server-side ingestion cost of the JSON/base64 protocol vs the binary PCM protocol.
+#
+# Replays the same audio through what voice.py and tasks.py do for each protocol, up to the
+# 16 kHz float32 samples transcription consumes, and reports bytes on the wire, ingestion throughput (MB/s of audio) and CPU per stream-minute.
+#
+# Usage: python bench_ws_protocol.py [--minutes 10] [--rate 32000] [--frame-ms 100]
+import argparse
+import base64
+import io
+import json
+import time
+import wave
+import numpy as np
+from audio import AudioStreamBuffer, pcm_to_float32
+from tasks import decode_audio_base64
+
+
+def wav_payload(pcm, rate):
+    """What the browser used to send: a WAV blob, base64-encoded inside a JSON action."""
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(pcm.tobytes())
+    return json.dumps({
+        "action": "transcribe_translate", "duration": 5, "mode": "c", "translate_to": "en",
+        "sample_rate": rate, "audio": base64.b64encode(wav_buffer.getvalue()).decode("ascii"),
+    })
+
+
+def ingest_json(messages):
+    for message in messages:
+        payload = json.loads(message)
+        pcm_to_float32(decode_audio_base64(payload.get("audio")), payload["sample_rate"])
+
+
+def ingest_binary(frames, rate):
+    stream = AudioStreamBuffer(rate, 5)
+    for frame in frames:
+        stream.write(frame)
+    stream.flush()
+
+
+def measure(label, fn, wire_bytes, audio_bytes, minutes):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    fn()
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    print(f"{label:<8} wire={wire_bytes / 1e6:8.2f} MB  throughput={audio_bytes / 1e6 / wall:9.1f} MB/s  "
+          f"cpu/stream-minute={cpu * 1000 / minutes:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--rate", type=int, default=32000)
+    parser.add_argument("--frame-ms", type=int, default=100, help="binary frame size")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pcm = (rng.standard_normal(int(args.rate * 60 * args.minutes)) * 1000).astype(np.int16)
+    chunk = args.rate * 5
+    messages = [wav_payload(pcm[i:i + chunk], args.rate) for i in range(0, len(pcm), chunk)]
+    frame = args.rate * args.frame_ms // 1000
+    frames = [pcm[i:i + frame].tobytes() for i in range(0, len(pcm), frame)]
+
+    audio_bytes = pcm.nbytes
+    measure("json", lambda: ingest_json(messages), sum(len(m) for m in messages), audio_bytes, args.minutes)
+    measure("binary", lambda: ingest_binary(frames, args.rate), sum(len(f) for f in frames), audio_bytes, args.minutes)
+
+
+if __name__ == "__main__":
+    main()
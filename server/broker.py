@@ -0,0 +1,104 @@
+# Pub/sub between worker processes, so a session's transcripts and responses reach subscribers
+# connected to any worker. The backend is chosen with BROKER:
+#   inprocess - a single worker; there is nobody to fan out to (default)
+#   local     - workers exchange messages through the supervisor's Unix socket hub (startall.py)
+import os
+import json
+import logging
+import asyncio
+
+BROKER = os.getenv("BROKER", "inprocess")
+BROKER_PATH = os.getenv("BROKER_PATH", "/tmp/ai-agent-broker.sock")
+BROKER_QUEUE_SIZE = int(os.getenv("BROKER_QUEUE_SIZE", "10000"))  # Messages buffered per connection
+
+log = logging.getLogger(__name__)
+
+
+class InProcessBroker:
+    """Backend for single-process deployments: publishing is a no-op."""
+    async def start(self, handler):
+        pass
+
+    def publish(self, message: dict):
+        pass
+
+    async def close(self):
+        pass
+
+
+class LocalBroker:
+    """Sends messages to every other worker through the hub and hands theirs to `handler`."""
+    def __init__(self, path=BROKER_PATH, queue_size=BROKER_QUEUE_SIZE):
+        self.path = path
+        self._outbox = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self.dropped = 0
+
+    async def start(self, handler):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        self._tasks = [
+            asyncio.create_task(self._read(reader, handler)),
+            asyncio.create_task(self._write(writer)),
+        ]
+
+    def publish(self, message: dict):
+        try:
+            self._outbox.put_nowait(json.dumps(message).encode() + b"\n")
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def _read(self, reader, handler):
+        while line := await reader.readline():
+            try:
+                handler(json.loads(line))
+            except Exception as e:
+                log.error("broker: Error handling message: %s", e)
+        log.info("broker: hub connection closed")
+
+    async def _write(self, writer):
+        while True:
+            writer.write(await self._outbox.get())
+            await writer.drain()
+
+
+def get_broker():
+    if BROKER == "local":
+        return LocalBroker()
+    return InProcessBroker()
+
+
+# Relays every line a worker sends to all the other workers. Runs in the supervisor process.
+async def run_hub(path=BROKER_PATH, queue_size=BROKER_QUEUE_SIZE):
+    peers: dict[asyncio.StreamWriter, asyncio.Queue] = {}
+
+    async def drain(writer, queue):
+        try:
+            while True:
+                writer.write(await queue.get())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def handle(reader, writer):
+        queue = peers[writer] = asyncio.Queue(maxsize=queue_size)
+        sender = asyncio.create_task(drain(writer, queue))
+        try:
+            while line := await reader.readline():
+                for peer, peer_queue in peers.items():
+                    if peer is not writer and not peer_queue.full():
+                        peer_queue.put_nowait(line)
+        finally:
+            del peers[writer]
+            sender.cancel()
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path)
+    log.info("broker: hub listening on %s", path)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,151 @@
+# Content-addressed cache for transcriptions and translations, so repeated audio and
+# boilerplate phrases don't go back to Whisper/GPT-4.
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import metrics
+
+CACHE_PATH = os.getenv("CACHE_PATH", "cache.sqlite3")  # Empty keeps the cache in memory only
+CACHE_MEMORY_ENTRIES = int(os.getenv("CACHE_MEMORY_ENTRIES", "1000"))  # Per cache, LRU
+CACHE_DISK_ENTRIES = int(os.getenv("CACHE_DISK_ENTRIES", "100000"))  # Per cache, least recently used evicted
+CACHE_TTL = float(os.getenv("CACHE_TTL", str(7 * 24 * 3600)))  # Seconds; 0 disables expiry
+
+
+class TwoLevelCache:
+    """In-memory LRU in front of a SQLite table.
+
+    Values are strings. Entries expire `ttl` seconds after they were stored, and each level
+    evicts its least recently used entries once it holds more than its limit. Safe to call
+    from the I/O thread pool.
+    """
+    def __init__(self, name, path=CACHE_PATH, memory_entries=CACHE_MEMORY_ENTRIES,
+                 disk_entries=CACHE_DISK_ENTRIES, ttl=CACHE_TTL):
+        self.name = name
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._db = None
+        self._rows = 0  # Rows in the table, kept up to date so put() doesn't count them each time
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {name}_accessed ON {name} (accessed_at)")
+            self._db.commit()
+            self._rows = self._db.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute(f"SELECT value, stored_at FROM {self.name} WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, stored_at = row
+                    if not self._expired(stored_at, now):
+                        self._db.execute(f"UPDATE {self.name} SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, stored_at, value)
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._rows -= 1
+                    self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                exists = self._db.execute(f"SELECT 1 FROM {self.name} WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.name} (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                if exists is None:
+                    self._rows += 1
+                excess = self._rows - self.disk_entries
+                if excess > 0:
+                    self._db.execute(
+                        f"DELETE FROM {self.name} WHERE key IN "
+                        f"(SELECT key FROM {self.name} ORDER BY accessed_at LIMIT ?)",
+                        (excess,),
+                    )
+                    self._rows -= excess
+                    self.evicted += excess
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.name}")
+                self._db.commit()
+                self._rows = 0
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def _expired(self, stored_at, now):
+        return self.ttl > 0 and now - stored_at > self.ttl
+
+    def _remember(self, key, stored_at, value):
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+
+def transcription_key(audio, rate, mode, model) -> str:
+    """Hash of the 16 kHz float32 samples (as normalised on the voice socket) plus everything that changes the transcript."""
+    digest = hashlib.blake2b(audio.tobytes(), digest_size=20)
+    digest.update(f"|{rate}|{mode}|{model}".encode())
+    return digest.hexdigest()
+
+
+def normalize_text(text) -> str:
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def translation_key(text, input_lang, output_lang) -> str:
+    digest = hashlib.blake2b(normalize_text(text).encode(), digest_size=20)
+    digest.update(f"|{input_lang.casefold()}|{output_lang.casefold()}".encode())
+    return digest.hexdigest()
+
+
+transcription_cache = TwoLevelCache("transcriptions")
+translation_cache = TwoLevelCache("translations")
+metrics.register_cache("transcriptions", transcription_cache)
+metrics.register_cache("translations", translation_cache)
@@ -0,0 +1,109 @@
+# Append-only message log with per-subscriber cursors, so delivery only touches new entries.
+import uuid
+from collections import deque
+
+
+class ChannelLog:
+    """Append-only log for one delivery channel.
+
+    Every entry gets a monotonically increasing sequence number and every subscriber
+    has two cursors: the next sequence number it hasn't read (`advance`d past once the
+    entry is queued for sending) and the next one it hasn't acknowledged (`ack`ed once
+    actually sent). Reading costs O(new entries), and entries acknowledged by all
+    subscribers are compacted away, so an entry still queued for a peer survives for a
+    `since=` resume if the send fails. With no subscribers, entries are retained (up to
+    `max_entries`) for whoever connects next.
+
+    A replica of another worker's log keeps that log's numbering and `epoch`. The epoch
+    changes when the source log is created again (its session was evicted and came back
+    with seq 1), and the replica then starts over from the new numbering.
+    """
+    def __init__(self, max_entries=500, wakeup=None, on_append=None):
+        self.max_entries = max_entries
+        self.next_seq = 1
+        self.epoch = uuid.uuid4().hex[:12]  # Which incarnation of the log the numbering belongs to
+        self._entries = deque()  # (seq, item), oldest first, seqs increasing but not always consecutive
+        self._cursors = {}  # subscriber -> next seq to read
+        self._acked = {}  # subscriber -> next seq not yet acknowledged
+        self._wakeup = wakeup  # Optional asyncio.Event shared with the delivery loop
+        self._on_append = on_append  # Optional callback(seq, item, epoch) for entries appended here, e.g. to replicate them
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def first_seq(self):
+        return self._entries[0][0] if self._entries else self.next_seq
+
+    def append(self, item, seq=None, epoch=None) -> int:
+        """Appends an entry. `seq` and `epoch` are given for replicas of another worker's log, which keep its numbering."""
+        replica = seq is not None
+        if not replica:
+            seq = self.next_seq
+        elif epoch is not None and epoch != self.epoch:
+            self._restart(epoch, seq)
+        elif seq < self.next_seq:
+            return seq  # Already have it
+        self.next_seq = seq + 1
+        self._entries.append((seq, item))
+        if len(self._entries) > self.max_entries:
+            # Memory cap: slow or absent subscribers lose the oldest entries
+            self._entries.popleft()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._on_append is not None and not replica:
+            self._on_append(seq, item, self.epoch)
+        return seq
+
+    def _restart(self, epoch, seq):
+        """Follows a source log that started over: drops the old entries and reads on from `seq`."""
+        self.epoch = epoch
+        self._entries.clear()
+        self.next_seq = seq
+        for subscriber in self._cursors:
+            self._cursors[subscriber] = self._acked[subscriber] = seq
+
+    def subscribe(self, subscriber, since=None):
+        """Starts a cursor after `since` (a client's last seen seq), or at the oldest retained entry."""
+        start = self.first_seq if since is None else since + 1
+        self._cursors[subscriber] = self._acked[subscriber] = min(max(start, self.first_seq), self.next_seq)
+
+    def unsubscribe(self, subscriber):
+        self._cursors.pop(subscriber, None)
+        self._acked.pop(subscriber, None)
+        self._compact()
+
+    def has_unread(self) -> bool:
+        return any(cursor < self.next_seq for cursor in self._cursors.values())
+
+    def read(self, subscriber) -> list:
+        """Returns the (seq, item) pairs the subscriber hasn't read yet."""
+        cursor = self._cursors.get(subscriber, self.next_seq)
+        if cursor >= self.next_seq:
+            return []
+        # New entries are at the tail, so walk back from it; replicas can have gaps in their seqs
+        unread = []
+        for entry in reversed(self._entries):
+            if entry[0] < cursor:
+                break
+            unread.append(entry)
+        return unread[::-1]
+
+    def advance(self, subscriber, seq):
+        """Moves the subscriber's read cursor past `seq`; the entry is kept until it is acknowledged."""
+        if subscriber in self._cursors and seq >= self._cursors[subscriber]:
+            self._cursors[subscriber] = seq + 1
+
+    def ack(self, subscriber, seq):
+        """Acknowledges everything up to `seq` for the subscriber and drops entries everyone has acknowledged."""
+        if subscriber in self._acked and seq >= self._acked[subscriber]:
+            self._acked[subscriber] = seq + 1
+            self.advance(subscriber, seq)
+            self._compact()
+
+    def _compact(self):
+        if not self._acked:
+            return
+        low = min(self._acked.values())
+        while self._entries and self._entries[0][0] < low:
+            self._entries.popleft()
@@ -0,0 +1,161 @@
+# Runs a fragment's pipeline as a small dependency graph rather than a fixed chain of stages.
+#
+# Each node starts as soon as the nodes it depends on have finished, so independent nodes
+# (translating for display and diarizing the source text, see tasks.FRAGMENT_PIPELINE) run at the
+# same time and a run takes as long as its slowest path instead of the sum of its nodes. A node
+# that still fails after its retries skips the nodes that depend on it; the others carry on.
+#
+# Nodes can be `ordered`: runs with the same key (the session) then go through the node one at a
+# time, in the order the runs started, so a session's transcript and dialogue stay in order while
+# other sessions' fragments overlap. `limit` caps how many runs are in a node at once.
+#
+# Every run keeps when each node was ready, started and finished, which gives its critical path:
+# the node that finished last, the dependency of it that finished last, and so on back.
+import time
+import asyncio
+import logging
+from contextlib import nullcontext
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Node:
+    """One step of a Graph. `run(*args, results)` is awaited with the run's arguments and the results so far, by node name."""
+    def __init__(self, name, run, after=(), ordered=False, limit=None, retries=0):
+        self.name = name
+        self.run = run
+        self.after = tuple(after)
+        self.ordered = ordered
+        self.limit = limit
+        self.retries = retries
+
+
+class GraphRun:
+    """Results, errors and timings (seconds since the run started) of one run of a Graph."""
+    def __init__(self, graph):
+        self.graph = graph
+        self.results = {}
+        self.errors: dict[str, str] = {}
+        self.skipped: set[str] = set()
+        self.ready: dict[str, float] = {}
+        self.started: dict[str, float] = {}
+        self.finished: dict[str, float] = {}
+        self.origin = time.perf_counter()
+
+    def critical_path(self) -> list[str]:
+        """The chain of nodes that determined how long the run took, first node first."""
+        if not self.finished:
+            return []
+        name = max(self.finished, key=self.finished.get)
+        path = [name]
+        while True:
+            before = [dependency for dependency in self.graph.nodes[name].after if dependency in self.finished]
+            if not before:
+                return path[::-1]
+            name = max(before, key=self.finished.get)
+            path.append(name)
+
+    def summary(self) -> dict:
+        """Span attributes: the critical path, how long it took, and what running the nodes one after another would have taken."""
+        path = self.critical_path()
+        durations = {name: self.finished[name] - self.started[name] for name in self.finished}
+        summary = {
+            "critical_path": ">".join(path),
+            "critical_path_ms": round(max(self.finished.values(), default=0.0) * 1000, 2),
+            # Time on the path spent waiting for the session's previous run or a free slot, not working
+            "critical_path_wait_ms": round(sum(self.started[name] - self.ready[name] for name in path) * 1000, 2),
+            "serial_ms": round(sum(durations.values()) * 1000, 2),
+        }
+        summary.update((f"{name}_ms", round(duration * 1000, 2)) for name, duration in durations.items())
+        return summary
+
+
+class Graph:
+    def __init__(self, *nodes: Node):
+        self.nodes = {node.name: node for node in nodes}
+        for node in nodes:
+            for dependency in node.after:
+                if dependency not in self.nodes:
+                    raise ValueError(f"{node.name} depends on unknown node {dependency}")
+        self.order = self._topological_order()
+        self._limits = {node.name: asyncio.Semaphore(node.limit) for node in nodes if node.limit}
+        # (node, key) -> finished when the latest run with that key is through the node
+        self._turns: dict[tuple[str, object], asyncio.Future] = {}
+
+    def _topological_order(self) -> list[Node]:
+        order, placed = [], set()
+        while len(order) < len(self.nodes):
+            ready = [node for node in self.nodes.values()
+                     if node.name not in placed and all(dependency in placed for dependency in node.after)]
+            if not ready:
+                raise ValueError(f"cycle among {sorted(set(self.nodes) - placed)}")
+            order.extend(ready)
+            placed.update(node.name for node in ready)
+        return order
+
+    async def run(self, *args, key=None) -> GraphRun:
+        """Runs every node; returns once all of them have finished, failed or been skipped."""
+        run = GraphRun(self)
+        loop = asyncio.get_running_loop()
+        # Take this run's turn at the ordered nodes before anything awaits, so turns follow call order
+        turns = {}
+        for node in self.order:
+            if node.ordered:
+                turn = loop.create_future()
+                turns[node.name] = (self._turns.get((node.name, key)), turn)
+                self._turns[(node.name, key)] = turn
+        tasks = {}
+        for node in self.order:
+            tasks[node.name] = asyncio.create_task(self._run_node(node, run, args, tasks, key, turns.get(node.name)))
+        await asyncio.gather(*tasks.values())
+        metrics.observe_critical_path(run.critical_path())
+        return run
+
+    async def _run_node(self, node, run, args, tasks, key, turn):
+        try:
+            await asyncio.gather(*(tasks[name] for name in node.after))
+            failed = [name for name in node.after if name in run.errors or name in run.skipped]
+            if failed:
+                run.skipped.add(node.name)
+                return
+            run.ready[node.name] = time.perf_counter() - run.origin
+            if turn is not None and turn[0] is not None:
+                await asyncio.shield(turn[0])  # The same node of this key's previous run
+            async with self._limits.get(node.name) or nullcontext():
+                run.started[node.name] = started = time.perf_counter() - run.origin
+                result, error = await self._call(node, args, run.results)
+                run.finished[node.name] = finished = time.perf_counter() - run.origin
+            if error is None:
+                run.results[node.name] = result
+            else:
+                run.errors[node.name] = error
+            metrics.get_stage(node.name).record(started - run.ready[node.name], finished - started, error is None)
+        finally:
+            if turn is not None:
+                self._pass_turn(node.name, key, *turn)
+
+    # Lets the key's next run into the node. A run that never waited for its turn (skipped after a
+    # failed dependency, or cancelled) hands it on only once the previous run has, so later runs
+    # still go through the node in order.
+    def _pass_turn(self, name, key, previous, turn):
+        if previous is not None and not previous.done():
+            previous.add_done_callback(lambda _: self._pass_turn(name, key, None, turn))
+            return
+        turn.set_result(None)
+        if self._turns.get((name, key)) is turn:
+            del self._turns[(name, key)]
+
+    # Awaits the node, retrying it with backoff when it raises. Returns (result, None), or
+    # (None, error) once the retries are used up, so a failing node is never silently dropped.
+    @staticmethod
+    async def _call(node, args, results):
+        for attempt in range(node.retries + 1):
+            try:
+                return await node.run(*args, results), None
+            except Exception as e:
+                log.warning("%s failed (attempt %d/%d): %s", node.name, attempt + 1, node.retries + 1, e)
+                error = f"{type(e).__name__}: {e}"
+            if attempt < node.retries:
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        return None, error
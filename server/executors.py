@@ -0,0 +1,34 @@
+# Shared executors for blocking pipeline work, so it never runs on the event loop thread.
+import os
+import asyncio
+import contextvars
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+IO_THREADS = int(os.getenv("IO_THREADS", "16"))  # Network-bound calls (OpenAI audio/chat)
+# In-process Whisper decodes (streaming mode); one per resident model, so they don't crowd the I/O pool
+CPU_THREADS = int(os.getenv("CPU_THREADS", os.getenv("WHISPER_POOL_SIZE", "1")))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io")
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_THREADS, thread_name_prefix="cpu")
+
+
+async def _run(executor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()  # Keeps the caller's trace (tracing.py)
+    return await loop.run_in_executor(executor, partial(context.run, fn, *args, **kwargs))
+
+
+async def run_io(fn, *args, **kwargs):
+    """Runs a blocking network call on the I/O thread pool, in the caller's trace (tracing.py)."""
+    return await _run(io_executor, fn, *args, **kwargs)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Runs CPU-bound work (VAD and Whisper decoding) on the bounded CPU pool, in the caller's trace."""
+    return await _run(cpu_executor, fn, *args, **kwargs)
+
+
+def shutdown():
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
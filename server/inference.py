@@ -0,0 +1,343 @@
+# Local Whisper inference service: worker processes that each hold a warm model on their own cores.
+#
+# Each fragment goes to the worker with the fewest fragments in flight, on that worker's own
+# request queue, so the pool knows which fragments a worker held if it dies: they fail (and the
+# pipeline retries them) and the worker is restarted with a fresh queue. The
+# audio (already 16 kHz float32, see audio.py) is copied into a slot of a shared-memory slab, so
+# only (request id, slot, length) is pickled, and the worker hands the model a view of the slot. A worker takes up to WHISPER_BATCH_SIZE queued fragments at a time and
+# decodes them in a single BatchedInferencePipeline call, one clip per fragment.
+import os
+import time
+import logging
+import queue
+import asyncio
+import itertools
+import threading
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+import numpy as np
+import metrics
+import affinity
+from whisper_models import DEFAULT_MODEL_SIZE, DEFAULT_COMPUTE_TYPE
+
+WHISPER_PROCESSES = int(os.getenv("WHISPER_PROCESSES", "1"))  # Inference worker processes per app worker
+WHISPER_CORES = os.getenv("WHISPER_CORES", "")  # Cores per process, e.g. "0-7;8-15"; empty splits this app worker's share evenly
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "8"))  # Fragments decoded per forward pass; 1 disables batching
+WHISPER_BATCH_WINDOW = float(os.getenv("WHISPER_BATCH_WINDOW", "0.01"))  # Seconds a worker waits for a batch to fill
+WHISPER_SLOTS = int(os.getenv("WHISPER_SLOTS", "8"))  # Shared-memory slots per process, i.e. fragments in flight
+WHISPER_SLOT_SECONDS = float(os.getenv("WHISPER_SLOT_SECONDS", "30"))  # Longest fragment a slot holds
+WHISPER_TIMEOUT = float(os.getenv("WHISPER_TIMEOUT", "120"))  # Seconds a fragment may take before its worker is presumed hung
+WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "en")  # A batch mixes sessions, so don't detect it per batch
+MAX_CLIP_SAMPLES = 30 * 16000  # The batched pipeline decodes at most 30 s per clip
+
+log = logging.getLogger(__name__)
+
+
+def parse_cores(spec) -> list[list[int]]:
+    """"0-3;4,5" -> [[0, 1, 2, 3], [4, 5]]"""
+    groups = []
+    for group in filter(None, (part.strip() for part in spec.split(";"))):
+        cores = []
+        for item in group.split(","):
+            first, _, last = item.partition("-")
+            cores.extend(range(int(first), int(last or first) + 1))
+        groups.append(cores)
+    return groups
+
+
+def default_cores(processes) -> list[list[int]]:
+    """Splits the cores this app worker may use into `processes` contiguous groups."""
+    available = sorted(os.sched_getaffinity(0))
+    # With several app workers (startall.py), each gets its own slice of the machine
+    share = max(1, len(available) // affinity.WORKER_COUNT)
+    available = available[affinity.WORKER_INDEX * share:(affinity.WORKER_INDEX + 1) * share] or available
+    size = max(1, len(available) // processes)
+    return [available[(i * size) % len(available):][:size] for i in range(processes)]
+
+
+class WhisperEngine:
+    """A warm faster-whisper model that decodes a list of 16 kHz float32 fragments."""
+    def __init__(self, cpu_threads, batch_size=WHISPER_BATCH_SIZE, model_size=DEFAULT_MODEL_SIZE,
+                 compute_type=DEFAULT_COMPUTE_TYPE, language=WHISPER_LANGUAGE):
+        from faster_whisper import WhisperModel, BatchedInferencePipeline
+        self.model = WhisperModel(model_size, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+        self.batched = BatchedInferencePipeline(self.model) if batch_size > 1 else None
+        self.language = language or None
+
+    def transcribe_batch(self, fragments: list[np.ndarray]) -> list[str]:
+        if self.batched is None or len(fragments) == 1 or any(len(f) > MAX_CLIP_SAMPLES for f in fragments):
+            return [self._transcribe(fragment) for fragment in fragments]
+        # Lay the fragments end to end and give each its own clip, so each is one row of the batch
+        starts = itertools.accumulate((len(f) for f in fragments[:-1]), initial=0)
+        clips, owners = [], {}
+        for index, (start, fragment) in enumerate(zip(starts, fragments)):
+            if len(fragment):
+                clip = {"start": start / 16000, "end": (start + len(fragment)) / 16000}
+                clips.append(clip)
+                # Segments carry their clip's offset in 10 ms frames, computed as the pipeline does
+                owners[int(int(clip["start"] * 16000) / 16000 * 100)] = index
+        if not clips:
+            return [""] * len(fragments)
+        segments, _ = self.batched.transcribe(
+            np.concatenate(fragments), clip_timestamps=clips, batch_size=len(clips),
+            language=self.language, without_timestamps=True,
+        )
+        texts = [[] for _ in fragments]
+        for segment in segments:
+            texts[owners[segment.seek]].append(segment.text.strip())
+        return [" ".join(parts).strip() for parts in texts]
+
+    def _transcribe(self, fragment):
+        if not len(fragment):
+            return ""
+        segments, _ = self.model.transcribe(fragment, language=self.language)
+        return " ".join(segment.text for segment in segments)
+
+
+def load_whisper_engine(cpu_threads, batch_size):
+    return WhisperEngine(cpu_threads, batch_size)
+
+
+def _worker_main(index, cores, shm_name, slot_bytes, requests, results, batch_size, batch_window, loader):
+    """Inference process: pins itself to `cores`, loads the engine, then serves batches until it gets None."""
+    from logconfig import configure_logging
+    configure_logging()  # A spawned process starts with logging unconfigured
+    if cores:
+        os.sched_setaffinity(0, cores)
+    engine = loader(len(cores) or os.cpu_count() or 1, batch_size)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    log.info("inference: worker %d ready on cores %s", index, cores)
+    stopping = False
+    while not stopping:
+        batch = [requests.get()]
+        if batch[0] is None:
+            break
+        deadline = time.monotonic() + batch_window
+        while len(batch) < batch_size:
+            try:
+                item = requests.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+
+        started = time.monotonic()
+        # The slots stay ours until the results are sent, so decode straight from shared memory
+        fragments = [
+            np.ndarray((length,), dtype=np.float32, buffer=shm.buf, offset=slot * slot_bytes) if inline is None else inline
+            for _, slot, length, inline in batch
+        ]
+        try:
+            texts, error = engine.transcribe_batch(fragments), None
+        except Exception as e:
+            texts, error = [""] * len(batch), f"{type(e).__name__}: {e}"
+        finished = time.monotonic()
+        for (request_id, *_), text, fragment in zip(batch, texts, fragments):
+            results.put((request_id, text, error, started, finished, len(batch), len(fragment) / 16000))
+        del fragments, fragment  # Views into the slab must be gone before it is closed
+    shm.close()
+
+
+class InferencePool:
+    """Dispatches fragments from the event loop to the inference processes.
+
+    `transcribe` awaits a free shared-memory slot (this is the back-pressure), copies the
+    fragment into it and queues a small request; a reader thread resolves the futures as
+    results come back. Fragments longer than a slot are pickled through the queue instead.
+    A watcher thread waits on the workers' sentinels: a worker that exits fails its fragments,
+    frees their slots and is started again, after a growing delay if it keeps dying young.
+    A fragment that takes longer than `timeout` gets its worker terminated the same way.
+    """
+    def __init__(self, processes=WHISPER_PROCESSES, cores=WHISPER_CORES, batch_size=WHISPER_BATCH_SIZE,
+                 batch_window=WHISPER_BATCH_WINDOW, slots=WHISPER_SLOTS, slot_seconds=WHISPER_SLOT_SECONDS,
+                 timeout=WHISPER_TIMEOUT, loader=load_whisper_engine):
+        self.processes = max(1, processes)
+        self.cores = parse_cores(cores) if cores else default_cores(self.processes)
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self.slots = max(1, slots) * self.processes
+        self.slot_bytes = int(slot_seconds * 16000) * 4
+        self.timeout = timeout
+        self.loader = loader
+        self.stage = metrics.get_stage("inference")
+        self._workers = []  # By index; None while a dead worker waits to be restarted
+        self._queues = []
+        self._in_flight = []
+        self._spawned_at = []
+        self._backoff = []  # Seconds before restarting each worker if it dies young again
+        self._restarts = {}  # index -> scheduled restart
+        self._pending = {}  # request id -> (future, slot, submitted_at, worker index)
+        self._ids = itertools.count()
+        self._started = False
+        # Statistics
+        self.batches = 0
+        self.fragments = 0
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.worker_restarts = 0
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._loop = asyncio.get_running_loop()
+        self._free = asyncio.Queue()
+        for slot in range(self.slots):
+            self._free.put_nowait(slot)
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._workers = [None] * self.processes
+        self._queues = [self._context.Queue() for _ in range(self.processes)]
+        self._in_flight = [0] * self.processes
+        self._spawned_at = [0.0] * self.processes
+        self._backoff = [1.0] * self.processes
+        for index in range(self.processes):
+            self._spawn(index)
+        threading.Thread(target=self._read_results, name="inference-results", daemon=True).start()
+        threading.Thread(target=self._watch_workers, name="inference-watch", daemon=True).start()
+
+    def _spawn(self, index):
+        self._restarts.pop(index, None)
+        if not self._started:
+            return
+        cores = self.cores[index % len(self.cores)]
+        worker = self._context.Process(
+            target=_worker_main, daemon=True,
+            args=(index, cores, self._shm.name, self.slot_bytes, self._queues[index], self._results,
+                  self.batch_size, self.batch_window, self.loader),
+        )
+        worker.start()
+        self._workers[index] = worker
+        self._spawned_at[index] = time.monotonic()
+
+    async def transcribe(self, samples: np.ndarray) -> str:
+        """Transcribes 16 kHz float32 samples in one of the inference processes."""
+        self.start()
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        slot = await self._free.get()
+        index = min(range(self.processes), key=self._in_flight.__getitem__)
+        request_id = next(self._ids)
+        future = self._loop.create_future()
+        self._pending[request_id] = (future, slot, time.monotonic(), index)
+        self._in_flight[index] += 1
+        if samples.nbytes <= self.slot_bytes:
+            view = np.ndarray(samples.shape, dtype=np.float32, buffer=self._shm.buf, offset=slot * self.slot_bytes)
+            view[:] = samples
+            self._queues[index].put((request_id, slot, len(samples), None))
+        else:
+            self._queues[index].put((request_id, slot, len(samples), samples))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            # Still pending means the worker holds the slot and isn't answering; the watcher restarts it
+            worker = self._workers[index]
+            if request_id in self._pending and worker is not None:
+                log.error("inference: worker %d gave no result in %ss, killing it", index, self.timeout)
+                worker.kill()
+            raise
+
+    def _read_results(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                return
+            self._loop.call_soon_threadsafe(self._resolve, *result)
+
+    def _watch_workers(self):
+        reported = set()
+        while self._started:
+            workers = [worker for worker in self._workers if worker is not None and worker not in reported]
+            ready = multiprocessing.connection.wait([worker.sentinel for worker in workers], timeout=1.0)
+            for worker in workers:
+                if worker.sentinel in ready:
+                    worker.join(timeout=1)  # Reap it, for its exit code
+                    reported.add(worker)
+                    self._loop.call_soon_threadsafe(self._worker_died, worker)
+
+    def _worker_died(self, worker):
+        if not self._started or worker not in self._workers:
+            return  # Shutting down
+        index = self._workers.index(worker)
+        lost = [request_id for request_id, entry in self._pending.items() if entry[3] == index]
+        log.error("inference: worker %d exited with code %s, failing its %d fragments",
+                  index, worker.exitcode, len(lost))
+        for request_id in lost:
+            future, slot, _, _ = self._pending.pop(request_id)
+            self._free.put_nowait(slot)
+            if not future.done():
+                future.set_exception(RuntimeError(f"inference: worker {index} exited with code {worker.exitcode}"))
+        # Requests still queued for it were among the failed ones; the restarted worker starts clean
+        self._queues[index].cancel_join_thread()
+        self._queues[index].close()
+        self._queues[index] = self._context.Queue()
+        self._in_flight[index] = 0
+        self._workers[index] = None
+        lived = time.monotonic() - self._spawned_at[index]
+        self._backoff[index] = 1.0 if lived > 60 else min(60.0, self._backoff[index] * 2)
+        self.worker_restarts += 1
+        self._restarts[index] = self._loop.call_later(self._backoff[index], self._spawn, index)
+
+    def _resolve(self, request_id, text, error, started, finished, batch_len, audio_seconds):
+        entry = self._pending.pop(request_id, None)
+        if entry is None:
+            return  # Already failed when its worker died
+        future, slot, submitted_at, index = entry
+        self._free.put_nowait(slot)
+        self._in_flight[index] -= 1
+        self.fragments += 1
+        self.batches += 1 / batch_len
+        self.audio_seconds += audio_seconds
+        self.busy_seconds += (finished - started) / batch_len
+        self.stage.record(started - submitted_at, finished - started, error is None)
+        if future.done():
+            return  # The caller gave up waiting
+        if error is None:
+            future.set_result(text)
+        else:
+            future.set_exception(RuntimeError(f"inference: {error}"))
+
+    def stats(self) -> dict:
+        return {
+            "processes": self.processes,
+            "cores": self.cores,
+            "fragments": self.fragments,
+            "mean_batch": round(self.fragments / self.batches, 2) if self.batches else 0.0,
+            "audio_seconds": round(self.audio_seconds, 1),
+            # Decode time per second of audio, per process; below 1 is faster than real time
+            "rtf": round(self.busy_seconds / self.audio_seconds, 3) if self.audio_seconds else 0.0,
+            "in_flight": len(self._pending),
+            "restarts": self.worker_restarts,
+        }
+
+    def shutdown(self):
+        if not self._started:
+            return
+        self._started = False  # Stops the watcher and any restart still scheduled
+        for handle in self._restarts.values():
+            handle.cancel()
+        self._restarts.clear()
+        for worker, requests in zip(self._workers, self._queues):
+            if worker is not None:
+                requests.put(None)
+        for worker in self._workers:
+            if worker is None:
+                continue
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._results.put(None)
+        for future, _, _, _ in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+        self._shm.close()
+        self._shm.unlink()
+        self._workers = []
+        self._queues = []
+
+
+inference_pool = InferencePool()
@@ -0,0 +1,203 @@
+# Crash-safe journal of the fragments each pipeline stage still has to process.
+#
+# A voice fragment is journaled before it is queued, and it stays in the journal until every
+# node of the pipeline (tasks.FRAGMENT_PIPELINE) is through with it. Whatever is left after a
+# crash or kill -9 is replayed on startup (tasks.replay_journal), so every accepted fragment is
+# processed at least once. Handlers are idempotent: transcripts and translations come from the
+# caches, and the agent skips fragment IDs it has already seen.
+#
+# Writes go through one committer task. Everything queued while the previous commit was being
+# fsynced goes out in the next transaction, so at high load one fsync covers many fragments.
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import affinity
+import metrics
+
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "journal.sqlite3")  # Empty disables journaling; one file per app worker
+JOURNAL_COMMIT_WINDOW = float(os.getenv("JOURNAL_COMMIT_WINDOW", "0"))  # Extra seconds to wait for a group to fill
+JOURNAL_MAX_REPLAYS = int(os.getenv("JOURNAL_MAX_REPLAYS", "3"))  # A record replayed this often is set aside as poison
+
+
+def worker_path(path):
+    """journal.sqlite3 -> journal-2.sqlite3 for app worker 2 when there are several, since each owns its sessions."""
+    if not path or affinity.WORKER_COUNT <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{affinity.WORKER_INDEX}{ext}"
+
+
+class Journal:
+    """Append/ack log of pipeline records in SQLite (WAL, fsync per commit), with group commit.
+
+    `append` resolves once the record is durable; `ack` and `fail` are queued and ride along
+    with the next commit, since losing one only means a record is replayed again.
+    """
+    def __init__(self, path=JOURNAL_PATH, commit_window=JOURNAL_COMMIT_WINDOW, group_commit=True):
+        self.path = path
+        self.commit_window = commit_window
+        self.group_commit = group_commit
+        self._db = None
+        self._ops = []  # (sql, params, future or None)
+        self._wakeup = None
+        self._committer = None
+        self._closing = False
+        # One thread, so SQLite sees a single writer and statements keep their order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        # Statistics
+        self.appends = 0
+        self.acks = 0
+        self.failures = 0
+        self.commits = 0
+        self.commit_seconds = 0.0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=FULL")  # fsync the WAL on every commit
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS journal (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "fragment_id TEXT NOT NULL, stage TEXT NOT NULL, session TEXT, record TEXT NOT NULL, "
+                "samples BLOB, replays INTEGER NOT NULL DEFAULT 0, error TEXT, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    def start(self):
+        if self._committer is None and self.enabled:
+            self._wakeup = asyncio.Event()
+            self._committer = asyncio.get_running_loop().create_task(self._run_committer())
+
+    async def append(self, stage, session_id, record: dict, samples=None, fragment_id=None) -> int | None:
+        """Durably journals a record for `stage` and returns its journal ID (None when disabled).
+
+        `samples` (float32) are stored as a blob rather than in the JSON record.
+        """
+        if not self.enabled:
+            return None
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        blob = None if samples is None else np.asarray(samples, dtype=np.float32).tobytes()
+        self._queue(
+            "INSERT INTO journal (fragment_id, stage, session, record, samples, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (fragment_id or uuid.uuid4().hex, stage, session_id, json.dumps(record), blob, time.time()), future,
+        )
+        self.appends += 1
+        return await future
+
+    def ack(self, journal_id):
+        """Marks a record as processed."""
+        if self.enabled and journal_id is not None:
+            self.start()
+            self._queue("DELETE FROM journal WHERE id = ?", (journal_id,))
+            self.acks += 1
+
+    def fail(self, journal_id, error):
+        """Sets a record aside after its retries ran out; it stays for inspection but isn't replayed."""
+        if self.enabled and journal_id is not None:
+            self.start()
+            self._queue("UPDATE journal SET error = ? WHERE id = ?", (str(error), journal_id))
+            self.failures += 1
+
+    def pending(self) -> list[dict]:
+        """Records left over from the last run, oldest first, each counted as one more replay."""
+        if not self.enabled:
+            return []
+        self._db.execute(
+            "UPDATE journal SET error = 'replayed too often' WHERE error IS NULL AND replays >= ?",
+            (JOURNAL_MAX_REPLAYS,),
+        )
+        self._db.execute("UPDATE journal SET replays = replays + 1 WHERE error IS NULL")
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT id, fragment_id, stage, session, record, samples FROM journal WHERE error IS NULL ORDER BY id"
+        ).fetchall()
+        return [
+            {
+                "id": row[0], "fragment_id": row[1], "stage": row[2], "session": row[3],
+                "record": json.loads(row[4]),
+                "samples": None if row[5] is None else np.frombuffer(row[5], dtype=np.float32),
+            }
+            for row in rows
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "appends": self.appends,
+            "acks": self.acks,
+            "failures": self.failures,
+            "commits": self.commits,
+            "records_per_commit": round((self.appends + self.acks + self.failures) / self.commits, 1) if self.commits else 0.0,
+            "commit_ms": round(self.commit_seconds / self.commits * 1000, 2) if self.commits else 0.0,
+            "queued": len(self._ops),
+        }
+
+    async def close(self):
+        """Commits what is still queued and closes the database."""
+        if self._committer is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._committer
+            self._committer = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        self._executor.shutdown(wait=True)
+
+    def _queue(self, sql, params, future=None):
+        self._ops.append((sql, params, future))
+        self._wakeup.set()
+
+    async def _run_committer(self):
+        loop = asyncio.get_running_loop()
+        while not (self._closing and not self._ops):
+            await self._wakeup.wait()
+            if self.commit_window and not self._closing:
+                await asyncio.sleep(self.commit_window)
+            self._wakeup.clear()
+            ops, self._ops = self._ops, []
+            if not ops:
+                continue
+            ids, error = await loop.run_in_executor(self._executor, self._write, ops)
+            self._settle(ops, ids, error)
+
+    def _write(self, ops):
+        """Runs on the journal thread. Returns the row ID of each op and the error, if any."""
+        started = time.perf_counter()
+        ids = []
+        try:
+            for sql, params, _ in ops:
+                ids.append(self._db.execute(sql, params).lastrowid)
+                if not self.group_commit:
+                    self._db.commit()
+                    self.commits += 1
+            if self.group_commit:
+                self._db.commit()
+                self.commits += 1
+        except Exception as e:
+            self._db.rollback()
+            return ids, e
+        finally:
+            self.commit_seconds += time.perf_counter() - started
+        return ids, None
+
+    @staticmethod
+    def _settle(ops, ids, error):
+        for (_, _, future), journal_id in zip(ops, ids + [None] * (len(ops) - len(ids))):
+            if future is None or future.done():
+                continue
+            if error is None:
+                future.set_result(journal_id)
+            else:
+                future.set_exception(RuntimeError(f"journal: {error}"))
+
+
+journal = Journal(worker_path(JOURNAL_PATH))
+metrics.register_journal(journal)
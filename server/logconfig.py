@@ -0,0 +1,71 @@
+# Logging for the app, the agent, the inference processes and startall.py.
+#
+# Records are filtered by LOG_LEVEL where they are made, stamped with the worker and the current
+# trace ID (tracing.py), and written to stderr by a listener thread, so a slow terminal or log
+# collector never blocks the event loop. LOG_FORMAT=json writes one JSON object per line, with
+# any `extra=` fields (span durations, sizes) as keys of their own.
+import os
+import sys
+import json
+import atexit
+import queue
+import logging
+import logging.handlers
+import affinity
+import tracing
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG adds per-fragment progress and every span
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+
+QUIET_LOGGERS = ("httpx", "httpcore", "openai", "urllib3")  # A line per HTTP request otherwise; kept at WARNING
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s w%(worker)s %(name)s [%(trace_id)s] %(message)s"
+
+# Attributes every LogRecord has; anything else on a record came in through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "worker", "trace_id"}
+
+_listener = None
+
+
+class TraceFilter(logging.Filter):
+    """Adds the worker index and the trace of the code that logged the record."""
+    def filter(self, record):
+        record.worker = affinity.WORKER_INDEX
+        record.trace_id = tracing.current_trace_id() or "-"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "worker": getattr(record, "worker", None),
+            "trace_id": getattr(record, "trace_id", None),
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Routes the root logger through a queue to stderr. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(TraceFilter())  # Runs in the caller, where the trace context is
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
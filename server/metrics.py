@@ -0,0 +1,236 @@
+# In-process metrics for the pipeline stages: queue depth and per-stage dwell time, plus the
+# per-span histograms fed by tracing.py. snapshot() is the JSON view (/voice/stats); the same
+# numbers are served in the Prometheus text format at /metrics (render_prometheus).
+import os
+import time
+import bisect
+import asyncio
+import logging
+import resource
+import threading
+import statistics
+from collections import deque
+import affinity
+
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Seconds
+
+log = logging.getLogger(__name__)
+
+
+class StageMetrics:
+    """Rolling queue-wait and service-time samples for one pipeline stage."""
+    def __init__(self, name, window=1000):
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=window)     # Seconds a fragment sat in the queue
+        self.service_times = deque(maxlen=window)  # Seconds the stage spent on it
+        self.first_token_times = deque(maxlen=window)  # Seconds until a streaming stage produced output
+
+    def record(self, wait, service, ok=True):
+        self.processed += 1
+        if not ok:
+            self.failed += 1
+        self.wait_times.append(wait)
+        self.service_times.append(service)
+
+    def record_first_token(self, ttft):
+        self.first_token_times.append(ttft)
+
+    def snapshot(self):
+        snapshot = {
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_ms": _summary(self.wait_times),
+            "service_ms": _summary(self.service_times),
+        }
+        if self.first_token_times:
+            snapshot["ttft_ms"] = _summary(self.first_token_times)
+        return snapshot
+
+
+def _summary(samples):
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    return {
+        "p50": round(statistics.median(ordered) * 1000, 1),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        "max": round(ordered[-1] * 1000, 1),
+    }
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus sense: counts per upper bound, plus sum and count."""
+    def __init__(self, buckets=SPAN_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()  # Spans finish on I/O threads too
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, metric, labels):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket in zip([*map(str, self.buckets), "+Inf"], counts):
+            cumulative += bucket
+            yield f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{metric}_sum{{{labels}}} {total}"
+        yield f"{metric}_count{{{labels}}} {count}"
+
+
+stages: dict[str, StageMetrics] = {}
+queues: dict[str, asyncio.Queue] = {}
+caches = {}
+journals = {}
+connections = {}
+loop_lag = {"last_interval_worst_ms": 0.0, "worst_ms": 0.0}
+span_durations: dict[str, Histogram] = {}
+span_waits: dict[str, Histogram] = {}
+span_bytes: dict[str, int] = {}
+critical_path_counts: dict[str, int] = {}
+
+
+def get_stage(name) -> StageMetrics:
+    if name not in stages:
+        stages[name] = StageMetrics(name)
+    return stages[name]
+
+
+def observe_span(name, duration, wait=None, size=None):
+    """Counts a finished span (tracing.py): its duration, the queue wait before it and its payload size."""
+    # setdefault, since spans finish on several threads
+    (span_durations.get(name) or span_durations.setdefault(name, Histogram())).observe(duration)
+    if wait is not None:
+        (span_waits.get(name) or span_waits.setdefault(name, Histogram())).observe(wait)
+    if size:
+        span_bytes[name] = span_bytes.get(name, 0) + size
+
+
+def observe_critical_path(path):
+    """Counts a finished pipeline run (dag.py) against each node on its critical path."""
+    for name in path:
+        critical_path_counts[name] = critical_path_counts.get(name, 0) + 1
+
+
+def register_queue(name, queue: asyncio.Queue):
+    queues[name] = queue
+
+
+def register_cache(name, cache):
+    caches[name] = cache
+
+
+def register_journal(pipeline_journal):
+    journals["pipeline"] = pipeline_journal
+
+
+def register_connections(name, manager):
+    connections[name] = manager
+
+
+def process_memory() -> dict:
+    """Resident set size of this process now and at its peak, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        rss = peak
+    return {"rss_mb": round(rss, 1), "peak_rss_mb": round(peak, 1)}
+
+
+def snapshot():
+    """Returns current queue depths and per-stage dwell times."""
+    return {
+        "queues": {name: {"depth": q.qsize(), "maxsize": q.maxsize} for name, q in queues.items()},
+        "stages": {name: stage.snapshot() for name, stage in stages.items()},
+        "critical_path": dict(critical_path_counts),
+        "loop_lag": dict(loop_lag),
+        "caches": {name: cache.stats() for name, cache in caches.items()},
+        "journal": {name: journal.stats() for name, journal in journals.items()},
+        "memory": process_memory(),
+    }
+
+
+def render_prometheus() -> str:
+    """The metrics in the Prometheus text exposition format (version 0.0.4), labelled with the worker."""
+    worker = f'worker="{affinity.WORKER_INDEX}"'
+    lines = []
+
+    def family(metric, kind, help_text, samples):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        lines.extend(samples)
+
+    family("pipeline_span_seconds", "histogram", "Time spent in each traced pipeline span.",
+           [line for name, histogram in sorted(span_durations.items())
+            for line in histogram.samples("pipeline_span_seconds", f'{worker},span="{name}"')])
+    family("pipeline_queue_wait_seconds", "histogram", "Time work sat queued before the span started.",
+           [line for name, histogram in sorted(span_waits.items())
+            for line in histogram.samples("pipeline_queue_wait_seconds", f'{worker},span="{name}"')])
+    family("pipeline_payload_bytes_total", "counter", "Payload bytes handled per span.",
+           [f'pipeline_payload_bytes_total{{{worker},span="{name}"}} {size}' for name, size in sorted(span_bytes.items())])
+    family("pipeline_critical_path_total", "counter", "Fragments whose critical path went through each pipeline node.",
+           [f'pipeline_critical_path_total{{{worker},node="{name}"}} {count}' for name, count in sorted(critical_path_counts.items())])
+    family("pipeline_queue_depth", "gauge", "Items waiting in each stage queue.",
+           [f'pipeline_queue_depth{{{worker},queue="{name}"}} {q.qsize()}' for name, q in queues.items()])
+    family("pipeline_queue_capacity", "gauge", "Bound of each stage queue.",
+           [f'pipeline_queue_capacity{{{worker},queue="{name}"}} {q.maxsize}' for name, q in queues.items()])
+    family("pipeline_stage_processed_total", "counter", "Items each stage has finished.",
+           [f'pipeline_stage_processed_total{{{worker},stage="{name}"}} {stage.processed}' for name, stage in stages.items()])
+    family("pipeline_stage_failed_total", "counter", "Items each stage gave up on.",
+           [f'pipeline_stage_failed_total{{{worker},stage="{name}"}} {stage.failed}' for name, stage in stages.items()])
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+    family("pipeline_cache_lookups_total", "counter", "Cache lookups by result.",
+           [f'pipeline_cache_lookups_total{{{worker},cache="{name}",result="{result}"}} {stats[key]}'
+            for name, stats in cache_stats.items()
+            for result, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))])
+    journal_stats = {name: journal.stats() for name, journal in journals.items()}
+    family("pipeline_journal_operations_total", "counter", "Journal writes by kind.",
+           [f'pipeline_journal_operations_total{{{worker},journal="{name}",op="{op}"}} {stats[op + "s"]}'
+            for name, stats in journal_stats.items() for op in ("append", "ack", "failure", "commit")])
+    family("pipeline_journal_queued", "gauge", "Journal writes waiting for the next commit.",
+           [f'pipeline_journal_queued{{{worker},journal="{name}"}} {stats["queued"]}' for name, stats in journal_stats.items()])
+    family("pipeline_websocket_connections", "gauge", "Open WebSocket connections per endpoint.",
+           [f'pipeline_websocket_connections{{{worker},endpoint="{name}"}} {len(manager.active_connections)}'
+            for name, manager in connections.items()])
+    family("pipeline_websocket_evicted_total", "counter", "Peers evicted after a failed or stuck send.",
+           [f'pipeline_websocket_evicted_total{{{worker},endpoint="{name}"}} {manager.evicted}'
+            for name, manager in connections.items()])
+    memory = process_memory()
+    family("process_resident_memory_bytes", "gauge", "Resident set size.",
+           [f"process_resident_memory_bytes{{{worker}}} {int(memory['rss_mb'] * 2**20)}"])
+    family("pipeline_event_loop_lag_seconds", "gauge", "Worst event loop lag in the last monitoring interval.",
+           [f"pipeline_event_loop_lag_seconds{{{worker}}} {loop_lag['last_interval_worst_ms'] / 1000}"])
+    return "\n".join(lines) + "\n"
+
+
+# Periodically logs the pipeline metrics
+async def run_metrics_reporter(interval: int = 30):
+    while True:
+        await asyncio.sleep(interval)
+        log.info("metrics: %s", snapshot())
+
+
+# Measures how late short sleeps wake up; anything blocking the loop shows up as lag
+async def run_loop_lag_monitor(interval: float = 10, tick: float = 0.1, warn_ms: float = 100):
+    while True:
+        worst = 0.0
+        deadline = time.monotonic() + interval
+        while time.monotonic() < deadline:
+            before = time.monotonic()
+            await asyncio.sleep(tick)
+            worst = max(worst, time.monotonic() - before - tick)
+        worst_ms = round(worst * 1000, 1)
+        loop_lag["last_interval_worst_ms"] = worst_ms
+        loop_lag["worst_ms"] = max(loop_lag["worst_ms"], worst_ms)
+        if worst_ms >= warn_ms:
+            log.warning("metrics: event loop stalled for %s ms in the last %ss", worst_ms, interval)
@@ -1,56 +1,128 @@
 # WebSocket for model responses
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from websocket_manager import WebSocketConnectionManager
-from objects import modelresps
+from sessions import session_manager, SessionLimitError
+from objects import StreamDelta
 import asyncio
 import json
+import time
+import logging
+import metrics
+import tracing
 
 modelrespapp = FastAPI()
 modelrespmanager = WebSocketConnectionManager()
+metrics.register_connections("modelresp", modelrespmanager)
+log = logging.getLogger(__name__)
+
+
+# Builds the writer's callback for a subscriber's message: once it has actually been sent, the
+# entry is acknowledged in the session log and, for a complete message, the fragment's trace is
+# closed with a "deliver_response" span (the wait is from the entry being logged to its being queued).
+def on_delivered(session_log, websocket, seq, fragment, size):
+    queued = time.monotonic()
+
+    def delivered():
+        session_log.ack(websocket, seq)
+        if not isinstance(fragment, StreamDelta) and fragment.fragment_id:
+            tracing.record("deliver_response", time.monotonic() - queued, queued - fragment.enqueued_at,
+                           fragment.fragment_id, bytes=size)
+    return delivered
 
 
 # Handles WebSocket connections for model responses.
 @modelrespapp.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    # Subscribers join one consultation with ?session=<id>, as returned by the voice socket
+    session_id = websocket.query_params.get("session")
     await modelrespmanager.connect(websocket)
+    if not session_id:
+        modelrespmanager.disconnect(websocket)
+        await websocket.close(code=1008, reason="session query parameter is required")
+        return
+    try:
+        session = session_manager.get_or_create(session_id)
+    except SessionLimitError as e:
+        modelrespmanager.disconnect(websocket)
+        await websocket.close(code=1013, reason=str(e))
+        return
+    session.modelresp_subscribers.add(websocket)
+    since = websocket.query_params.get("since")  # Last seq a reconnecting client saw
+    session.modelresps.subscribe(websocket, int(since) if since and since.isdigit() else None)
+    session_manager.modelresps_wakeup.set()  # Deliver any backlog straight away
     try:
+        # Subscribers don't send anything, so this blocks until the peer closes, is evicted
+        # after a failed send, or stops answering the server's pings (startall.WS_PING_TIMEOUT)
         while True:
-            await asyncio.sleep(1)  # Keep the connection alive
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
     except WebSocketDisconnect:
-        modelrespmanager.disconnect(websocket)
-        print("modelresp: client disconnected")
+        log.info("modelresp: client disconnected")
     except Exception as e:
-        print(f"modelresp: Error in websocket_endpoint: {e}")
+        log.error("modelresp: Error in websocket_endpoint: %s", e)
+    finally:
+        modelrespmanager.disconnect(websocket)
+        session.modelresp_subscribers.discard(websocket)
+        session.modelresps.unsubscribe(websocket)
+        session.touch()
+
 
+# Per-connection queue depth and lag
+@modelrespapp.get("/stats")
+async def connection_stats():
+    return modelrespmanager.stats()
 
-# Periodically sends new model responses to connected clients
+
+# Sends new model responses to each session's subscribers as soon as they are appended.
+# Each subscriber has a cursor into the session log, so a pass only touches unread entries.
 async def send_new_modelresp():
-    print("enter modelresp")
+    log.debug("enter send_new_modelresp")
+    wakeup = session_manager.modelresps_wakeup
     try:
         while True:
-            for fragment in modelresps:
-                if not fragment.sent:  # Only send unsent fragments
-                    print("modelresp: preparing to send new fragment")
-                    message = {
-                        "timestamp": fragment.timestamp.isoformat(),
-                        "model_resp": fragment.response,
-                    }
-                    print("modelresp: send_new:")
-
-                    # Check if there are active WebSocket connections
-                    if modelrespmanager.active_connections:
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            for session in list(session_manager.sessions.values()):
+                session_log = session.modelresps
+                if not session_log.has_unread():
+                    continue
+                for websocket in list(session.modelresp_subscribers):
+                    for seq, fragment in session_log.read(websocket):
+                        if isinstance(fragment, StreamDelta):
+                            # Tokens of a reply still streaming in; the complete message follows
+                            message = {
+                                "seq": seq,
+                                "timestamp": fragment.timestamp.isoformat(),
+                                "session": session.session_id,
+                                "type": "delta",
+                                "stream": fragment.stream_id,
+                                "delta": fragment.delta,
+                            }
+                        else:
+                            message = {
+                                "seq": seq,
+                                "timestamp": fragment.timestamp.isoformat(),
+                                "session": session.session_id,
+                                "type": "complete",
+                                "stream": fragment.stream_id,
+                                "model_resp": fragment.response,
+                            }
                         try:
-                            # Broadcast the message to all active connections
-                            await modelrespmanager.broadcast(json.dumps(message))
-                            fragment.sent = True  # Mark as sent only if broadcast succeeds
-                            print("modelresp: broadcast succeeded, fragment marked as sent")
+                            # Queued on the peer's writer, which acknowledges it once sent; a slow peer only delays itself
+                            data = json.dumps(message)
+                            await modelrespmanager.send_personal_message(
+                                data, websocket, on_sent=on_delivered(session_log, websocket, seq, fragment, len(data))
+                            )
+                            session_log.advance(websocket, seq)
                         except Exception as e:
-                            print(f"modelresp: Error broadcasting message: {e}")
-                    else:
-                        print("modelresp: No active WebSocket connections, skipping broadcast")
-            await asyncio.sleep(1)
+                            log.warning("modelresp: Error sending message: %s", e)
+                            break
     except Exception as e:
-        print(f"modelresp: Error in send_new_modelresp: {e}")
+        log.error("modelresp: Error in send_new_modelresp: %s", e)
         await asyncio.sleep(1)
 
 
@@ -61,16 +133,16 @@ async def monitor_tasks(*tasks):
         for task in tasks:
             if task.done():
                 if task.cancelled():
-                    print(f"Task {task.get_name()} was cancelled.")
+                    log.info("Task %s was cancelled.", task.get_name())
                 else:
                     exception = task.exception()
                     if exception:
-                        print(f"Task {task.get_name()} exited with exception: {exception}")
+                        log.error("Task %s exited with exception: %s", task.get_name(), exception)
                     else:
-                        print(f"Task {task.get_name()} completed successfully.")
+                        log.info("Task %s completed successfully.", task.get_name())
                 # Optionally restart the task if needed
                 if task.get_coro().__name__ == "send_new_modelresp":
-                    print("Restarting send_new_modelresp task...")
+                    log.warning("Restarting send_new_modelresp task...")
                     tasks = list(tasks)  # Convert tuple to list to modify
                     tasks.remove(task)
                     new_task = asyncio.create_task(send_new_modelresp())
@@ -80,18 +152,18 @@ async def monitor_tasks(*tasks):
 
 # Startup event to initialize tasks
 async def startup_event():
-    print("modelresp: startup")
+    log.info("modelresp: startup")
     try:
         # Create the tasks
         send_new_modelresp_task = asyncio.create_task(send_new_modelresp())
-        print(f"send_new_modelresp task created: {send_new_modelresp_task}")
+        log.debug("send_new_modelresp task created: %s", send_new_modelresp_task)
 
         # Monitor the tasks
         asyncio.create_task(monitor_tasks(send_new_modelresp_task))
 
-        print("modelresp: after send_new_modelresp")
+        log.debug("modelresp: after send_new_modelresp")
     except Exception as e:
-        print(f"modelresp: startup_event: Error: {e}")
+        log.error("modelresp: startup_event: Error: %s", e)
         await asyncio.sleep(1)
 
 
@@ -1,35 +1,84 @@
+import os
+import time
+import uuid
+import asyncio
+from datetime import datetime
 from pydantic import BaseModel
 
+VOICE_QUEUE_SIZE = int(os.getenv("VOICE_QUEUE_SIZE", "32"))
+
 # Global objects
-voice_fragments = [] # Stores VoiceFragment objects
-text_fragments = []  # Stores TextFragment objects
-modelresps = []
+# Bounded queue: when it is full the producer blocks, which pushes back to the voice WebSocket
+voice_queue: asyncio.Queue = asyncio.Queue(maxsize=VOICE_QUEUE_SIZE)  # VoiceFragments awaiting the pipeline (tasks.py)
+# Transcripts and model responses are kept per session, see sessions.py
 
 # Represents a voice fragment with a timestamp and payload."""
 class VoiceFragment:
-    def __init__(self, timestamp, payload):
+    def __init__(self, timestamp, payload, fragment_id=None):
         self.timestamp = timestamp
         self.payload = payload
+        self.session_id = payload.get("session")
+        self.fragment_id = fragment_id or uuid.uuid4().hex  # Kept across replays, so stages can skip repeats
+        self.journal_id = None  # Row in journal.py until every pipeline node is through
+        self.published = set()  # Transcript variants already published (None: the source), so a retry doesn't repeat them
+        self.enqueued_at = time.monotonic()  # Used to measure queue dwell time
 
 
-# Represents a text fragment with a timestamp, translation output, and sent status."""
+# Represents a text fragment with a timestamp and translation output."""
 class TextFragment:
-    def __init__(self, timestamp, translation_output):
+    def __init__(self, timestamp, translation_output, partial=False, session_id=None, stream_id=None, fragment_id=None,
+                 language=None, requested=True):
         self.timestamp = timestamp
+        self.session_id = session_id
         self.translation_output = translation_output
-        self.sent = False  # Tracks whether this fragment has been sent to clients
+        self.partial = partial  # Streaming hypothesis that a later final fragment supersedes
+        self.stream_id = stream_id  # Set when the text was streamed token by token first
+        self.fragment_id = fragment_id  # The voice fragment it came from
+        self.language = language  # What it was translated into; None for the transcript itself
+        self.requested = requested  # The variant the uploader's translate_to asked for, for subscribers that chose none
+        self.enqueued_at = time.monotonic()  # Used to measure queue dwell time
 
 # Represents a model response."""
 class ModelResp:
-    def __init__(self, timestamp, response):
+    def __init__(self, timestamp, response, session_id=None, stream_id=None, fragment_id=None):
         self.timestamp = timestamp
+        self.session_id = session_id
         self.response = response
-        self.sent = False  # Tracks whether this fragment has been sent to clients
+        self.stream_id = stream_id
+        self.fragment_id = fragment_id  # The voice fragment whose text the agent answered, for tracing
+        self.enqueued_at = time.monotonic()  # Used to measure how long delivery took
+
+# Represents tokens of a streamed translation or model response, ahead of the complete message."""
+class StreamDelta:
+    def __init__(self, timestamp, stream_id, delta, session_id=None, language=None, requested=True):
+        self.timestamp = timestamp
+        self.session_id = session_id
+        self.stream_id = stream_id
+        self.delta = delta
+        self.language = language  # As on the TextFragment the stream ends in
+        self.requested = requested
+
+# Session log entries as plain dicts, so they can cross process boundaries
+def entry_to_dict(entry) -> dict:
+    data = {key: value for key, value in vars(entry).items() if key not in ("enqueued_at", "journal_id")}
+    data["timestamp"] = entry.timestamp.isoformat()
+    data["type"] = type(entry).__name__
+    return data
+
+
+def entry_from_dict(data: dict):
+    data = dict(data)
+    cls = {"TextFragment": TextFragment, "ModelResp": ModelResp, "StreamDelta": StreamDelta}[data.pop("type")]
+    data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+    return cls(**data)
+
 
 class PatientInput(BaseModel):
     gender: str
     age: int
     symptoms: str
     medical_history: str
+    session_id: str | None = None  # Set to diarize incrementally against the session's dialogue so far
+    fragment_id: str | None = None  # Set by the pipeline; a fragment replayed after a crash isn't labelled twice
 
 
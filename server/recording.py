@@ -0,0 +1,76 @@
+# Recordings of voice sockets, so a real consultation can be replayed against the stack later
+# (bench_replay.py) at its original pace or faster.
+#
+# A recording is JSON lines, one per client message, in arrival order:
+#   {"t": seconds since the socket connected, "text": "..."}   or   {"t": ..., "bytes": "<base64>"}
+# Set VOICE_RECORD_DIR to record every voice socket to <dir>/<session>-<unix time>.jsonl.
+import os
+import json
+import time
+import base64
+import wave
+import numpy as np
+
+VOICE_RECORD_DIR = os.getenv("VOICE_RECORD_DIR", "")  # Empty disables recording
+
+
+class SessionRecorder:
+    """Appends one voice socket's messages, with their arrival times, to a recording file."""
+    def __init__(self, session_id, directory=VOICE_RECORD_DIR):
+        self.started = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{session_id}-{int(time.time())}.jsonl")
+        self._file = open(self.path, "a")
+
+    def record(self, text=None, data=None):
+        entry = {"t": round(time.monotonic() - self.started, 4)}
+        if data is not None:
+            entry["bytes"] = base64.b64encode(data).decode()
+        else:
+            entry["text"] = text
+        self._file.write(json.dumps(entry) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def open_recorder(session_id) -> SessionRecorder | None:
+    return SessionRecorder(session_id) if VOICE_RECORD_DIR else None
+
+
+def load_recording(path) -> list[tuple[float, str | bytes]]:
+    """Returns (arrival time, message) pairs; binary frames come back as bytes."""
+    messages = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                message = base64.b64decode(entry["bytes"]) if "bytes" in entry else entry["text"]
+                messages.append((entry["t"], message))
+    return messages
+
+
+def save_recording(messages, path):
+    with open(path, "w") as f:
+        for t, message in messages:
+            if isinstance(message, bytes):
+                f.write(json.dumps({"t": t, "bytes": base64.b64encode(message).decode()}) + "\n")
+            else:
+                f.write(json.dumps({"t": t, "text": message}) + "\n")
+
+
+def recording_from_wav(path, frame_ms=100, mode="c", translate_to=None, duration=5) -> list[tuple[float, str | bytes]]:
+    """Turns a mono 16-bit WAV into the messages a browser streaming it live would send."""
+    with wave.open(path, "rb") as wav_file:
+        rate = wav_file.getframerate()
+        pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+    start = {"action": "start_stream", "mode": mode, "sample_rate": rate, "duration": duration}
+    if translate_to:
+        start["translate_to"] = translate_to
+    messages = [(0.0, json.dumps(start))]
+    frame = rate * frame_ms // 1000
+    for index, offset in enumerate(range(0, len(pcm), frame)):
+        # A frame goes out once it has been captured
+        messages.append(((index + 1) * frame_ms / 1000, pcm[offset:offset + frame].tobytes()))
+    messages.append((messages[-1][0], json.dumps({"action": "end_stream"})))
+    return messages
@@ -0,0 +1,75 @@
+# DOCX reports per session, built incrementally and only rendered when someone downloads them.
+import os
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from docx import Document
+
+REPORT_MAX_SESSIONS = int(os.getenv("REPORT_MAX_SESSIONS", "100"))  # Reports kept, least recently used dropped
+REPORT_CHUNK_SIZE = 64 * 1024  # Bytes per chunk of a streamed download
+
+
+def format_entry(entry):
+    if isinstance(entry, dict) and ("doctor" in entry or "patient" in entry):
+        return f"Doctor: {entry.get('doctor', '')}\nPatient: {entry.get('patient', '')}"
+    return str(entry)
+
+
+class Report:
+    """Entries of one session's report and its latest rendered DOCX.
+
+    `add` only records entries and bumps the version. `render` appends the entries added
+    since the last render to the same Document and caches the saved bytes for that version,
+    so repeated downloads of an unchanged report cost nothing.
+    """
+    def __init__(self, title="Healthcare Diagnosis and Treatment Recommendations"):
+        self.title = title
+        self.entries = []
+        self.version = 0
+        self._lock = threading.Lock()
+        self._doc = None
+        self._rendered_entries = 0
+        self._rendered = None  # (version, bytes)
+
+    def add(self, entries) -> int:
+        with self._lock:
+            self.entries.extend(entries)
+            self.version += 1
+            return self.version
+
+    def render(self) -> tuple[int, bytes]:
+        with self._lock:
+            if self._rendered is not None and self._rendered[0] == self.version:
+                return self._rendered
+            if self._doc is None:
+                self._doc = Document()
+                self._doc.add_heading(self.title, 0)
+            for entry in self.entries[self._rendered_entries:]:
+                self._doc.add_paragraph(format_entry(entry))
+            self._rendered_entries = len(self.entries)
+            bio = BytesIO()
+            self._doc.save(bio)
+            self._rendered = (self.version, bio.getvalue())
+            return self._rendered
+
+
+_reports: OrderedDict[str, Report] = OrderedDict()
+_reports_lock = threading.Lock()
+
+
+def get_report(report_id, create=True) -> Report | None:
+    with _reports_lock:
+        report = _reports.get(report_id)
+        if report is None:
+            if not create:
+                return None
+            report = _reports[report_id] = Report()
+            while len(_reports) > REPORT_MAX_SESSIONS:
+                _reports.popitem(last=False)
+        _reports.move_to_end(report_id)
+        return report
+
+
+def iter_chunks(data, chunk_size=REPORT_CHUNK_SIZE):
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
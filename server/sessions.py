@@ -0,0 +1,164 @@
+# Per-session state, so concurrent consultations don't share transcripts or subscribers.
+import os
+import time
+import logging
+import asyncio
+from functools import partial
+import affinity
+from channel_log import ChannelLog
+from objects import entry_to_dict, entry_from_dict
+
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "100"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "900"))  # Seconds without activity
+SESSION_MAX_FRAGMENTS = int(os.getenv("SESSION_MAX_FRAGMENTS", "500"))  # Per transcript/response buffer
+SESSION_MAX_PENDING = int(os.getenv("SESSION_MAX_PENDING", "8"))  # Voice fragments queued per session
+SOURCE_LANGUAGE = os.getenv("SOURCE_LANGUAGE", "English")  # What transcripts are in; asking for it means no translation
+
+log = logging.getLogger(__name__)
+
+
+def language_variant(name) -> str | None:
+    """A language as transcript entries are tagged with it: "spanish " -> "Spanish", the source language -> None."""
+    name = (name or "").strip().title()
+    return None if not name or name == SOURCE_LANGUAGE.title() else name
+
+
+class SessionLimitError(Exception):
+    """Raised when a new session is requested while every slot is in use."""
+
+
+class Session:
+    """Transcript buffers, subscribers and intake limit for one consultation."""
+    def __init__(self, session_id, text_fragments_wakeup=None, modelresps_wakeup=None, publish=None):
+        self.session_id = session_id
+        self.created_at = time.monotonic()
+        self.last_active = self.created_at
+        # Append-only delivery logs with per-subscriber cursors, capped at SESSION_MAX_FRAGMENTS.
+        # `publish(session_id, log, seq, entry, epoch)` replicates local appends to the other workers
+        self.text_fragments = ChannelLog(
+            SESSION_MAX_FRAGMENTS, text_fragments_wakeup,
+            partial(publish, session_id, "text_fragments") if publish else None,
+        )
+        self.modelresps = ChannelLog(
+            SESSION_MAX_FRAGMENTS, modelresps_wakeup,
+            partial(publish, session_id, "modelresps") if publish else None,
+        )
+        # Subscribed sockets; sending goes through each app's WebSocketConnectionManager
+        self.transcribe_subscribers = set()
+        # The transcript variants each transcript subscriber declared (language_variant; None is the
+        # source), and the translations subscribers on other workers wait for, by worker index.
+        # A subscriber that declared nothing gets what the uploader's translate_to asked for
+        self.subscriber_languages = {}
+        self.remote_languages = {}
+        self.modelresp_subscribers = set()
+        # Caps how much of the shared voice queue one session can occupy
+        self.pending = asyncio.Semaphore(SESSION_MAX_PENDING)
+        self.pending_count = 0
+        self.voice_connections = 0
+        # Streaming transcription state for mode "s"; fragments must be fed in order
+        self.transcriber = None
+        self.transcriber_lock = asyncio.Lock()
+
+    def languages(self) -> set[str]:
+        """Languages some transcript subscriber, on this worker or another, wants a translation into."""
+        languages = set().union(*self.remote_languages.values(), *self.subscriber_languages.values())
+        languages.discard(None)
+        return languages
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def is_idle(self, now, timeout):
+        return (
+            self.voice_connections == 0
+            and self.pending_count == 0
+            and not self.transcribe_subscribers
+            and not self.modelresp_subscribers
+            and now - self.last_active > timeout
+        )
+
+
+class SessionManager:
+    """Creates, looks up and evicts sessions keyed by session ID."""
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions: dict[str, Session] = {}
+        # Set whenever any session appends, so the delivery loops wake up immediately
+        self.text_fragments_wakeup = asyncio.Event()
+        self.modelresps_wakeup = asyncio.Event()
+        self.broker = None  # Set by attach_broker when running as one of several workers
+
+    def get(self, session_id) -> Session | None:
+        return self.sessions.get(session_id)
+
+    def get_or_create(self, session_id=None) -> Session:
+        session_id = session_id or affinity.new_local_session_id()
+        session = self.sessions.get(session_id)
+        if session is None:
+            if len(self.sessions) >= self.max_sessions:
+                self._evict_oldest_idle()
+            session = self.sessions[session_id] = Session(
+                session_id, self.text_fragments_wakeup, self.modelresps_wakeup, self.publish
+            )
+            log.info("sessions: created %s (%d active)", session_id, len(self.sessions))
+        session.touch()
+        return session
+
+    def evict_idle(self, timeout=None):
+        """Drops sessions that have had no connections or activity for `timeout` seconds."""
+        now = time.monotonic()
+        timeout = self.idle_timeout if timeout is None else timeout
+        for session_id in [sid for sid, s in self.sessions.items() if s.is_idle(now, timeout)]:
+            del self.sessions[session_id]
+            log.info("sessions: evicted idle %s", session_id)
+
+    def _evict_oldest_idle(self):
+        now = time.monotonic()
+        idle = [s for s in self.sessions.values() if s.is_idle(now, 0)]
+        if not idle:
+            raise SessionLimitError(f"All {self.max_sessions} sessions are in use")
+        oldest = min(idle, key=lambda s: s.last_active)
+        del self.sessions[oldest.session_id]
+        log.info("sessions: evicted %s to make room", oldest.session_id)
+
+    async def attach_broker(self, broker):
+        """Replicates session log appends to the other workers and applies theirs here."""
+        self.broker = broker
+        await broker.start(self.receive)
+
+    def publish(self, session_id, log, seq, entry, epoch):
+        if self.broker is not None:
+            self.broker.publish({
+                "session": session_id, "log": log, "seq": seq, "epoch": epoch, "entry": entry_to_dict(entry),
+            })
+
+    def publish_languages(self, session):
+        """Tells the other workers, among them the session's owner, which translations subscribers here want."""
+        if self.broker is not None:
+            self.broker.publish({
+                "session": session.session_id, "worker": affinity.WORKER_INDEX,
+                "languages": sorted(set().union(*session.subscriber_languages.values()) - {None}),
+            })
+
+    def receive(self, message):
+        try:
+            session = self.get_or_create(message["session"])
+        except SessionLimitError:
+            log.warning("sessions: no room to replicate %s", message["session"])
+            return
+        if "languages" in message:
+            session.remote_languages[message["worker"]] = set(message["languages"])
+            return
+        getattr(session, message["log"]).append(
+            entry_from_dict(message["entry"]), seq=message["seq"], epoch=message["epoch"]
+        )
+
+    # Periodically evicts idle sessions
+    async def run_eviction(self, interval: int = 60):
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+
+session_manager = SessionManager()
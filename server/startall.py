@@ -1,71 +1,106 @@
-# Wrapper to start WebSocket servers for voice, transcribed, and model response services.
+# Starts the voice, transcribed and model response WebSockets (app.py) on one port.
+#
+# APP_WORKERS=1 serves everything from this process. With more workers, this process becomes a
+# supervisor: it binds the shared port, runs the broker hub the workers publish session
+# updates through, and starts APP_WORKERS worker processes. Worker i also listens on
+# APP_PORT + 1 + i, where clients are redirected for sessions it owns (see affinity.py).
+#
+# Usage: APP_WORKERS=4 python startall.py
 
+import os
+import socket
+import logging
 import asyncio
+import multiprocessing
 from uvicorn.config import Config
 from uvicorn.server import Server
-from tasks import run_translate_fragment_periodically, run_agent_call_periodically
-from voice import voiceapp as voice_app  # Import the FastAPI app for voice
-from transcribed import transcribeapp as transcribed_app  # Import the FastAPI app for transcribed
-from modelresp import modelrespapp as modelresp_app  # Import the FastAPI app for model response
-from fastapi.middleware.cors import CORSMiddleware
-
-transcribed_app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Replace "*" with specific origins if needed
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-
-async def start_voice_server():
-    """Starts the WebSocket server for voice-related actions."""
-    config = Config("voice:voiceapp", host="0.0.0.0", port=8081, reload=False)
-    server = Server(config)
-    # Trigger FastAPI lifecycle events
-    await voice_app.router.startup()
-    await server.serve()
-    await voice_app.router.shutdown()
-
-
-async def start_transcribed_server():
-    """Starts the WebSocket server for transcribed text."""
-    config = Config("transcribed:transcribeapp", host="0.0.0.0", port=6081, reload=False)
-    server = Server(config)
-    # Trigger FastAPI lifecycle events
-    print("Starting transcribed_app...")
-    await transcribed_app.router.startup()
-    print("transcribed_app started. Serving...")
-    await server.serve()
-    print("Shutting down transcribed_app...")
-    await transcribed_app.router.shutdown()
-    print("transcribed_app shut down.")
-
-
-async def start_modelresp_server():
-    """Starts the WebSocket server for model response."""
-    config = Config("modelresp:modelrespapp", host="0.0.0.0", port=7081, reload=False)
-    server = Server(config)
-    # Trigger FastAPI lifecycle events
-    await modelresp_app.router.startup()
-    await server.serve()
-    await modelresp_app.router.shutdown()
-
-
-async def main():
-    """Main function to run all WebSocket servers and periodic tasks."""
-    print("Starting all servers and periodic tasks...")
-    await asyncio.gather(
-        start_voice_server(),
-        start_transcribed_server(),
-        start_modelresp_server(),
-        run_translate_fragment_periodically(),
-        run_agent_call_periodically(),
-    )
+from logconfig import configure_logging, LOG_LEVEL
+
+APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
+APP_PORT = int(os.getenv("APP_PORT", "8080"))
+APP_WORKERS = int(os.getenv("APP_WORKERS", "1"))  # Worker processes, each with its own event loop and Whisper pool
+WORKER_PORT_BASE = APP_PORT + 1  # Worker i's private port, for session-affinity redirects
+# Dead WebSocket peers are found with protocol-level pings from uvicorn's timers rather than
+# app-level heartbeats, so an idle connection costs no wakeups between pings
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))  # Seconds between pings to each peer
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "20"))  # A peer that doesn't pong in time is closed (1011)
+# Browsers offer permessage-deflate, and its zlib state is most of what an idle socket costs;
+# the messages are short JSON, so it is off unless asked for
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "0") == "1"
+
+log = logging.getLogger(__name__)
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index, count, shared_socket, host=APP_HOST, port_base=WORKER_PORT_BASE, setup=None):
+    """Entry point of a worker process; `setup` is an optional picklable hook run before the app is imported."""
+    # affinity.py and broker.py read these at import time
+    os.environ["WORKER_INDEX"] = str(index)
+    os.environ["WORKER_COUNT"] = str(count)
+    os.environ["WORKER_PORT_BASE"] = str(port_base)
+    os.environ["BROKER"] = "local" if count > 1 else "inprocess"
+    if setup is not None:
+        setup()
+    from app import app
+
+    server = Server(Config(
+        app, host=host, port=port_base + index, log_level=LOG_LEVEL.lower(),
+        ws_ping_interval=WS_PING_INTERVAL, ws_ping_timeout=WS_PING_TIMEOUT, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+    ))
+    sockets = [shared_socket, bind_socket(host, port_base + index)] if count > 1 else [shared_socket]
+    server.run(sockets=sockets)
+
+
+async def supervise(workers, host=APP_HOST, port=APP_PORT, setup=None):
+    """Runs the broker hub and `workers` worker processes until one of them exits."""
+    from broker import run_hub, BROKER_PATH
+
+    shared_socket = bind_socket(host, port)
+    hub = asyncio.create_task(run_hub(BROKER_PATH))
+    while not os.path.exists(BROKER_PATH):
+        await asyncio.sleep(0.01)
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(index, workers, shared_socket, host, port + 1, setup))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    log.info("Started %d workers on port %d (private ports %d-%d)", workers, port, port + 1, port + workers)
+    try:
+        # Any worker exiting takes the deployment down, so the process manager can restart it
+        while all(process.is_alive() for process in processes):
+            await asyncio.sleep(0.5)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.kill()  # Stuck in graceful shutdown, e.g. on an open socket
+        hub.cancel()
+        shared_socket.close()
+
+
+def main(workers=APP_WORKERS, host=APP_HOST, port=APP_PORT, setup=None):
+    configure_logging()
+    log.info("Starting all servers and pipeline workers...")
+    if workers <= 1:
+        run_worker(0, 1, bind_socket(host, port), host, port + 1, setup)
+    else:
+        asyncio.run(supervise(workers, host, port, setup))
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
-        print("Shutting down servers...")
\ No newline at end of file
+        log.info("Shutting down servers...")
@@ -0,0 +1,61 @@
+# Forwards streamed tokens to a session log as they arrive, ahead of the complete message.
+import os
+import time
+import uuid
+from datetime import datetime
+import metrics
+from objects import StreamDelta
+
+STREAM_TOKENS = os.getenv("STREAM_TOKENS", "0") == "1"  # Stream translations and agent replies token by token
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))  # Seconds of tokens per delta message
+
+
+class DeltaWriter:
+    """Coalesces streamed tokens into StreamDelta entries on a ChannelLog.
+
+    The first token is forwarded immediately; after that, tokens are batched into one
+    entry per `interval` so a long reply doesn't flood the log. Records time to first
+    token and total time on the given pipeline stage.
+    """
+    def __init__(self, log, session_id, stage, interval=STREAM_FLUSH_INTERVAL, language=None, requested=True):
+        self.log = log
+        self.session_id = session_id
+        self.language = language  # Tags the deltas of a translation, see objects.TextFragment
+        self.requested = requested
+        self.stream_id = uuid.uuid4().hex
+        self.stage = metrics.get_stage(stage)
+        self.interval = interval
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.last_flush = 0.0
+        self._parts = []
+        self._pending = []
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def write(self, token):
+        if not token:
+            return
+        now = time.monotonic()
+        if self.first_token_at is None:
+            self.first_token_at = now
+            self.stage.record_first_token(now - self.started)
+        self._parts.append(token)
+        self._pending.append(token)
+        if now - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.log.append(StreamDelta(
+                datetime.now(), self.stream_id, "".join(self._pending), self.session_id, self.language, self.requested
+            ))
+            self._pending = []
+            self.last_flush = time.monotonic()
+
+    def close(self, ok=True):
+        """Flushes the remaining tokens and records the stage's total time."""
+        self.flush()
+        self.stage.record(0.0, time.monotonic() - self.started, ok)
@@ -0,0 +1,130 @@
+# Stand-in for the OpenAI endpoints the pipeline calls, for offline benchmarks (bench_replay.py).
+#
+#   POST /v1/audio/transcriptions  - Whisper: a sentence picked by a hash of the upload
+#   POST /v1/chat/completions      - GPT translation (plain text) and diarization (the "dialogue"
+#                                    JSON schema), streamed token by token when asked to
+#   GET  /stats                    - requests served per endpoint, and how many of the chat
+#                                    requests were translations
+#
+# Every response waits a latency drawn from a normal distribution (mean, jitter as its standard
+# deviation); streamed completions then wait --token-delay between tokens. Point the server at
+# it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1/ and any OPENAI_API_KEY.
+#
+# Usage: python stub_openai.py [--port 18090] [--transcribe-latency 0.6] [--chat-latency 0.4]
+#                              [--jitter 0.1] [--token-delay 0.02] [--seed 0]
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+SENTENCES = [
+    "How long have you had the cough?",
+    "About a week, and it gets worse at night.",
+    "Any fever or shortness of breath?",
+    "A mild fever on Tuesday, no trouble breathing.",
+    "Are you taking any medication at the moment?",
+    "Only ibuprofen for the headaches.",
+    "Let me listen to your chest, take a deep breath.",
+    "I'd like to run a blood test to be sure.",
+]
+
+stub = FastAPI()
+stub.state.transcribe_latency = 0.6
+stub.state.chat_latency = 0.4
+stub.state.jitter = 0.1
+stub.state.token_delay = 0.02
+stub.state.rng = random.Random(0)
+stub.state.requests = {"transcriptions": 0, "chat": 0, "chat_stream": 0, "translations": 0}
+
+
+def configure(transcribe_latency=0.6, chat_latency=0.4, jitter=0.1, token_delay=0.02, seed=0):
+    stub.state.transcribe_latency = transcribe_latency
+    stub.state.chat_latency = chat_latency
+    stub.state.jitter = jitter
+    stub.state.token_delay = token_delay
+    stub.state.rng = random.Random(seed)
+
+
+async def wait(mean):
+    await asyncio.sleep(max(0.0, stub.state.rng.gauss(mean, stub.state.jitter)))
+
+
+@stub.post("/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    # Multipart isn't parsed (it would need python-multipart); the raw body identifies the audio
+    digest = hashlib.blake2b(await request.body(), digest_size=4).digest()
+    stub.state.requests["transcriptions"] += 1
+    await wait(stub.state.transcribe_latency)
+    return {"text": SENTENCES[int.from_bytes(digest, "big") % len(SENTENCES)]}
+
+
+def reply_tokens(body) -> list[str]:
+    """Diarization gets the JSON its schema asks for; anything else a word-for-word "translation"."""
+    text = body["messages"][-1]["content"]
+    if (body.get("response_format") or {}).get("type") == "json_schema":
+        sentences = [s for s in SENTENCES if s in text] or SENTENCES[:2]
+        pairs = [{"doctor": sentences[i], "patient": sentences[i + 1] if i + 1 < len(sentences) else ""}
+                 for i in range(0, len(sentences), 2)]
+        content = json.dumps({"fragments": pairs})
+        return [content[i:i + 8] for i in range(0, len(content), 8)]
+    words = text.split("\n\n")[1].split() if "\n\n" in text else text.split()
+    return [f"«{word}» " for word in words]
+
+
+@stub.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if body["messages"][-1]["content"].startswith("Translate"):
+        stub.state.requests["translations"] += 1
+    tokens = reply_tokens(body)
+    model = body.get("model", "stub")
+
+    def envelope(obj, choice):
+        return {"id": "chatcmpl-stub", "object": obj, "created": int(time.time()), "model": model, "choices": [choice]}
+
+    if not body.get("stream"):
+        stub.state.requests["chat"] += 1
+        await wait(stub.state.chat_latency)
+        await asyncio.sleep(stub.state.token_delay * len(tokens))  # Generation time, as if streamed
+        message = {"role": "assistant", "content": "".join(tokens)}
+        return envelope("chat.completion", {"index": 0, "message": message, "finish_reason": "stop"})
+
+    stub.state.requests["chat_stream"] += 1
+
+    async def events():
+        await wait(stub.state.chat_latency)
+        for token in tokens:
+            chunk = envelope("chat.completion.chunk", {"index": 0, "delta": {"content": token}, "finish_reason": None})
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(stub.state.token_delay)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@stub.get("/stats")
+async def stats():
+    return dict(stub.state.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--transcribe-latency", type=float, default=0.6, help="mean seconds per transcription")
+    parser.add_argument("--chat-latency", type=float, default=0.4, help="mean seconds to the first token")
+    parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of those latencies (s)")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    configure(args.transcribe_latency, args.chat_latency, args.jitter, args.token_delay, args.seed)
+    uvicorn.run(stub, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,34 @@
-# Defines periodic tasks for transcription, translation, and agent calls.
+# Defines the event-driven pipeline for transcription, translation, and agent calls.
 
 import asyncio
 import os
+import time
 import base64
+import logging
+import dag
+import metrics
+import tracing
 import numpy as np
+from audio import pcm_from_wav_bytes, pcm_to_float32, SAMPLE_RATE
 from datetime import datetime
 from agent_call import agentCall_async  
-from translate_openai import translate_text
-from objects import voice_fragments, text_fragments, TextFragment
-from transcribe_whisper import transcribe_cloud_from_memory, record_audio, save_wav, transcribe_cloud, transcribe_local
+from executors import run_io, run_cpu
+from inference import inference_pool
+from translation_batcher import translation_batcher
+from translate_openai import translate_text_stream
+from streaming import DeltaWriter, STREAM_TOKENS
+from objects import voice_queue, VoiceFragment, TextFragment
+from sessions import session_manager, SessionLimitError, SOURCE_LANGUAGE, language_variant
+from journal import journal
+from whisper_models import DEFAULT_MODEL_SIZE
+from cache import transcription_cache, translation_cache, transcription_key, translation_key
+from transcribe_whisper import transcribe_cloud_from_memory, StreamingTranscriber
 
-translate_fragment_running = False  # Flag to track if translate_fragment is running
+FRAGMENT_WORKERS = int(os.getenv("FRAGMENT_WORKERS", "4"))  # Fragments in the pipeline at once, across sessions
+AGENT_CONCURRENCY = int(os.getenv("AGENT_CONCURRENCY", "2"))  # Agent calls in flight at once
+PIPELINE_RETRIES = int(os.getenv("PIPELINE_RETRIES", "2"))  # Extra attempts per fragment and node before it is set aside
+
+log = logging.getLogger(__name__)
 
 
 def decode_audio_base64(audio_base64: str) -> np.ndarray:
@@ -20,91 +38,247 @@ def decode_audio_base64(audio_base64: str) -> np.ndarray:
 
         # Ensure the base64 string is properly padded
         if len(audio_base64) % 4 != 0:
-            print("Base64 string length is not a multiple of 4. Adding padding.")
+            log.debug("Base64 string length is not a multiple of 4. Adding padding.")
             audio_base64 += "=" * (4 - len(audio_base64) % 4)
 
         # Decode the base64 string
         audio_bytes = base64.b64decode(audio_base64)
 
-        # Convert the raw bytes into a NumPy array
-        audio = np.frombuffer(audio_bytes, dtype=np.int16)
+        # View the samples as int16, skipping the RIFF header so it isn't played back as a click
+        audio, _ = pcm_from_wav_bytes(audio_bytes)
         return audio
     except Exception as e:
         raise ValueError(f"Error decoding base64 audio: {e}")
 
 
-async def translate_fragment():
-    print("Running translate_fragment")
-    global translate_fragment_running
-    if translate_fragment_running:
-        print("translate_fragment already running. Skipping this run.")
-        return
+# Streams a session's audio through its StreamingTranscriber. Partial hypotheses go straight
+# to the session transcript; final text is returned for translation and the agent.
+# VAD and decoding are CPU-bound, so they run on the CPU pool rather than among network calls.
+async def transcribe_streaming(session, payload, samples):
+    async with session.transcriber_lock:  # Fragments of one session must be fed in order
+        if session.transcriber is None:
+            session.transcriber = StreamingTranscriber()
+        transcriber = session.transcriber
+        events = await run_cpu(transcriber.feed, samples) if len(samples) else []
+        if payload.get("final"):
+            events += await run_cpu(transcriber.flush)
+            log.info("streaming stats: %s %s", session.session_id, transcriber.stats())
+            session.transcriber = None
 
-    translate_fragment_running = True
-    try:
-        while voice_fragments:
-            fragment = voice_fragments.pop(0)
-            payload = fragment.payload
-            duration = payload.get("duration")
-            transcription_mode = payload.get("mode").lower()
-            translate_to = payload.get("translate_to")
-            rate = payload.get("sample_rate")
-            audio_base64 = payload.get("audio")  # Base64-encoded audio string
-            print("duration, mode, translate_to, audio length: ", duration, transcription_mode, translate_to, len(audio_base64))
-
-            # Decode the base64-encoded audio string using the utility function
+    for event in events:
+        if event["type"] == "partial":
+            session.text_fragments.append(
+                TextFragment(datetime.now(), event["text"], partial=True, session_id=session.session_id)
+            )
+    return " ".join(event["text"] for event in events if event["type"] == "final")
+
+
+# Transcribes a whole 16 kHz float32 fragment, reusing the transcript if identical audio was seen before.
+# Cloud transcription is network-bound (thread pool); local Whisper goes to the inference processes.
+# Failures raise and empty transcripts aren't stored, so neither sticks to the audio for the cache's TTL
+async def transcribe_cached(samples, mode):
+    model = "whisper-1" if mode == "c" else DEFAULT_MODEL_SIZE
+    key = transcription_key(samples, SAMPLE_RATE, mode, model)
+    text = await run_io(transcription_cache.get, key)
+    if text is None:
+        if mode == "c":
+            text = await run_io(transcribe_cloud_from_memory, samples, SAMPLE_RATE)
+        else:
+            text = await inference_pool.transcribe(samples)
+        if text:
+            await run_io(transcription_cache.put, key, text)
+    return text
+
+
+# Translates text, reusing earlier translations of the same phrase and language pair.
+# Misses are micro-batched with other fragments waiting on the same language pair, or, when
+# `stream_to` is a session, streamed to its transcript subscribers token by token (`requested`
+# tags the deltas, see objects.TextFragment).
+# Returns the translation and the stream ID its tokens were sent under (None if not streamed).
+async def translate_cached(text, input_lang, output_lang, stream_to=None, requested=True):
+    key = translation_key(text, input_lang, output_lang)
+    translated = await run_io(translation_cache.get, key)
+    stream_id = None
+    if translated is None:
+        if stream_to is not None:
+            writer = DeltaWriter(stream_to.text_fragments, stream_to.session_id, "translate_stream",
+                                 language=output_lang, requested=requested)
+            stream_id = writer.stream_id
+            ok = False
             try:
-                audio = decode_audio_base64(audio_base64)
-            except ValueError as e:
-                print(e)
-                continue
-
-            path = await asyncio.to_thread(save_wav, audio, rate)
-
-            # Perform transcription
-            if transcription_mode == "c":
-                transcribed_text = transcribe_cloud(path)
-                #transcribed_text = transcribe_cloud_from_memory(audio, rate)
-            elif transcription_mode == "l":
-                transcribed_text = transcribe_local(path)
-            else:
-                print("Invalid transcription mode. Skipping.")
-                continue
+                async for token in translate_text_stream(text, input_lang, output_lang):
+                    writer.write(token)
+                ok = True
+            finally:
+                writer.close(ok)
+            translated = writer.text.strip()
+        else:
+            translated = await translation_batcher.translate(text, input_lang, output_lang)
+        await run_io(translation_cache.put, key, translated)
+    return translated, stream_id
 
-            print("transcribed_text size: ", len(transcribed_text))
 
-            # Perform translation if needed
-            if translate_to:
-                translated_text = await asyncio.to_thread(
-                    translate_text, transcribed_text, "English", translate_to
-                )
-            else:
-                translated_text = transcribed_text
+# The per-fragment pipeline (see dag.py). Transcription comes first; then the transcript is
+# translated for its subscribers and diarized by the agent at the same time, since the agent works
+# on the source text. A fragment takes transcribe + max(translate, agent) rather than their sum.
+# Each node is ordered per session where order matters, so a session's transcript and dialogue
+# come out in fragment order while other sessions' fragments overlap.
 
-            # Append the translated text to text_fragments
-            text_fragments.append(TextFragment(datetime.now(), translated_text))
-            print("after append text_fragments: ", len(text_fragments))
 
-    except Exception as e:
-        print(f"Error in translate_fragment: {e}")
-    finally:
-        translate_fragment_running = False
+# Transcribes a voice fragment. Returns the text, or None if there is nothing to pass on.
+async def transcribe_node(fragment, session, results):
+    payload = fragment.payload
+    duration = payload.get("duration")
+    transcription_mode = payload.get("mode").lower()
+    translate_to = payload.get("translate_to")
+    samples = payload.get("samples")  # 16 kHz float32, normalised on the voice socket
 
+    if samples is None:
+        # JSON compatibility path: decode the base64-encoded audio string using the utility function
+        try:
+            samples = pcm_to_float32(decode_audio_base64(payload.get("audio")), payload.get("sample_rate"))
+        except ValueError as e:
+            log.warning("%s", e)
+            return None
+    log.debug("duration, mode, translate_to, samples: %s %s %s %d", duration, transcription_mode, translate_to, len(samples))
+    if len(samples) == 0 and transcription_mode != "s":
+        return None
 
-# Runs translate_fragment periodically
-async def run_translate_fragment_periodically(interval: int = 5):
-    print("Running translate_fragment periodically")
-    while True:
-        await translate_fragment()
-        await asyncio.sleep(interval)
+    # Audio stays in memory end to end; no WAV is written per fragment. Streaming mode is
+    # stateful per session, so only whole-fragment modes are cached; its fragments reach the
+    # transcriber lock in the order their runs started, which is the order they were queued
+    if transcription_mode not in ("c", "l", "s"):
+        log.warning("Invalid transcription mode %r. Skipping.", transcription_mode)
+        return None
+    with tracing.span("transcribe", mode=transcription_mode, bytes=samples.nbytes):
+        if transcription_mode == "s":
+            transcribed_text = await transcribe_streaming(session, payload, samples)
+        else:
+            transcribed_text = await transcribe_cached(samples, transcription_mode)
+    if not transcribed_text:
+        return None  # Silence, or only partial hypotheses so far
+    log.debug("transcribed_text size: %d", len(transcribed_text))
+    return transcribed_text
+
+
+# Publishes the transcript to the session's transcript subscribers, then a translation into each
+# language they are waiting for (Session.languages) and the one the uploader's translate_to asked
+# for. Each language is translated once however many subscribers want it, and each subscriber is
+# sent only its own variants (transcribed.py). Returns the translations.
+async def translate_node(fragment, session, results):
+    transcribed_text = results["transcribe"]
+    if transcribed_text is None:
+        return None
+    requested = language_variant(fragment.payload.get("translate_to"))
+    if None not in fragment.published:
+        publish_text(session, TextFragment(datetime.now(), transcribed_text, session_id=session.session_id,
+                                           fragment_id=fragment.fragment_id, requested=requested is None))
+        fragment.published.add(None)
+
+    stream = session if fragment.payload.get("stream_tokens", STREAM_TOKENS) else None
+    languages = sorted((session.languages() | ({requested} if requested else set())) - fragment.published)
+    translated = await asyncio.gather(*(
+        translate_variant(fragment, session, transcribed_text, language, language == requested, stream)
+        for language in languages
+    ), return_exceptions=True)
+    errors = [result for result in translated if isinstance(result, BaseException)]
+    if errors:
+        raise errors[0]  # A retry only translates the languages still missing
+    return translated
+
+
+async def translate_variant(fragment, session, text, language, requested, stream):
+    with tracing.span("translate", language=language, bytes=len(text.encode())):
+        translated_text, stream_id = await translate_cached(text, SOURCE_LANGUAGE, language, stream, requested)
+    text_fragment = TextFragment(datetime.now(), translated_text, session_id=session.session_id, stream_id=stream_id,
+                                 fragment_id=fragment.fragment_id, language=language, requested=requested)
+    publish_text(session, text_fragment)
+    fragment.published.add(language)
+    return text_fragment
 
 
-# Processes text fragments and calls the agent periodically.
-async def run_agent_call_periodically(interval: int = 10):
-    print("Running agent_call periodically")
+def publish_text(session, text_fragment):
+    session.text_fragments.append(text_fragment)
+    session.touch()
+    log.debug("after append text_fragments: %s %d", session.session_id, len(session.text_fragments))
+
+
+# Has the agent diarize the source transcript; its response goes to the modelresp subscribers
+async def agent_node(fragment, session, results):
+    transcribed_text = results["transcribe"]
+    if transcribed_text is None:
+        return None
+    await agentCall_async(transcribed_text, session.session_id, STREAM_TOKENS, fragment.fragment_id)
+    return True
+
+
+FRAGMENT_PIPELINE = dag.Graph(
+    dag.Node("transcribe", transcribe_node, retries=PIPELINE_RETRIES),
+    dag.Node("translate", translate_node, after=("transcribe",), ordered=True, retries=PIPELINE_RETRIES),
+    dag.Node("agent", agent_node, after=("transcribe",), ordered=True, limit=AGENT_CONCURRENCY, retries=PIPELINE_RETRIES),
+)
+
+
+# Consumes voice fragments as soon as they are enqueued and runs each through the pipeline
+async def fragment_worker(name):
+    stage = metrics.get_stage("fragment")
     while True:
-        if text_fragments:
-            fragment = text_fragments.pop(0)
-            await agentCall_async(fragment.translation_output)  # Call the imported function
-        await asyncio.sleep(interval)
+        fragment = await voice_queue.get()
+        with tracing.trace(fragment.fragment_id):
+            await process_fragment(name, stage, fragment)
+
+
+# One fragment through the pipeline, inside the fragment's trace. The "fragment" span carries
+# its critical path (GraphRun.summary); the journal record goes once every node is through.
+async def process_fragment(name, stage, fragment):
+    started = time.monotonic()
+    run = None
+    session = session_manager.get(fragment.session_id)
+    try:
+        with tracing.span("fragment", wait=started - fragment.enqueued_at) as attributes:
+            if session is None:
+                log.warning("%s: session %s is gone, dropping fragment", name, fragment.session_id)
+            else:
+                run = await FRAGMENT_PIPELINE.run(fragment, session, key=session.session_id)
+                attributes.update(run.summary())
+    finally:
+        voice_queue.task_done()
+        if session is not None:
+            session.pending_count -= 1
+            session.pending.release()
+        stage.record(started - fragment.enqueued_at, time.monotonic() - started, run is not None and not run.errors)
+
+    if run is not None and run.errors:
+        journal.fail(fragment.journal_id, "; ".join(f"{node}: {error}" for node, error in run.errors.items()))
+    else:
+        journal.ack(fragment.journal_id)  # Done, or skipped (silence, gone session)
+
+
+# Puts the records a previous run left in the journal back on the voice queue, oldest first.
+# Run once the workers are up, since the queue is bounded.
+async def replay_journal():
+    records = await run_io(journal.pending)
+    if not records:
+        return
+    log.info("journal: replaying %d records", len(records))
+    for record in records:
+        try:
+            session = session_manager.get_or_create(record["session"])
+        except SessionLimitError as e:
+            log.warning("journal: can't replay %s: %s", record["fragment_id"], e)
+            continue
+        payload = record["record"]
+        if record["samples"] is not None:
+            payload["samples"] = record["samples"]
+        fragment = VoiceFragment(datetime.now(), payload, record["fragment_id"])
+        fragment.journal_id = record["id"]
+        await session.pending.acquire()  # Released by the fragment worker, as for live fragments
+        session.pending_count += 1
+        await voice_queue.put(fragment)
+
 
+# Runs the pipeline with a configurable number of fragments in flight
+async def run_fragment_workers(workers: int = FRAGMENT_WORKERS):
+    log.info("Starting %d fragment workers", workers)
+    metrics.register_queue("voice", voice_queue)
+    await asyncio.gather(*(fragment_worker(f"fragment-{i}") for i in range(workers)))
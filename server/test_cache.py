@@ -0,0 +1,110 @@
+# Cache hits never reach the backends: resent audio and repeated phrases are transcribed and
+# translated once (the check bench_cache.py reports, as an assertion), and the disk level stays
+# within its limit. Transcription and translation are counting stand-ins.
+#
+# Usage: python -m pytest -q test_cache.py
+import asyncio
+import os
+import numpy as np
+import pytest
+
+os.environ.setdefault("JOURNAL_PATH", "")
+os.environ.setdefault("CACHE_PATH", "")
+import tasks
+from cache import TwoLevelCache
+from translation_batcher import TranslationBatcher
+
+
+class Backend:
+    """Stand-in for Whisper/GPT-4 that counts calls."""
+    def __init__(self, fn):
+        self.fn = fn
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.fn(*args)
+
+
+@pytest.fixture
+def backends(monkeypatch, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    monkeypatch.setattr(tasks, "transcription_cache", TwoLevelCache("transcriptions", path=path))
+    monkeypatch.setattr(tasks, "translation_cache", TwoLevelCache("translations", path=path))
+    transcriber = Backend(lambda audio, rate: f"phrase {round(audio[0] * 32768)}" if audio[0] else "")
+    translator = Backend(lambda text, src, dst: f"[es] {text}")
+    monkeypatch.setattr(tasks, "transcribe_cloud_from_memory", transcriber)
+    monkeypatch.setattr(tasks, "translation_batcher", TranslationBatcher(translator, window=0))
+    return path, transcriber, translator
+
+
+def fragment(marker):
+    return np.full(16000, marker / 32768, dtype=np.float32)  # As normalised by the voice socket
+
+
+async def replay(markers):
+    for marker in markers:
+        text = await tasks.transcribe_cached(fragment(marker), "c")
+        if text:
+            await tasks.translate_cached(text, "English", "Spanish")
+
+
+def test_repeats_skip_the_backends(backends):
+    path, transcriber, translator = backends
+    asyncio.run(replay([1, 2, 1, 3, 2, 1]))
+    assert transcriber.calls == 3
+    assert translator.calls == 3
+    # A restart keeps the disk level
+    tasks.transcription_cache = TwoLevelCache("transcriptions", path=path)
+    tasks.translation_cache = TwoLevelCache("translations", path=path)
+    asyncio.run(replay([1, 2, 3]))
+    assert transcriber.calls == 3
+    assert translator.calls == 3
+    assert tasks.transcription_cache.disk_hits == 3
+
+
+def test_phrases_are_matched_after_normalising(backends):
+    _, _, translator = backends
+
+    async def translate(*texts):
+        return [(await tasks.translate_cached(text, "English", "Spanish"))[0] for text in texts]
+
+    translated = asyncio.run(translate("Do you have  any allergies?", "do you have any ALLERGIES? "))
+    assert translated[0] == translated[1]
+    assert translator.calls == 1
+
+
+def test_empty_transcripts_are_not_cached(backends):
+    _, transcriber, _ = backends
+    asyncio.run(replay([0, 0]))
+    assert transcriber.calls == 2
+
+
+def test_failed_transcriptions_are_not_cached(backends, monkeypatch):
+    _, transcriber, _ = backends
+
+    def fail(audio, rate):
+        raise RuntimeError("backend down")
+
+    monkeypatch.setattr(tasks, "transcribe_cloud_from_memory", fail)
+    with pytest.raises(RuntimeError):
+        asyncio.run(tasks.transcribe_cached(fragment(1), "c"))
+    monkeypatch.setattr(tasks, "transcribe_cloud_from_memory", transcriber)
+    asyncio.run(replay([1]))
+    assert transcriber.calls == 1
+
+
+def test_disk_level_keeps_the_most_recently_used(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = TwoLevelCache("entries", path=path, memory_entries=1, disk_entries=3)
+    for key in "abc":
+        cache.put(key, key.upper())
+    cache.put("a", "A")  # Replacing an entry doesn't grow the table
+    assert cache.get("b") == "B"
+    cache.put("d", "D")  # Over the limit: "c" was used least recently
+    cache = TwoLevelCache("entries", path=path, memory_entries=1, disk_entries=3)
+    assert cache.get("c") is None
+    assert [cache.get(key) for key in "abd"] == ["A", "B", "D"]
+    assert cache.evicted == 0
+    cache.put("e", "E")
+    assert cache.evicted == 1
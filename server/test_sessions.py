@@ -0,0 +1,130 @@
+# Sessions stay isolated under load: concurrent sessions streaming through the voice and
+# transcribed apps each receive exactly their own transcripts (the check bench_sessions.py
+# reports, as an assertion), and a stream that switches sessions leaves its tail on the session
+# it was streamed for. Transcription and the agent are stand-ins.
+#
+# Usage: python -m pytest -q test_sessions.py
+import asyncio
+import json
+import os
+import uuid
+import numpy as np
+import pytest
+import websockets
+
+os.environ.setdefault("JOURNAL_PATH", "")
+os.environ.setdefault("CACHE_PATH", "")
+from uvicorn.config import Config
+from uvicorn.server import Server
+import tasks
+from voice import voiceapp
+from transcribed import transcribeapp
+
+SAMPLE_RATE = 16000
+SESSIONS = 12
+FRAGMENTS = 3
+
+
+def transcribe(audio, rate):
+    # The server hands over 16 kHz float32; the markers were sent as int16
+    return f"s{round(audio[0] * 32768)}-f{round(audio[1] * 32768)}"
+
+
+async def agent_call(text, session_id=None, stream=False, fragment_id=None):
+    pass
+
+
+async def run_session(index, voice_port, transcribed_port):
+    """Streams FRAGMENTS marked fragments; returns (expected, received) transcripts for the session."""
+    session_id = uuid.uuid4().hex
+    expected = {f"s{index}-f{fragment}" for fragment in range(FRAGMENTS)}
+    received = []
+    async with websockets.connect(f"ws://127.0.0.1:{transcribed_port}/ws?session={session_id}") as transcript, \
+            websockets.connect(f"ws://127.0.0.1:{voice_port}/ws?session={session_id}") as voice:
+        await voice.recv()  # {"status": "connected"}
+        await voice.send(json.dumps({"action": "start_stream", "mode": "c", "sample_rate": SAMPLE_RATE, "duration": 1}))
+        for fragment in range(FRAGMENTS):
+            pcm = np.zeros(SAMPLE_RATE, dtype=np.int16)
+            pcm[0], pcm[1] = index, fragment
+            await voice.send(pcm.tobytes())
+        while len(received) < FRAGMENTS:
+            payload = json.loads(await asyncio.wait_for(transcript.recv(), timeout=30))
+            received.append((payload.get("session"), payload["translation_output"]))
+    return session_id, expected, received
+
+
+async def serve(client):
+    """Runs the voice and transcribed apps and the fragment workers around `client(voice_port, transcribed_port)`."""
+    servers = [
+        Server(Config(voiceapp, host="127.0.0.1", port=0, log_level="warning")),
+        Server(Config(transcribeapp, host="127.0.0.1", port=0, log_level="warning")),
+    ]
+    background = [asyncio.create_task(server.serve()) for server in servers]
+    background.append(asyncio.create_task(tasks.run_fragment_workers(4)))
+    try:
+        while not all(server.started for server in servers):
+            await asyncio.sleep(0.05)
+        return await client(*(server.servers[0].sockets[0].getsockname()[1] for server in servers))
+    finally:
+        for server in servers:
+            server.should_exit = server.force_exit = True
+        await asyncio.wait(background[:len(servers)], timeout=5)
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+
+async def run_sessions(voice_port, transcribed_port):
+    return await asyncio.gather(*(run_session(i, voice_port, transcribed_port) for i in range(SESSIONS)))
+
+
+async def switch_mid_stream(voice_port, transcribed_port):
+    """Streams half a fragment on one session, then restarts the stream on another; returns what each saw."""
+    first, second = uuid.uuid4().hex, uuid.uuid4().hex
+    async with websockets.connect(f"ws://127.0.0.1:{transcribed_port}/ws?session={first}") as transcript, \
+            websockets.connect(f"ws://127.0.0.1:{voice_port}/ws?session={first}") as voice:
+        await voice.recv()  # {"status": "connected"}
+        await voice.send(json.dumps({"action": "start_stream", "mode": "c"}))
+        missing_rate = json.loads(await voice.recv())
+        await voice.send(json.dumps({"action": "start_stream", "mode": "c", "sample_rate": SAMPLE_RATE, "duration": 1}))
+        await voice.recv()  # {"status": "stream_started"}
+        pcm = np.zeros(SAMPLE_RATE // 2, dtype=np.int16)
+        pcm[0], pcm[1] = 7, 0
+        await voice.send(pcm.tobytes())
+        await voice.send(json.dumps({"action": "start_stream", "session": second, "mode": "c", "sample_rate": SAMPLE_RATE}))
+        started = json.loads(await voice.recv())
+        payload = json.loads(await asyncio.wait_for(transcript.recv(), timeout=30))
+    return missing_rate, started, (first, second), payload
+
+
+@pytest.fixture(scope="module")
+def loop():
+    """One loop for the module, as in the app: the session manager's wakeup events bind to the first loop that waits on them."""
+    loop = asyncio.new_event_loop()
+    yield loop
+    # What asyncio.run does on the way out: cancel what is left (the servers' lifespan tasks) first
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
+
+
+def test_concurrent_sessions_receive_only_their_own_transcripts(monkeypatch, loop):
+    monkeypatch.setattr(tasks, "transcribe_cloud_from_memory", transcribe)
+    monkeypatch.setattr(tasks, "agentCall_async", agent_call)
+    tasks.transcription_cache.clear()  # The markers repeat across runs
+    for session_id, expected, received in loop.run_until_complete(serve(run_sessions)):
+        assert {session for session, _ in received} == {session_id}
+        assert sorted(text for _, text in received) == sorted(expected)
+
+
+def test_restarting_a_stream_keeps_the_tail_on_its_session(monkeypatch, loop):
+    monkeypatch.setattr(tasks, "transcribe_cloud_from_memory", transcribe)
+    monkeypatch.setattr(tasks, "agentCall_async", agent_call)
+    tasks.transcription_cache.clear()
+    missing_rate, started, (first, second), payload = loop.run_until_complete(serve(switch_mid_stream))
+    assert "sample_rate" in missing_rate["error"]
+    assert started == {"status": "stream_started", "session": second}
+    assert (payload.get("session"), payload["translation_output"]) == (first, "s7-f0")
@@ -0,0 +1,195 @@
+# Per-fragment tracing: one trace per voice fragment, from decoding its audio to delivering its
+# transcript and the agent's response on the WebSockets.
+#
+# The trace ID is the fragment ID (objects.VoiceFragment), so a fragment replayed from the journal
+# after a crash keeps its trace. Stages time their work with `span(...)`, or `record(...)` for
+# time measured elsewhere; every span feeds the per-stage histograms behind /metrics (metrics.py),
+# is logged at DEBUG, and with OTEL_EXPORTER_OTLP_ENDPOINT set is exported as OTLP/HTTP JSON.
+# The agent HTTP call carries the trace in a W3C traceparent header, so agent.py's spans (diarize,
+# crew_kickoff) join the same trace.
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+import metrics
+
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")  # e.g. http://localhost:4318; empty disables export
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "voice-pipeline")
+OTLP_BATCH_SIZE = int(os.getenv("OTLP_BATCH_SIZE", "512"))  # Spans per export request
+OTLP_INTERVAL = float(os.getenv("OTLP_INTERVAL", "2"))  # Longest a span waits for its batch to fill (s)
+OTLP_QUEUE_SIZE = int(os.getenv("OTLP_QUEUE_SIZE", "8192"))  # Spans are dropped, not queued, beyond this
+
+log = logging.getLogger(__name__)
+
+# Copied into tasks and (by executors.run_io) into threads, so nested work joins the trace
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span_id = contextvars.ContextVar("span_id", default=None)
+
+
+def current_trace_id() -> str | None:
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id):
+    """Makes `trace_id` the current trace inside the block."""
+    trace_token = _trace_id.set(trace_id)
+    span_token = _span_id.set(None)
+    try:
+        yield
+    finally:
+        _span_id.reset(span_token)
+        _trace_id.reset(trace_token)
+
+
+@contextmanager
+def span(name, wait=None, **attributes):
+    """Times the block as a span of the current trace. `wait` is the time the work sat queued
+    before it; the yielded attributes can be added to, e.g. with the payload size in "bytes"."""
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _span_id.get()
+    token = _span_id.set(span_id)
+    start_ns = time.time_ns()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _span_id.reset(token)
+        _finish(name, time.perf_counter() - started, wait, attributes, _trace_id.get(), span_id, parent_id, start_ns, error)
+
+
+def record(name, duration, wait=None, trace_id=None, **attributes):
+    """Records a span that was timed elsewhere and ended just now."""
+    _finish(name, duration, wait, attributes, trace_id or _trace_id.get(), uuid.uuid4().hex[:16],
+            _span_id.get(), time.time_ns() - int(duration * 1e9), None)
+
+
+def traceparent_header() -> str | None:
+    """The current trace and span as a W3C traceparent header value, for outgoing calls."""
+    trace_id = _trace_id.get()
+    if trace_id is None:
+        return None
+    return f"00-{trace_id}-{_span_id.get() or '0' * 16}-01"
+
+
+@contextmanager
+def continue_trace(traceparent):
+    """Joins the trace of an incoming traceparent header (or none, if it is missing or malformed)."""
+    parts = (traceparent or "").split("-")
+    valid = len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16
+    trace_token = _trace_id.set(parts[1] if valid else None)
+    span_token = _span_id.set(parts[2] if valid and parts[2] != "0" * 16 else None)
+    try:
+        yield
+    finally:
+        _span_id.reset(span_token)
+        _trace_id.reset(trace_token)
+
+
+def _finish(name, duration, wait, attributes, trace_id, span_id, parent_id, start_ns, error):
+    metrics.observe_span(name, duration, wait, attributes.get("bytes"))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("span %s took %.1f ms", name, duration * 1000, extra={
+            "span": name, "duration_ms": round(duration * 1000, 2),
+            "wait_ms": None if wait is None else round(wait * 1000, 2), **attributes,
+        })
+    if exporter is not None and trace_id is not None:
+        exporter.add(_otlp_span(name, duration, wait, attributes, trace_id, span_id, parent_id, start_ns, error))
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(name, duration, wait, attributes, trace_id, span_id, parent_id, start_ns, error):
+    if wait is not None:
+        attributes = {**attributes, "queue_wait_ms": round(wait * 1000, 2)}
+    otlp = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": 1,  # Internal
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int(duration * 1e9)),
+        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None],
+        "status": {"code": 2, "message": error} if error else {"code": 1},
+    }
+    if parent_id:
+        otlp["parentSpanId"] = parent_id
+    return otlp
+
+
+class OtlpExporter:
+    """Batches finished spans and posts them to an OTLP/HTTP collector from a daemon thread."""
+    def __init__(self, endpoint, service_name=OTEL_SERVICE_NAME, batch_size=OTLP_BATCH_SIZE, interval=OTLP_INTERVAL):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval = interval
+        self._spans = queue.Queue(maxsize=OTLP_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+        # Statistics
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def add(self, otlp_span):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._spans.put_nowait(otlp_span)
+        except queue.Full:
+            self.dropped += 1  # A slow collector must not hold up the pipeline
+
+    def stats(self) -> dict:
+        return {"exported": self.exported, "dropped": self.dropped, "failed": self.failed, "queued": self._spans.qsize()}
+
+    def _run(self):
+        while True:
+            batch = [self._spans.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._spans.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._post(batch)
+
+    def _post(self, batch):
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": batch}],
+        }]}
+        request = urllib.request.Request(
+            self.url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+            self.exported += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            log.warning("tracing: exporting %d spans to %s failed: %s", len(batch), self.url, e)
+
+
+exporter = OtlpExporter(OTEL_EXPORTER_OTLP_ENDPOINT) if OTEL_EXPORTER_OTLP_ENDPOINT else None
@@ -1,144 +1,182 @@
 import os
 import io
+import logging
 import openai
-import tempfile
-import datetime
 import numpy as np
 import sounddevice as sd
-import base64
 import wave
 from dotenv import load_dotenv
-from scipy.io.wavfile import write
-from faster_whisper import WhisperModel
-from objects import voice_fragments, text_fragments, VoiceFragment, TextFragment
+from audio import SAMPLE_RATE
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from whisper_models import get_model_pool
 
 
 load_dotenv()
-#openai.api_key = os.getenv("OPENAI_API_KEY")
-openai.api_key = ""
+openai.api_key = os.getenv("OPENAI_API_KEY")  # From .env; OPENAI_BASE_URL is read from there too
 
-# global store for all saved WAVs
-wav_store: dict[str, str] = {}
+WHISPER_SAMPLE_RATE = SAMPLE_RATE  # faster-whisper expects 16 kHz mono float32 when given an array
+
+log = logging.getLogger(__name__)
 
 
 def record_audio(duration=5, samplerate=44100):
-    print("Listening...")
+    log.info("Listening...")
     audio = sd.rec(int(samplerate * duration), samplerate=samplerate, channels=1, dtype='int16')
     sd.wait()
     return audio, samplerate
 
 
-def buffer_wav(audio: bytes, samplerate: int) -> str:
-    """
-    Saves the given audio buffer to a uniquely named .wav file and
-    stores the filename in wav_store keyed by timestamp.
-
-    Returns the timestamp key under which the file was saved.
-    """
-    # generate a timestamp key
-    timestamp = datetime.datetime.now().isoformat()
-
-    # write to a temp .wav file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        write(f.name, samplerate, audio)
-
-    # save in the global dictionary
-    wav_store[timestamp] = f.name
-
-    return timestamp
-
-
-def save_wav(audio_bytes: bytes, samplerate: int) -> str:
-    try:
-        # Convert raw audio bytes to a NumPy array
-        audio = np.frombuffer(audio_bytes, dtype=np.int16)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-            write(f.name, samplerate, audio)
-            print(f"Saved WAV file: {f.name}")
-            return f.name
-    except Exception as e:
-        print(f"Error saving WAV file: {e}")
-        return None
-
-
-def transcribe_cloud(file_path):
-    print("transcribe_cloud")
-    txt = ""
-    try:
-        with open(file_path, "rb") as audio_file:
-            transcript = openai.audio.transcriptions.create(
-                file=audio_file,
-                model="whisper-1"
-            )
-            txt = transcript.text
-    except Exception as e:
-        print(f"Error during transcription: {e}")
-
-    return txt
+def wav_bytes_io(audio: np.ndarray, samplerate: int) -> io.BytesIO:
+    """Wraps int16 PCM (or float32 in [-1, 1]) in an in-memory WAV container for upload."""
+    audio = np.asarray(audio)
+    if audio.dtype.kind == "f":
+        audio = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)  # Mono audio
+        wav_file.setsampwidth(2)  # 2 bytes per sample (int16)
+        wav_file.setframerate(samplerate)
+        wav_file.writeframes(np.asarray(audio, dtype=np.int16).tobytes())
+    wav_buffer.seek(0)  # Reset the buffer position to the beginning
+    wav_buffer.name = "fragment.wav"  # The API infers the format from the file name
+    return wav_buffer
 
 
-def transcribe_local(file_path, model_size="base"):
-    model = WhisperModel(model_size, compute_type="int8")
-    segments, _ = model.transcribe(file_path)
-    return " ".join([segment.text for segment in segments])
+def transcribe_local(audio, model_size="base"):
+    """Transcribes a file path or a 16 kHz float32 array with a resident model."""
+    # Borrow a resident model; segments are lazy so they must be consumed while it is held
+    with get_model_pool(model_size).acquire() as model:
+        segments, _ = model.transcribe(audio)
+        return " ".join([segment.text for segment in segments])
 
 
-
-def transcribe_cloud_from_memory(audio: bytes, samplerate: int) -> str:
+def transcribe_cloud_from_memory(audio: np.ndarray, samplerate: int) -> str:
     """
     Transcribes audio data from memory using the OpenAI Whisper API.
 
     Args:
-        audio (bytes): Raw audio data as bytes.
+        audio (np.ndarray): 16 kHz float32 or int16 PCM samples (raw int16 bytes are also accepted).
         samplerate (int): Sample rate of the audio.
 
     Returns:
         str: Transcribed text from the audio.
-    """
-    print("transcribe_cloud_from_memory")
-    txt = ""
-    try:
-        # Validate and convert audio if necessary
-        if isinstance(audio, bytes):
-            print("transcribe_cloud_from_memory: Converting bytes to NumPy array")
-            audio = np.frombuffer(audio, dtype=np.int16)
-
-        # Create an in-memory WAV file using the wave module
-        wav_buffer = io.BytesIO()
-        with wave.open(wav_buffer, 'wb') as wav_file:
-            wav_file.setnchannels(1)  # Mono audio
-            wav_file.setsampwidth(2)  # 2 bytes per sample (int16)
-            wav_file.setframerate(samplerate)
-            wav_file.writeframes(audio.tobytes())
-        print("transcribe_cloud_from_memory: WAV file written to memory")
-        wav_buffer.seek(0)  # Reset the buffer position to the beginning
-
-        # Send the in-memory file to the OpenAI API
-        print("transcribe_cloud_from_memory: Sending audio to OpenAI API")
-        transcript = openai.audio.transcriptions.create(
-            file=wav_buffer,
-            model="whisper-1"
-        )
-        txt = transcript.get("text", "")
-        print("transcribe_cloud_from_memory: Transcription successful")
-    except Exception as e:
-        print(f"Error during transcription: {e}")
-
-    return txt
-
-
-# Processes the next voice fragment from voice_fragments by saving it as a .wav file.
-def process_next_voice_fragment(fragment: VoiceFragment):
-    print(f"Processing voice fragment with timestamp: {fragment.timestamp}")
-    audio = fragment.payload.get("audio")
-    samplerate = fragment.payload.get("samplerate")
-    if audio is None or samplerate is None:
-        print("Invalid fragment payload: Missing audio or samplerate.")
-        return None
-
-    # Save the audio as a .wav file
-    wav_file_path = save_wav(audio, samplerate)
-    print(f"Saved .wav file: {wav_file_path}")
-
-    return wav_file_path
 
+    Raises whatever the API call raised, so the pipeline retries the fragment (and fails it in
+    the journal once the retries are used up) instead of taking an outage for silence.
+    """
+    log.debug("transcribe_cloud_from_memory")
+    if isinstance(audio, (bytes, bytearray, memoryview)):
+        audio = np.frombuffer(audio, dtype=np.int16)
+
+    transcript = openai.audio.transcriptions.create(
+        file=wav_bytes_io(audio, samplerate),
+        model="whisper-1"
+    )
+    return transcript.text
+
+
+class StreamingTranscriber:
+    """Per-session streaming transcription over a rolling 16 kHz buffer.
+
+    Silero VAD (bundled with faster-whisper) finds utterance boundaries, and silent
+    audio is dropped without ever reaching Whisper. While an utterance is open a
+    partial hypothesis is produced every `partial_interval` seconds of audio; once
+    it is followed by `min_silence_ms` of silence, or grows past `max_utterance`
+    seconds, it is transcribed once more and emitted as final. Each decode is
+    conditioned on the tail of the previous final text.
+    """
+    def __init__(self, model_size="base", max_buffer=30.0, partial_interval=1.5,
+                 min_silence_ms=600, max_utterance=20.0, context_chars=200):
+        self.model_size = model_size
+        self.partial_interval = int(partial_interval * WHISPER_SAMPLE_RATE)
+        self.min_silence = int(min_silence_ms * WHISPER_SAMPLE_RATE / 1000)
+        self.max_utterance = int(max_utterance * WHISPER_SAMPLE_RATE)
+        self.context_chars = context_chars
+        self.vad_options = VadOptions(min_silence_duration_ms=min_silence_ms, speech_pad_ms=200)
+        self._buffer = np.zeros(int(max_buffer * WHISPER_SAMPLE_RATE), dtype=np.float32)
+        self._length = 0
+        self._since_partial = 0
+        self._context = ""
+        # Replay statistics
+        self.samples_in = 0
+        self.samples_skipped = 0
+        self.whisper_calls = 0
+
+    def feed(self, samples: np.ndarray) -> list[dict]:
+        """Appends 16 kHz float32 audio and returns any partial/final hypotheses it produced."""
+        self.samples_in += len(samples)
+        self._append(samples)
+        self._since_partial += len(samples)
+
+        speech = get_speech_timestamps(self._buffer[:self._length], self.vad_options)
+        if not speech:
+            # Keep a short tail so the onset of the next word isn't clipped
+            self._discard(self._length - int(0.3 * WHISPER_SAMPLE_RATE), skipped=True)
+            return []
+        if speech[0]["start"] > 0:
+            self._discard(speech[0]["start"], skipped=True)
+            end = speech[-1]["end"] - speech[0]["start"]
+        else:
+            end = speech[-1]["end"]
+
+        if self._length - end >= self.min_silence or self._length >= self.max_utterance:
+            text = self._transcribe(self._buffer[:end])
+            self._discard(end, skipped=False)
+            self._since_partial = 0
+            if text:
+                self._context = (self._context + " " + text)[-self.context_chars:]
+                return [{"type": "final", "text": text}]
+        elif self._since_partial >= self.partial_interval:
+            self._since_partial = 0
+            text = self._transcribe(self._buffer[:self._length])
+            if text:
+                return [{"type": "partial", "text": text}]
+        return []
+
+    def flush(self) -> list[dict]:
+        """Finalises whatever speech is still buffered at the end of a stream."""
+        if self._length == 0:
+            return []
+        if not get_speech_timestamps(self._buffer[:self._length], self.vad_options):
+            self._discard(self._length, skipped=True)
+            return []
+        text = self._transcribe(self._buffer[:self._length])
+        self._discard(self._length, skipped=False)
+        return [{"type": "final", "text": text}] if text else []
+
+    def stats(self) -> dict:
+        return {
+            "audio_seconds": self.samples_in / WHISPER_SAMPLE_RATE,
+            "skipped_seconds": self.samples_skipped / WHISPER_SAMPLE_RATE,
+            "skipped_fraction": self.samples_skipped / self.samples_in if self.samples_in else 0.0,
+            "whisper_calls": self.whisper_calls,
+        }
+
+    def _transcribe(self, audio: np.ndarray) -> str:
+        self.whisper_calls += 1
+        with get_model_pool(self.model_size).acquire() as model:
+            segments, _ = model.transcribe(
+                audio,
+                vad_filter=True,
+                initial_prompt=self._context or None,
+                condition_on_previous_text=False,
+                without_timestamps=True,
+            )
+            return " ".join(segment.text.strip() for segment in segments).strip()
+
+    def _append(self, samples: np.ndarray):
+        overflow = self._length + len(samples) - len(self._buffer)
+        if overflow > 0:
+            # Only reachable if a single feed is larger than the headroom above max_utterance
+            self._discard(min(overflow, self._length), skipped=True)
+            samples = samples[-len(self._buffer):]
+        self._buffer[self._length:self._length + len(samples)] = samples
+        self._length += len(samples)
+
+    def _discard(self, count: int, skipped: bool):
+        count = max(0, min(count, self._length))
+        if skipped:
+            self.samples_skipped += count
+        remaining = self._length - count
+        self._buffer[:remaining] = self._buffer[count:self._length]
+        self._length = remaining
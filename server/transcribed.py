@@ -1,117 +1,218 @@
 # WebSocket for transcribed
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from websocket_manager import WebSocketConnectionManager
-from objects import text_fragments
+from sessions import session_manager, SessionLimitError, SOURCE_LANGUAGE, language_variant
+from objects import StreamDelta
 import asyncio
+import functools
 import json
+import time
+import logging
+import metrics
+import tracing
 
 transcribeapp = FastAPI()
 transcribemanager = WebSocketConnectionManager()
+metrics.register_connections("transcribed", transcribemanager)
+log = logging.getLogger(__name__)
+
+
+# The transcript variants a subscriber asked for, from ?languages=Spanish,English or a
+# {"action": "set_languages", "languages": [...]} message. None (nothing asked for) means
+# whatever the uploader's translate_to chose.
+def parse_languages(languages) -> set | None:
+    if isinstance(languages, str):
+        languages = languages.split(",")
+    variants = {language_variant(language) for language in languages or () if language.strip()}
+    return variants or None
+
+
+def set_languages(session, websocket, languages):
+    if session.subscriber_languages.get(websocket) == languages:
+        return
+    if languages is None:
+        session.subscriber_languages.pop(websocket, None)
+    else:
+        session.subscriber_languages[websocket] = languages
+    session_manager.publish_languages(session)
+
+
+# Whether a transcript entry goes to a subscriber. Partial hypotheses aren't translated, so
+# they go to everyone.
+def wanted(entry, languages) -> bool:
+    if getattr(entry, "partial", False):
+        return True
+    return entry.requested if languages is None else entry.language in languages
+
+
+# Builds the writer's callback for a subscriber's message: once it has actually been sent, the
+# entry is acknowledged in the session log and, for a complete message, the fragment's trace is
+# closed with a "deliver_transcript" span (the wait is from the entry being logged to its being queued).
+def on_delivered(session_log, websocket, seq, fragment, size):
+    queued = time.monotonic()
+
+    def delivered():
+        session_log.ack(websocket, seq)
+        if not isinstance(fragment, StreamDelta) and fragment.fragment_id:
+            tracing.record("deliver_transcript", time.monotonic() - queued, queued - fragment.enqueued_at,
+                           fragment.fragment_id, bytes=size)
+    return delivered
 
 
 # Handles WebSocket connections for transcribed text.
 @transcribeapp.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    # Subscribers join one consultation with ?session=<id>, as returned by the voice socket
+    session_id = websocket.query_params.get("session")
     await transcribemanager.connect(websocket)
+    if not session_id:
+        transcribemanager.disconnect(websocket)
+        await websocket.close(code=1008, reason="session query parameter is required")
+        return
     try:
+        session = session_manager.get_or_create(session_id)
+    except SessionLimitError as e:
+        transcribemanager.disconnect(websocket)
+        await websocket.close(code=1013, reason=str(e))
+        return
+    session.transcribe_subscribers.add(websocket)
+    set_languages(session, websocket, parse_languages(websocket.query_params.get("languages")))
+    since = websocket.query_params.get("since")  # Last seq a reconnecting client saw
+    session.text_fragments.subscribe(websocket, int(since) if since and since.isdigit() else None)
+    session_manager.text_fragments_wakeup.set()  # Deliver any backlog straight away
+    try:
+        # Subscribers only send to change their languages, so this mostly blocks until the peer closes,
+        # is evicted after a failed send, or stops answering the server's pings (startall.WS_PING_TIMEOUT)
         while True:
-            await asyncio.sleep(1)  # Keep the connection alive
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                request = json.loads(message.get("text") or "")
+            except ValueError:
+                continue
+            if isinstance(request, dict) and request.get("action") == "set_languages":
+                set_languages(session, websocket, parse_languages(request.get("languages")))
     except WebSocketDisconnect:
-        transcribemanager.disconnect(websocket)
-        print("transcribe: client disconnected")
+        log.info("transcribe: client disconnected")
     except Exception as e:
-        print(f"transcribe: Error in websocket_endpoint: {e}")
+        log.error("transcribe: Error in websocket_endpoint: %s", e)
+    finally:
+        transcribemanager.disconnect(websocket)
+        session.transcribe_subscribers.discard(websocket)
+        if session.subscriber_languages.pop(websocket, None) is not None:
+            session_manager.publish_languages(session)
+        session.text_fragments.unsubscribe(websocket)
+        session.touch()
+
 
+# Per-connection queue depth and lag
+@transcribeapp.get("/stats")
+async def connection_stats():
+    return transcribemanager.stats()
 
-# Periodically sends new transcriptions to connected clients
+
+# Sends new transcriptions to each session's subscribers as soon as they are appended.
+# Each subscriber has a cursor into the session log, so a pass only touches unread entries.
 async def send_new_transcriptions():
-    print("enter send_new_transcriptions")
+    log.debug("enter send_new_transcriptions")
+    wakeup = session_manager.text_fragments_wakeup
     try:
         while True:
-            # print("TRUE send_new_transcriptions")
-            for fragment in text_fragments:
-                print("transcribe: for loop")
-                if not fragment.sent:
-                    print("transcribe: preparing to send new fragment")
-                    message = {
-                        "timestamp": fragment.timestamp.isoformat(),
-                        "translation_output": fragment.translation_output,
-                    }
-                    print("transcribe: send_new:", message)
-
-                    # Check if there are active WebSocket connections
-                    if transcribemanager.active_connections:
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=7)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            for session in list(session_manager.sessions.values()):
+                session_log = session.text_fragments
+                if not session_log.has_unread():
+                    continue
+                for websocket in list(session.transcribe_subscribers):
+                    languages = session.subscriber_languages.get(websocket)
+                    skipped = None
+                    for seq, fragment in session_log.read(websocket):
+                        if not wanted(fragment, languages):
+                            session_log.advance(websocket, seq)  # Another subscriber's language
+                            skipped = seq
+                            continue
+                        skipped = None
+                        if isinstance(fragment, StreamDelta):
+                            # Tokens of a translation still streaming in; the complete message follows
+                            message = {
+                                "seq": seq,
+                                "timestamp": fragment.timestamp.isoformat(),
+                                "session": session.session_id,
+                                "type": "delta",
+                                "stream": fragment.stream_id,
+                                "language": fragment.language or SOURCE_LANGUAGE,
+                                "delta": fragment.delta,
+                            }
+                        else:
+                            message = {
+                                "seq": seq,
+                                "timestamp": fragment.timestamp.isoformat(),
+                                "session": session.session_id,
+                                "type": "complete",
+                                "stream": fragment.stream_id,
+                                "language": fragment.language or SOURCE_LANGUAGE,
+                                "translation_output": fragment.translation_output,
+                                "partial": fragment.partial,
+                            }
                         try:
-                            await transcribemanager.broadcast(json.dumps(message))
-                            fragment.sent = True  # Mark as sent only if broadcast succeeds
-                            print("transcribe: broadcast succeeded, fragment marked as sent")
+                            # Queued on the peer's writer, which acknowledges it once sent; a slow peer only delays itself
+                            data = json.dumps(message)
+                            await transcribemanager.send_personal_message(
+                                data, websocket, on_sent=on_delivered(session_log, websocket, seq, fragment, len(data))
+                            )
+                            session_log.advance(websocket, seq)
                         except Exception as e:
-                            print(f"transcribe: Error broadcasting message: {e}")
-                    else:
-                        print("transcribe: No active WebSocket connections, skipping broadcast")
-            await asyncio.sleep(7)
+                            log.warning("transcribe: Error sending message: %s", e)
+                            break
+                    if skipped is not None:
+                        # Entries for other languages are acknowledged behind whatever is still queued for the peer
+                        transcribemanager.when_sent(websocket, functools.partial(session_log.ack, websocket, skipped))
     except Exception as e:
-        print(f"transcribe: Error in send_new_transcriptions: {e}")
+        log.error("transcribe: Error in send_new_transcriptions: %s", e)
         await asyncio.sleep(7)
 
 
-# heartbeat
-async def send_heartbeat():
-    print("transcribe: heartbeat")
-    try:
-        while True:
-            await transcribemanager.broadcast('heartbeat')
-            await asyncio.sleep(8)
-    except Exception as e:
-        print(f"transcribe: heartbeat: Error: {e}")
-        await asyncio.sleep(8)
-
-
 async def monitor_tasks(*tasks):
     """Monitors the given tasks to check if they exit or terminate."""
     while True:
         for task in tasks:
             if task.done():
                 if task.cancelled():
-                    print(f"Task {task.get_name()} was cancelled.")
+                    log.info("Task %s was cancelled.", task.get_name())
                 else:
                     exception = task.exception()
                     if exception:
-                        print(f"Task {task.get_name()} exited with exception: {exception}")
+                        log.error("Task %s exited with exception: %s", task.get_name(), exception)
                     else:
-                        print(f"Task {task.get_name()} completed successfully.")
+                        log.info("Task %s completed successfully.", task.get_name())
                 # Optionally restart the task if needed
                 if task.get_coro().__name__ == "send_new_transcriptions":
-                    print("Restarting send_new_transcriptions task...")
+                    log.warning("Restarting send_new_transcriptions task...")
                     tasks = list(tasks)  # Convert tuple to list to modify
                     tasks.remove(task)
                     new_task = asyncio.create_task(send_new_transcriptions())
                     tasks.append(new_task)
-                elif task.get_coro().__name__ == "send_heartbeat":
-                    print("Restarting send_heartbeat task...")
-                    tasks = list(tasks)  # Convert tuple to list to modify
-                    tasks.remove(task)
-                    new_task = asyncio.create_task(send_heartbeat())
-                    tasks.append(new_task)
         await asyncio.sleep(5)
 
 
 async def startup_event():
-    print("transcribe: startup")
+    log.info("transcribe: startup")
     try:
         # Create the tasks
         send_new_transcriptions_task = asyncio.create_task(send_new_transcriptions())
-        print(f"send_new_transcriptions task created: {send_new_transcriptions_task}")
-
-        send_heartbeat_task = asyncio.create_task(send_heartbeat())
-        print(f"send_heartbeat task created: {send_heartbeat_task}")
+        log.debug("send_new_transcriptions task created: %s", send_new_transcriptions_task)
 
         # Monitor the tasks
-        asyncio.create_task(monitor_tasks(send_new_transcriptions_task, send_heartbeat_task))
+        asyncio.create_task(monitor_tasks(send_new_transcriptions_task))
 
-        print("transcribe: after send_new_transcriptions and send_heartbeat")
+        log.debug("transcribe: after send_new_transcriptions")
     except Exception as e:
-        print(f"transcribe: startup_event: Error: {e}")
+        log.error("transcribe: startup_event: Error: %s", e)
         await asyncio.sleep(1)
 
 
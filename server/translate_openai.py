@@ -1,16 +1,63 @@
+import re
 import openai
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
-#TODO - should come from .env file
-openai.api_key = ""
+openai.api_key = os.getenv("OPENAI_API_KEY")  # From .env; OPENAI_BASE_URL is read from there too
 
-def translate_text(text, input_lang="English", output_lang="Spanish"):
+def _translate_messages(text, input_lang, output_lang):
     prompt = (
         f"Translate the following text from {input_lang} to {output_lang}:\n\n"
         f"{text}\n\nOnly return the translated text."
     )
+    return [
+        {"role": "system", "content": "You are a professional translator with medical context awareness."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def translate_text(text, input_lang="English", output_lang="Spanish"):
+    response = openai.chat.completions.create(
+        model="gpt-4",
+        messages=_translate_messages(text, input_lang, output_lang),
+        temperature=0.3
+    )
+
+    return response.choices[0].message.content.strip()
+
+
+_async_client = None
+
+
+async def translate_text_stream(text, input_lang="English", output_lang="Spanish"):
+    """Yields the translation token by token as the completion streams in."""
+    global _async_client
+    if _async_client is None:
+        _async_client = openai.AsyncOpenAI(api_key=openai.api_key or None, base_url=openai.base_url)
+    stream = await _async_client.chat.completions.create(
+        model="gpt-4",
+        messages=_translate_messages(text, input_lang, output_lang),
+        temperature=0.3,
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+_SEGMENT = re.compile(r"<s(\d+)>(.*?)</s\1>", re.DOTALL)
+
+
+def translate_batch(texts, input_lang="English", output_lang="Spanish"):
+    """Translates several texts in one request. Raises ValueError if the reply can't be split back out."""
+    segments = "\n".join(f"<s{i}>{text}</s{i}>" for i, text in enumerate(texts, 1))
+    prompt = (
+        f"Translate each of the following segments from {input_lang} to {output_lang}. "
+        "Keep every segment inside its own tags, translate each one on its own, and return "
+        "only the tagged segments in the same order:\n\n"
+        f"{segments}"
+    )
 
     response = openai.chat.completions.create(
         model="gpt-4",
@@ -21,4 +68,7 @@ def translate_text(text, input_lang="English", output_lang="Spanish"):
         temperature=0.3
     )
 
-    return response.choices[0].message.content.strip()
+    translated = {int(i): text.strip() for i, text in _SEGMENT.findall(response.choices[0].message.content)}
+    if sorted(translated) != list(range(1, len(texts) + 1)):
+        raise ValueError(f"Expected {len(texts)} segments, got {sorted(translated)}")
+    return [translated[i] for i in range(1, len(texts) + 1)]
@@ -0,0 +1,125 @@
+# Micro-batches translation requests, so a backlog of fragments costs one round trip per batch.
+import os
+import asyncio
+import logging
+import openai
+from executors import run_io
+from translate_openai import translate_text, translate_batch
+
+TRANSLATE_BATCH_WINDOW = float(os.getenv("TRANSLATE_BATCH_WINDOW", "0.05"))  # Seconds to wait for more fragments
+TRANSLATE_BATCH_SIZE = int(os.getenv("TRANSLATE_BATCH_SIZE", "8"))  # Fragments per request
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "4"))  # Requests in flight
+TRANSLATE_RETRIES = int(os.getenv("TRANSLATE_RETRIES", "3"))  # Attempts after a rate-limit error
+
+log = logging.getLogger(__name__)
+
+# Errors that one request per text would only hit again, and N times over: these fail the whole batch
+NO_FALLBACK = (openai.RateLimitError, openai.APITimeoutError)
+
+
+class TranslationBatcher:
+    """Collects translation requests per language pair and sends them in batches.
+
+    A batch is sent when it reaches `max_batch` texts or `window` seconds after its first
+    text arrived. If the batched request fails (say its reply can't be split back into
+    segments), each text is translated on its own, unless it failed on the rate limit or a
+    timeout. At most `concurrency` requests run at once, fallback requests included, and a
+    request that hits the rate limit backs off and is retried while holding its slot.
+    """
+    def __init__(self, translate_one=translate_text, translate_many=translate_batch,
+                 window=TRANSLATE_BATCH_WINDOW, max_batch=TRANSLATE_BATCH_SIZE,
+                 concurrency=TRANSLATE_CONCURRENCY, retries=TRANSLATE_RETRIES):
+        self.translate_one = translate_one
+        self.translate_many = translate_many
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.retries = retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: dict[tuple[str, str], list] = {}  # (input_lang, output_lang) -> [(text, future)]
+        self._timers: dict[tuple[str, str], asyncio.TimerHandle] = {}
+        self._in_flight = set()  # Keeps running batch tasks referenced
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+        self.rate_limited = 0
+
+    async def translate(self, text, input_lang="English", output_lang="Spanish"):
+        key = (input_lang, output_lang)
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((text, future))
+        if len(batch) >= self.max_batch or self.window <= 0:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        return await future
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+            "rate_limited": self.rate_limited,
+        }
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            task = asyncio.create_task(self._send(key, batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, key, batch):
+        input_lang, output_lang = key
+        texts = [text for text, _ in batch]
+        fallback = False
+        async with self._semaphore:
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                if len(texts) == 1:
+                    results = [await self._call(self.translate_one, texts[0], input_lang, output_lang)]
+                else:
+                    results = await self._call(self.translate_many, texts, input_lang, output_lang)
+            except Exception as e:
+                results = [e] * len(texts)
+                fallback = len(texts) > 1 and not isinstance(e, NO_FALLBACK)
+                if fallback:
+                    log.warning("translation_batcher: batch of %d failed (%s), translating one by one", len(texts), e)
+                    self.fallbacks += 1
+        if fallback:
+            # Outside the batch's slot: each text takes its own, like any other request
+            results = await asyncio.gather(*(
+                self._send_one(text, input_lang, output_lang) for text in texts
+            ), return_exceptions=True)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _send_one(self, text, input_lang, output_lang):
+        async with self._semaphore:
+            return await self._call(self.translate_one, text, input_lang, output_lang)
+
+    async def _call(self, fn, *args):
+        delay = 1.0
+        for attempt in range(self.retries + 1):
+            try:
+                return await run_io(fn, *args)
+            except openai.RateLimitError as e:
+                if attempt == self.retries:
+                    raise
+                self.rate_limited += 1
+                retry_after = e.response.headers.get("retry-after", "") if e.response is not None else ""
+                await asyncio.sleep(float(retry_after) if retry_after.replace(".", "", 1).isdigit() else delay)
+                delay *= 2
+
+
+translation_batcher = TranslationBatcher()
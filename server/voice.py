@@ -1,35 +1,215 @@
 # WebSocket server for handling voice-related actions.
 import json
-import asyncio
+import time
+import uuid
+import logging
+import numpy as np
 from datetime import datetime
-from objects import voice_fragments, VoiceFragment
+import metrics
+import affinity
+import tracing
+from audio import AudioStreamBuffer, ENCODINGS
+from objects import voice_queue, VoiceFragment
+from journal import journal
+from recording import open_recorder
+from sessions import session_manager, SessionLimitError
 from websocket_manager import WebSocketConnectionManager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 
 voiceapp = FastAPI()
 voicemanager = WebSocketConnectionManager()
+metrics.register_connections("voice", voicemanager)
+log = logging.getLogger(__name__)
 
 
-# Handles WebSocket connections for voice actions."""
+# Enqueues a fragment for a session; waits while the session or the pipeline is saturated so
+# the socket stops reading and the client feels the backpressure. The fragment is journaled
+# before it is queued, so once this returns it survives a crash (see journal.py).
+# The fragment's trace starts here; `decoded` is the (seconds, bytes) spent decoding its audio.
+async def enqueue_fragment(session, payload, decoded=None):
+    fragment_id = uuid.uuid4().hex
+    with tracing.trace(fragment_id):
+        if decoded is not None:
+            tracing.record("decode", decoded[0], bytes=decoded[1], encoding=payload.get("encoding"))
+        log.debug("voice_queue: %d session pending: %s %d", voice_queue.qsize(), session.session_id, session.pending_count)
+        with tracing.span("intake", mode=payload.get("mode")):
+            await session.pending.acquire()  # Released by the fragment worker once the fragment is done
+            session.pending_count += 1
+            session.touch()
+            try:
+                fragment = VoiceFragment(datetime.now(), {**payload, "session": session.session_id}, fragment_id)
+                record = {key: value for key, value in fragment.payload.items() if key != "samples"}
+                with tracing.span("journal"):
+                    fragment.journal_id = await journal.append(
+                        "voice", session.session_id, record, payload.get("samples"), fragment.fragment_id
+                    )
+                await voice_queue.put(fragment)
+            except BaseException:
+                session.pending_count -= 1
+                session.pending.release()
+                raise
+
+
+# Flushes the tail of a binary stream. Streaming mode always gets a final marker so the
+# session's transcriber can finalise and release its state.
+async def finish_stream(session, stream_header, stream_buffer, decoded):
+    samples = stream_buffer.flush()
+    if samples is None and stream_header["mode"] == "s":
+        samples = np.zeros(0, dtype=np.float32)
+    if samples is not None:
+        await enqueue_fragment(session, {**stream_header, "samples": samples, "final": True}, decoded)
+
+
+# Sends a client whose session is owned by another worker to that worker's own port.
+# Fragments of a session have to be processed where its transcriber and agent state live.
+async def redirect_to_owner(websocket, session_id):
+    voicemanager.disconnect(websocket)
+    await websocket.send_text(json.dumps(
+        {"status": "redirect", "session": session_id, "port": affinity.owner_port(session_id)}
+    ))
+    await websocket.close(code=affinity.REDIRECT_CLOSE_CODE, reason="session is owned by another worker")
+
+
+# Handles WebSocket connections for voice actions.
+#
+# The session is negotiated on connect: clients pass ?session=<id> (or start_stream's "session")
+# to join a consultation, otherwise a new ID is assigned and sent back as {"session": ...}.
+# With several workers, a session owned by another worker gets {"status": "redirect", "port": ...}.
+# Two protocols share the endpoint:
+#   * binary: a {"action": "start_stream", mode, translate_to, sample_rate, encoding, session, stream_tokens}
+#     text frame, then binary audio frames, optionally ended by {"action": "end_stream"}. Frames are
+#     raw int16 PCM at sample_rate ("pcm_s16le", the default), one Opus packet each ("opus"), or
+#     MediaRecorder's audio/webm;codecs=opus chunks as they come ("webm"). They are decoded and
+#     resampled to 16 kHz float32 here, once, as they arrive.
+#     Mode "s" streams short chunks through per-session VAD and incremental transcription.
+#   * JSON (compatibility): {"action": "transcribe_translate", ..., "audio": <base64 WAV>} per chunk
 @voiceapp.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    print("voice:enter")
+    log.debug("voice:enter")
     try:
         await voicemanager.connect(websocket)
     except Exception as e:
-        print(f"Error in voicemanager.connect: {e}")
+        log.error("Error in voicemanager.connect: %s", e)
         return
+    requested = websocket.query_params.get("session")
+    if requested and not affinity.is_local(requested):
+        await redirect_to_owner(websocket, requested)
+        return
+    try:
+        session = session_manager.get_or_create(requested)
+    except SessionLimitError as e:
+        voicemanager.disconnect(websocket)
+        await websocket.close(code=1013, reason=str(e))  # Try again later
+        return
+    session.voice_connections += 1
+    await voicemanager.send_personal_message(
+        json.dumps({"status": "connected", "session": session.session_id}), websocket
+    )
+    stream_header = None
+    stream_buffer = None
+    decoded = [0.0, 0]  # Seconds and bytes decoded since the last fragment, for its "decode" span
+    recorder = open_recorder(session.session_id)  # With VOICE_RECORD_DIR set, for bench_replay.py
     try:
         while True:
-            data = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if recorder is not None:
+                recorder.record(message.get("text"), message.get("bytes"))
+
+            data = message.get("bytes")
+            if data is not None:
+                if stream_buffer is None:
+                    await voicemanager.send_personal_message(
+                        json.dumps({"error": "Send start_stream before audio frames"}), websocket
+                    )
+                    continue
+                started = time.perf_counter()
+                try:
+                    completed = stream_buffer.write(data)
+                except ValueError as e:
+                    # Audio that doesn't parse won't start parsing later: keep what decoded, end the stream
+                    log.warning("voice: ending %s stream: %s", stream_header["encoding"], e)
+                    await finish_stream(session, stream_header, stream_buffer, tuple(decoded))
+                    stream_header = stream_buffer = None
+                    await voicemanager.send_personal_message(
+                        json.dumps({"status": "stream_ended", "error": f"Undecodable audio: {e}"}), websocket
+                    )
+                    continue
+                decoded[0] += time.perf_counter() - started
+                decoded[1] += len(data)
+                for samples in completed:
+                    await enqueue_fragment(session, {**stream_header, "samples": samples}, tuple(decoded))
+                    decoded = [0.0, 0]
+                continue
+
             try:
-                payload = json.loads(data)
+                payload = json.loads(message.get("text") or "")
                 action = payload.get("action")
 
-                if action == "transcribe_translate":
-                    # Add payload to voice_fragments
-                    print("voice_fragments:", len(voice_fragments))
-                    voice_fragments.append(VoiceFragment(datetime.now(), payload))
+                if action == "start_stream":
+                    requested = payload.get("session")
+                    if requested and not affinity.is_local(requested):
+                        await redirect_to_owner(websocket, requested)
+                        return
+                    mode = payload.get("mode", "c").lower()
+                    encoding = payload.get("encoding", "pcm_s16le")
+                    if encoding not in ENCODINGS:
+                        await voicemanager.send_personal_message(
+                            json.dumps({"error": f"Unsupported encoding, expected one of {list(ENCODINGS)}"}), websocket
+                        )
+                        continue
+                    sample_rate = 48000  # Opus is 48 kHz
+                    if encoding == "pcm_s16le":
+                        try:
+                            sample_rate = int(payload["sample_rate"])
+                        except (KeyError, TypeError, ValueError):
+                            sample_rate = 0
+                        if sample_rate <= 0:
+                            await voicemanager.send_personal_message(
+                                json.dumps({"error": "pcm_s16le streams need a positive integer sample_rate"}), websocket
+                            )
+                            continue
+                    switched = session
+                    if requested and requested != session.session_id:
+                        try:
+                            switched = session_manager.get_or_create(requested)
+                        except SessionLimitError as e:
+                            # Stay on the current session, whose count still includes this socket
+                            await voicemanager.send_personal_message(json.dumps({"error": str(e)}), websocket)
+                            continue
+                    if stream_buffer is not None:
+                        # The new stream replaces a running one: keep its tail, on the session it was streamed for
+                        await finish_stream(session, stream_header, stream_buffer, tuple(decoded))
+                        stream_header = stream_buffer = None
+                    if switched is not session:
+                        session.voice_connections -= 1
+                        session = switched
+                        session.voice_connections += 1
+                    stream_header = {
+                        "mode": mode,
+                        "translate_to": payload.get("translate_to"),
+                        "sample_rate": sample_rate,
+                        "encoding": encoding,
+                        # Streaming mode wants short chunks; VAD decides where utterances end
+                        "duration": payload.get("duration", 1 if mode == "s" else 5),
+                    }
+                    if "stream_tokens" in payload:
+                        stream_header["stream_tokens"] = bool(payload["stream_tokens"])
+                    stream_buffer = AudioStreamBuffer(stream_header["sample_rate"], stream_header["duration"], encoding)
+                    decoded = [0.0, 0]
+                    await voicemanager.send_personal_message(
+                        json.dumps({"status": "stream_started", "session": session.session_id}), websocket
+                    )
+                elif action == "end_stream":
+                    if stream_buffer is not None:
+                        await finish_stream(session, stream_header, stream_buffer, tuple(decoded))
+                        stream_header = stream_buffer = None
+                    await voicemanager.send_personal_message(
+                        json.dumps({"status": "stream_ended"}), websocket
+                    )
+                elif action == "transcribe_translate":
+                    await enqueue_fragment(session, payload)
                     await voicemanager.send_personal_message(
                         json.dumps({"status": "payload_added"}), websocket
                     )
@@ -42,34 +222,31 @@ async def websocket_endpoint(websocket: WebSocket):
                     json.dumps({"error": "Invalid JSON format"}), websocket
                 )
             except Exception as e:
-                print(f"WebSocket error: {e}")
+                log.error("WebSocket error: %s", e)
                 await voicemanager.send_personal_message(
                     json.dumps({"error": f"Server error: {e}"}), websocket
                 )
     except WebSocketDisconnect:
-        voicemanager.disconnect(websocket)
-        print(f"voice:Client disconnected")
+        log.info("voice: client disconnected")
+        # Don't lose the tail of a stream that ended without end_stream
+        if stream_buffer is not None:
+            await finish_stream(session, stream_header, stream_buffer, tuple(decoded))
     except Exception as e:
-        print(f"Unexpected error in websocket_endpoint: {e}")
-
-
-# heartbeat
-async def send_heartbeat():
-    #print("voice: heartbeat")
-    try:
-        while True:
-            #print("voice: Heartbeat")
-            await voicemanager.broadcast("heartbeat")
-            await asyncio.sleep(8)
-    except Exception as e:
-        print(f"voice: heartbeat: Error: {e}")
-        await asyncio.sleep(1)
-
-
-async def startup_event():
-    print("voice: startup")
-    loop = asyncio.get_event_loop()
-    loop.create_task(send_heartbeat())
+        log.exception("Unexpected error in websocket_endpoint: %s", e)
+        try:
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        # However the socket ended, it stops counting as a connection and leaves the manager
+        voicemanager.disconnect(websocket)
+        session.voice_connections -= 1
+        session.touch()
+        if recorder is not None:
+            recorder.close()
 
 
-voiceapp.add_event_handler("startup", startup_event)
+# Queue depth and per-stage dwell time for the pipeline, plus voice connection stats
+@voiceapp.get("/stats")
+async def pipeline_metrics():
+    return {**metrics.snapshot(), "connections": voicemanager.stats()}
@@ -1,26 +1,149 @@
 # Manages WebSocket connections and defines data models.
 
+import os
+import time
+import logging
+import asyncio
+from collections import deque
 from fastapi import WebSocket
 
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))  # Seconds before a stuck peer is evicted
+OUTBOUND_QUEUE_SIZE = int(os.getenv("WS_OUTBOUND_QUEUE_SIZE", "64"))  # Messages buffered per peer
+
+log = logging.getLogger(__name__)
+
+
+class _Connection:
+    """Outbound queue, writer task and counters for one WebSocket."""
+    def __init__(self, websocket: WebSocket, maxsize: int):
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.queue = deque()  # (enqueued_at, coalesce_key, message, on_sent)
+        self.pending_keys = set()
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+        self.writer = None
+
+    def lag(self):
+        return time.monotonic() - self.queue[0][0] if self.queue else 0.0
+
+
 class WebSocketConnectionManager:
-    """Manages active WebSocket connections."""
-    def __init__(self):
+    """Manages active WebSocket connections.
+
+    Each connection gets a bounded outbound queue drained by its own writer task, so a
+    broadcast never waits on a slow peer. Sends that exceed SEND_TIMEOUT or fail evict
+    the peer; a peer that falls behind loses its oldest queued messages. A message's
+    `on_sent` callback runs once the writer has actually sent it.
+    """
+    def __init__(self, send_timeout=SEND_TIMEOUT, queue_size=OUTBOUND_QUEUE_SIZE):
         self.active_connections: list[WebSocket] = []
+        self.send_timeout = send_timeout
+        self.queue_size = queue_size
+        self._connections: dict[WebSocket, _Connection] = {}
+        self.evicted = 0
 
     async def connect(self, websocket: WebSocket):
         """Accepts a WebSocket connection."""
         await websocket.accept()
+        self.register(websocket)
+
+    def register(self, websocket: WebSocket):
+        """Tracks an already accepted WebSocket connection and starts its writer."""
+        connection = _Connection(websocket, self.queue_size)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self._connections[websocket] = connection
         self.active_connections.append(websocket)
 
     def disconnect(self, websocket: WebSocket):
         """Removes a WebSocket connection."""
-        self.active_connections.remove(websocket)
+        connection = self._connections.pop(websocket, None)
+        if connection is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+
+    async def send_personal_message(self, message: str, websocket: WebSocket, coalesce_key=None, on_sent=None):
+        """Queues a message for a specific WebSocket connection.
+
+        A socket that isn't registered (never connected, or just evicted) gets nothing: sending
+        to it inline could block the caller on a stuck peer.
+        """
+        connection = self._connections.get(websocket)
+        if connection is None:
+            log.debug("websocket_manager: dropping message for an unregistered socket")
+            return
+        self._enqueue(connection, message, coalesce_key, on_sent)
+
+    def when_sent(self, websocket: WebSocket, callback):
+        """Calls `callback` once everything queued for the connection so far has been sent."""
+        connection = self._connections.get(websocket)
+        if connection is not None:
+            self._enqueue(connection, None, None, callback)
+
+    async def broadcast(self, message: str, coalesce_key=None):
+        """Queues a message for every active connection without waiting on any of them.
+
+        Messages with a `coalesce_key` aren't queued twice for a peer that hasn't sent the
+        previous one yet (e.g. a status that only matters in its latest form).
+        """
+        for connection in list(self._connections.values()):
+            self._enqueue(connection, message, coalesce_key)
+
+    def stats(self):
+        """Per-connection queue depth, lag and counters."""
+        return {
+            "connections": len(self._connections),
+            "evicted": self.evicted,
+            "peers": [
+                {
+                    "client": f"{c.websocket.client.host}:{c.websocket.client.port}" if c.websocket.client else None,
+                    "queue_depth": len(c.queue),
+                    "lag_ms": round(c.lag() * 1000, 1),
+                    "sent": c.sent,
+                    "dropped": c.dropped,
+                }
+                for c in self._connections.values()
+            ],
+        }
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        """Sends a message to a specific WebSocket connection."""
-        await websocket.send_text(message)
+    def _enqueue(self, connection: _Connection, message, coalesce_key, on_sent=None):
+        if coalesce_key is not None and coalesce_key in connection.pending_keys:
+            return
+        if len(connection.queue) >= connection.maxsize:
+            # The peer is falling behind: drop its oldest message rather than block everyone
+            _, dropped_key, _, _ = connection.queue.popleft()
+            connection.pending_keys.discard(dropped_key)
+            connection.dropped += 1
+        connection.queue.append((time.monotonic(), coalesce_key, message, on_sent))
+        if coalesce_key is not None:
+            connection.pending_keys.add(coalesce_key)
+        connection.ready.set()
 
-    async def broadcast(self, message: str):
-        """Broadcasts a message to all active WebSocket connections."""
-        for connection in self.active_connections:
-            await connection.send_text(message)
\ No newline at end of file
+    async def _write(self, connection: _Connection):
+        websocket = connection.websocket
+        try:
+            while True:
+                if not connection.queue:
+                    connection.ready.clear()
+                    await connection.ready.wait()
+                    continue
+                _, coalesce_key, message, on_sent = connection.queue.popleft()
+                connection.pending_keys.discard(coalesce_key)
+                if message is not None:  # None is a when_sent marker
+                    await asyncio.wait_for(websocket.send_text(message), timeout=self.send_timeout)
+                    connection.sent += 1
+                if on_sent is not None:
+                    on_sent()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Timed out or the peer is gone: evict it so it can't hold anything up
+            log.warning("websocket_manager: evicting peer after send failure: %r", e)
+            self.evicted += 1
+            self.disconnect(websocket)
+            try:
+                await websocket.close(code=1011)
+            except Exception:
+                pass
@@ -0,0 +1,112 @@
+# Keeps faster-whisper models resident so each fragment doesn't reload weights from disk.
+import os
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from faster_whisper import WhisperModel
+
+DEFAULT_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "base")
+DEFAULT_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+DEFAULT_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
+DEFAULT_POOL_SIZE = int(os.getenv("WHISPER_POOL_SIZE", "1"))
+DEFAULT_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", "0"))  # 0 = split the cores across the pool
+DEFAULT_NUM_WORKERS = int(os.getenv("WHISPER_NUM_WORKERS", "1"))
+
+log = logging.getLogger(__name__)
+
+# Registry of pools keyed by (model_size, compute_type, device)
+_pools: dict[tuple[str, str, str], "WhisperModelPool"] = {}
+_pools_lock = threading.Lock()
+
+
+class WhisperModelPool:
+    """Bounded pool of identical WhisperModel instances.
+
+    Instances are created on demand up to `size` and handed out one caller at a
+    time, so several sessions can transcribe in parallel without sharing a model.
+    """
+    def __init__(self, model_size, compute_type, device, size=1, cpu_threads=0, num_workers=1):
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.device = device
+        self.size = max(1, size)
+        self.num_workers = max(1, num_workers)
+        if cpu_threads <= 0:
+            # Give each instance an equal share of the cores instead of letting them oversubscribe
+            cpu_threads = max(1, (os.cpu_count() or 1) // self.size)
+        self.cpu_threads = cpu_threads
+        self._idle: queue.Queue[WhisperModel] = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _load(self) -> WhisperModel:
+        log.info("whisper_models: loading %s/%s/%s (cpu_threads=%s, num_workers=%s)",
+                 self.model_size, self.compute_type, self.device, self.cpu_threads, self.num_workers)
+        return WhisperModel(
+            self.model_size,
+            device=self.device,
+            compute_type=self.compute_type,
+            cpu_threads=self.cpu_threads,
+            num_workers=self.num_workers,
+        )
+
+    def warm(self, count=1):
+        """Loads up to `count` instances ahead of the first request."""
+        while True:
+            with self._lock:
+                if self._created >= min(count, self.size):
+                    return
+                self._created += 1
+            self._idle.put(self._load())
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Borrows a model, loading a new instance if the pool isn't full yet."""
+        model = None
+        try:
+            model = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._created < self.size
+                if grow:
+                    self._created += 1
+            if grow:
+                try:
+                    model = self._load()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                model = self._idle.get(timeout=timeout)
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+
+
+def get_model_pool(model_size=None, compute_type=None, device=None,
+                   pool_size=None, cpu_threads=None, num_workers=None) -> WhisperModelPool:
+    """Returns the resident pool for a (size, compute_type, device) combination, creating it once."""
+    key = (model_size or DEFAULT_MODEL_SIZE,
+           compute_type or DEFAULT_COMPUTE_TYPE,
+           device or DEFAULT_DEVICE)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = WhisperModelPool(
+                *key,
+                size=DEFAULT_POOL_SIZE if pool_size is None else pool_size,
+                cpu_threads=DEFAULT_CPU_THREADS if cpu_threads is None else cpu_threads,
+                num_workers=DEFAULT_NUM_WORKERS if num_workers is None else num_workers,
+            )
+            _pools[key] = pool
+    return pool
+
+
+def preload_models(model_size=None, compute_type=None, device=None, count=1):
+    """Loads the default model at startup so the first fragment doesn't pay for it."""
+    pool = get_model_pool(model_size, compute_type, device)
+    pool.warm(count)
+    return pool